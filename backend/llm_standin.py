@@ -0,0 +1,185 @@
+"""
+Local LLM Stand-in
+
+OpenAI-compatible chat completions server for tests and load benchmarks of
+the knowledge endpoints, with no network access or API key. Latency, token
+rate, failure rate and a concurrency limit (answered with 429) are
+configurable, so time spent in our own code can be measured separately from
+the provider's.
+
+Run:
+    python llm_standin.py --port 5010 --latency-ms 300 --tokens-per-second 50
+
+and point the backend at it:
+    LLM_API_BASE=http://localhost:5010/v1
+    LLM_PROVIDER=openai_compatible   # or litellm
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+# Time before the first token (ms), generation speed (0 = instant) and answer length
+STANDIN_LATENCY_MS = float(os.environ.get('STANDIN_LATENCY_MS', 300))
+STANDIN_TOKENS_PER_SECOND = float(os.environ.get('STANDIN_TOKENS_PER_SECOND', 50))
+STANDIN_COMPLETION_TOKENS = int(os.environ.get('STANDIN_COMPLETION_TOKENS', 120))
+
+# Per-model overrides of the first-token latency, e.g. "gpt-4o=3000,gpt-4o-mini=200"
+STANDIN_MODEL_LATENCY_MS = os.environ.get('STANDIN_MODEL_LATENCY_MS', '')
+
+# Fraction of requests answered with HTTP 503, to exercise retries
+STANDIN_FAILURE_RATE = float(os.environ.get('STANDIN_FAILURE_RATE', 0))
+
+# Requests in flight above this are answered with HTTP 429 (0 = unlimited)
+STANDIN_MAX_CONCURRENCY = int(os.environ.get('STANDIN_MAX_CONCURRENCY', 0))
+STANDIN_RETRY_AFTER = 1
+
+in_flight = 0
+
+FILLER = (
+    "The molecule contains an aromatic ring and polar functional groups that determine its "
+    "solubility, hydrogen bonding and reactivity. Its properties follow from the structure "
+    "described by the SMILES string and should be verified against experimental data."
+).split()
+
+app = FastAPI(title="LLM Stand-in")
+
+
+class ChatCompletionRequest(BaseModel):
+    model: str = "standin"
+    messages: List[Dict]
+    stream: bool = False
+    max_tokens: Optional[int] = None
+
+
+def completion_tokens(request: ChatCompletionRequest) -> List[str]:
+    """Deterministic answer: echo the start of the question, then filler words"""
+    question = next((m.get("content") or "" for m in reversed(request.messages) if m.get("role") == "user"), "")
+    words = ["Stand-in", "answer", "to:"] + question.split()[:20] + ["-"]
+    limit = request.max_tokens or STANDIN_COMPLETION_TOKENS
+    while len(words) < limit:
+        words.extend(FILLER)
+    return [w + " " for w in words[:limit]]
+
+
+def first_token_latency(model: str) -> float:
+    """Seconds before the first token for ``model``"""
+    for entry in STANDIN_MODEL_LATENCY_MS.split(","):
+        name, _, latency = entry.partition("=")
+        if name.strip() == model and latency:
+            return float(latency) / 1000
+    return STANDIN_LATENCY_MS / 1000
+
+
+def usage(request: ChatCompletionRequest, num_tokens: int) -> Dict:
+    prompt_tokens = sum(len((m.get("content") or "").split()) for m in request.messages)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": num_tokens,
+        "total_tokens": prompt_tokens + num_tokens,
+    }
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.get("/v1/models")
+async def list_models():
+    return {"object": "list", "data": [{"id": "standin", "object": "model", "owned_by": "local"}]}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: ChatCompletionRequest):
+    global in_flight
+    if STANDIN_FAILURE_RATE and random.random() < STANDIN_FAILURE_RATE:
+        raise HTTPException(status_code=503, detail="Stand-in simulated overload")
+    if STANDIN_MAX_CONCURRENCY and in_flight >= STANDIN_MAX_CONCURRENCY:
+        raise HTTPException(
+            status_code=429,
+            detail="Stand-in rate limit exceeded",
+            headers={"Retry-After": str(STANDIN_RETRY_AFTER)},
+        )
+
+    tokens = completion_tokens(request)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+    created = int(time.time())
+    delay = 1.0 / STANDIN_TOKENS_PER_SECOND if STANDIN_TOKENS_PER_SECOND > 0 else 0.0
+
+    if not request.stream:
+        in_flight += 1
+        try:
+            await asyncio.sleep(first_token_latency(request.model) + delay * len(tokens))
+        finally:
+            in_flight -= 1
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": request.model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(tokens).strip()},
+                "finish_reason": "stop",
+            }],
+            "usage": usage(request, len(tokens)),
+        }
+
+    def chunk(delta: Dict, finish_reason: Optional[str] = None) -> str:
+        return "data: " + json.dumps({
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": request.model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }) + "\n\n"
+
+    async def stream():
+        global in_flight
+        in_flight += 1
+        try:
+            await asyncio.sleep(first_token_latency(request.model))
+            yield chunk({"role": "assistant", "content": ""})
+            for token in tokens:
+                yield chunk({"content": token})
+                if delay:
+                    await asyncio.sleep(delay)
+            yield chunk({}, finish_reason="stop")
+            yield "data: [DONE]\n\n"
+        finally:
+            in_flight -= 1
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="OpenAI-compatible LLM stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5010)
+    parser.add_argument("--latency-ms", type=float, default=STANDIN_LATENCY_MS)
+    parser.add_argument("--tokens-per-second", type=float, default=STANDIN_TOKENS_PER_SECOND)
+    parser.add_argument("--completion-tokens", type=int, default=STANDIN_COMPLETION_TOKENS)
+    parser.add_argument("--model-latency", default=STANDIN_MODEL_LATENCY_MS, help='e.g. "gpt-4o=3000,gpt-4o-mini=200"')
+    parser.add_argument("--failure-rate", type=float, default=STANDIN_FAILURE_RATE)
+    parser.add_argument("--max-concurrency", type=int, default=STANDIN_MAX_CONCURRENCY)
+    args = parser.parse_args()
+
+    STANDIN_LATENCY_MS = args.latency_ms
+    STANDIN_TOKENS_PER_SECOND = args.tokens_per_second
+    STANDIN_COMPLETION_TOKENS = args.completion_tokens
+    STANDIN_MODEL_LATENCY_MS = args.model_latency
+    STANDIN_FAILURE_RATE = args.failure_rate
+    STANDIN_MAX_CONCURRENCY = args.max_concurrency
+    uvicorn.run(app, host=args.host, port=args.port)
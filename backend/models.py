@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from typing import Dict, List, Optional
 from datetime import datetime, timezone
 import uuid
 
@@ -25,10 +25,43 @@ class GenerationRecord(BaseModel):
     experiment_id: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: Optional[datetime] = None
+    parent_id: Optional[str] = None # Record this one was regenerated from
+    root_id: Optional[str] = None # First version of the regeneration tree (None: this record)
 
 class GenerationHistoryResponse(BaseModel):
     history: List[GenerationRecord]
 
+# Regeneration lineage
+class LineageVersion(GenerationRecord):
+    created_at: Optional[datetime] = None # None if missing or unreadable in the stored record
+    depth: int # Regenerations below the root (root: 0)
+
+class GenerationLineage(BaseModel):
+    record_id: str
+    root_id: str
+    truncated: bool # Versions deeper than the depth limit were left out
+    versions: List[LineageVersion] # Root first, then by depth and creation time
+    comparison: Dict[str, List[Optional[SingleModelResult]]] # Per model, its result in each version
+
+# Per-model analytics
+class LatencyBucket(BaseModel):
+    le: Optional[float] = None # Upper bound in seconds; None for the last, open bucket
+    count: int
+
+class ModelStats(BaseModel):
+    model_name: str
+    experiment_id: Optional[str] = None # None: all generations
+    count: int
+    valid_count: int
+    validity_rate: float
+    avg_confidence: float
+    avg_execution_time: float
+    min_execution_time: float
+    max_execution_time: float
+    latency_percentiles: Dict[str, float] # p50, p90, p95, p99 (seconds, from the histogram)
+    latency_histogram: List[LatencyBucket]
+    last_generated_at: Optional[datetime] = None
+
 # New Experiment Models
 class ExperimentCreate(BaseModel):
     name: str
@@ -42,4 +75,4 @@ class Experiment(BaseModel):
     description: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-    run_count: int = 0 # Computed field
+    run_count: int = 0 # Denormalized; $inc on each run, reconciled from generation_history
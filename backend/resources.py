@@ -0,0 +1,137 @@
+"""
+Application Resources
+
+Long-lived resources shared by the requests of one worker process: the Mongo
+client, the compute process pool, the model API connection pool, the LLM
+provider and the router, chat sessions and mol2text generator built on it,
+the retrieval index, the caches and the generation store. `open_resources` creates them
+when the worker starts (in the app's lifespan, not at import, so every
+uvicorn worker gets its own connections and nothing is inherited across a
+fork) and `Resources.close` releases them in reverse order when it stops.
+
+Routes get them through FastAPI dependencies (`get_db`, `get_resources`)
+and pass them on to the services they call, instead of importing module
+globals; the services' `get_*` functions are only the factories used here.
+"""
+
+import asyncio
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Coroutine, Set
+
+import aiohttp
+from fastapi import Request
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+
+from services.compute_pool import get_process_pool, shutdown_process_pool
+from services.docking_cache import DockingCache, get_docking_cache
+from services.generation_store import GenerationStore, get_generation_store
+from services.llm_providers import LLMProvider, close_llm_provider, get_llm_provider
+from services.llm_service import ChatSessionStore, ModelRouter, MoleculeToTextGenerator
+from services.model_clients import close_http_session, get_http_session
+from services.mol2text_cache import Mol2TextCache, get_mol2text_cache
+from services.retrieval_index import RetrievalIndex, get_retrieval_index, save_retrieval_index
+
+logger = logging.getLogger(__name__)
+
+# Mongo connection pool, per worker process
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 50))
+# Connections kept open while idle, so bursts skip the TCP/TLS handshake
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 5))
+MONGO_MAX_IDLE_TIME_MS = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', 300000))
+# Fail requests fast (instead of the 30s driver default) when Mongo is unreachable
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+# Longest a request waits for a free connection when the pool is exhausted
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 10000))
+
+
+def create_mongo_client() -> AsyncIOMotorClient:
+    # Timestamps are stored as BSON dates (UTC); read them back as aware datetimes
+    return AsyncIOMotorClient(
+        os.environ['MONGO_URL'],
+        tz_aware=True,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    )
+
+
+@dataclass
+class Resources:
+    """Everything one worker process shares between requests"""
+    mongo_client: AsyncIOMotorClient
+    db: AsyncIOMotorDatabase
+    process_pool: ProcessPoolExecutor
+    http_session: aiohttp.ClientSession
+    llm_provider: LLMProvider
+    model_router: ModelRouter
+    chat_sessions: ChatSessionStore
+    mol2text_generator: MoleculeToTextGenerator
+    retrieval_index: RetrievalIndex
+    docking_cache: DockingCache
+    mol2text_cache: Mol2TextCache
+    generation_store: GenerationStore
+    # Background tasks (kept referenced so they are not garbage collected)
+    tasks: Set[asyncio.Task] = field(default_factory=set)
+
+    def spawn(self, coro: Coroutine) -> asyncio.Task:
+        """Run ``coro`` in the background until it finishes or the app stops"""
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def close(self) -> None:
+        """Release everything, in reverse order of creation"""
+        for task in list(self.tasks):
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+        # Queued generation records need Mongo, so they go before the client
+        await self.generation_store.stop()
+        await asyncio.to_thread(save_retrieval_index, self.retrieval_index)
+        await close_llm_provider()
+        await close_http_session()
+        shutdown_process_pool()
+        self.mongo_client.close()
+        logger.info("Closed application resources")
+
+
+async def open_resources() -> Resources:
+    """Create the worker's resources (called at startup)"""
+    mongo_client = create_mongo_client()
+    llm_provider = get_llm_provider()
+    model_router = ModelRouter(llm_provider)
+    resources = Resources(
+        mongo_client=mongo_client,
+        db=mongo_client[os.environ['DB_NAME']],
+        process_pool=get_process_pool(),
+        http_session=get_http_session(),
+        llm_provider=llm_provider,
+        model_router=model_router,
+        chat_sessions=ChatSessionStore(model_router),
+        mol2text_generator=MoleculeToTextGenerator(model_router),
+        # The persisted copy (the database backfill runs in the background)
+        retrieval_index=await asyncio.to_thread(get_retrieval_index),
+        docking_cache=get_docking_cache(),
+        mol2text_cache=get_mol2text_cache(),
+        generation_store=get_generation_store(),
+    )
+    # No-op unless GENERATION_WRITE_MODE=write_behind
+    resources.generation_store.start(resources.db)
+    logger.info(f"Opened application resources (Mongo pool {MONGO_MIN_POOL_SIZE}-{MONGO_MAX_POOL_SIZE})")
+    return resources
+
+
+# ============ Dependencies ============
+
+def get_resources(request: Request) -> Resources:
+    return request.app.state.resources
+
+
+def get_db(request: Request) -> AsyncIOMotorDatabase:
+    return request.app.state.resources.db
@@ -1,64 +1,113 @@
-from fastapi import APIRouter, HTTPException, Depends, Body
-from typing import List
+from fastapi import APIRouter, HTTPException, Depends, Body, Query, Response
+from typing import List, Optional
 from motor.motor_asyncio import AsyncIOMotorDatabase
 import os
-from datetime import datetime, timezone
-from models import Experiment, ExperimentCreate, GenerationRecord, MoleculeGenerationRequest
+from datetime import datetime
+import logging
+from resources import get_db, get_resources
+from models import Experiment, ExperimentCreate, GenerationRecord, ModelStats, MoleculeGenerationRequest
 from services.molecule_service import generate_molecules
+from services.retrieval_index import generation_document, index_document
+from services.model_stats import get_model_stats
+from services.experiment_runs import reconcile_run_counts
+from routes.molecule_routes import MAX_PAGE_SIZE, export_generation_history, generation_filter, generation_history_page
 
-router = APIRouter(prefix="/experiments", tags=["experiments"])
+logger = logging.getLogger(__name__)
 
-def get_db():
-    from server import db
-    return db
+router = APIRouter(prefix="/experiments", tags=["experiments"])
 
 @router.post("/", response_model=Experiment)
 async def create_experiment(experiment: ExperimentCreate, db=Depends(get_db)):
     exp_obj = Experiment(**experiment.model_dump())
     doc = exp_obj.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    doc['updated_at'] = doc['updated_at'].isoformat()
-    
     await db.experiments.insert_one(doc)
     return exp_obj
 
 @router.get("/", response_model=List[Experiment])
 async def list_experiments(db=Depends(get_db)):
+    # run_count is maintained on the experiment document, so this is one query
     cursor = db.experiments.find({}, {"_id": 0}).sort("updated_at", -1)
     experiments = await cursor.to_list(length=100)
-    
-    # Enrich with run counts (optional optimization: store count in experiment doc)
-    for exp in experiments:
-        count = await db.generation_history.count_documents({"experiment_id": exp['id']})
-        exp['run_count'] = count
-        
     return experiments
 
 @router.get("/{experiment_id}", response_model=Experiment)
-async def get_experiment(experiment_id: str, db=Depends(get_db)):
+async def get_experiment(experiment_id: str, db=Depends(get_db), resources=Depends(get_resources)):
+    # Queued runs are counted in run_count once written
+    await resources.generation_store.ensure_written(experiment_id=experiment_id)
     exp = await db.experiments.find_one({"id": experiment_id}, {"_id": 0})
     if not exp:
         raise HTTPException(status_code=404, detail="Experiment not found")
-    
-    # Get run count
-    exp['run_count'] = await db.generation_history.count_documents({"experiment_id": experiment_id})
     return exp
 
+@router.post("/reconcile-run-counts")
+async def reconcile_experiment_run_counts(db=Depends(get_db)):
+    """Recompute run counts from generation history (repairs any drift)"""
+    corrected = await reconcile_run_counts(db)
+    return {"corrected": corrected}
+
 @router.get("/{experiment_id}/runs", response_model=List[GenerationRecord])
-async def get_experiment_runs(experiment_id: str, db=Depends(get_db)):
-    cursor = db.generation_history.find({"experiment_id": experiment_id}, {"_id": 0}).sort("created_at", -1)
-    runs = await cursor.to_list(length=200)
-    return runs
+async def get_experiment_runs(
+    experiment_id: str,
+    response: Response,
+    limit: int = Query(200, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    model: Optional[str] = None,
+    valid: Optional[bool] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    db=Depends(get_db),
+    resources=Depends(get_resources)
+):
+    """Runs of an experiment, newest first; paged and filtered like /molecules/history"""
+    await resources.generation_store.ensure_written(experiment_id=experiment_id)
+    return await generation_history_page(
+        db, response, {"experiment_id": experiment_id}, limit, cursor, fields, model, valid, created_after, created_before
+    )
+
+@router.get("/{experiment_id}/export")
+async def export_experiment_runs(
+    experiment_id: str,
+    format: str = Query("ndjson", pattern="^(ndjson|csv|parquet)$"),
+    model: Optional[str] = None,
+    valid: Optional[bool] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    db=Depends(get_db),
+    resources=Depends(get_resources)
+):
+    """Download all runs of an experiment (see /molecules/history/export)"""
+    await resources.generation_store.ensure_written(experiment_id=experiment_id)
+    exp = await db.experiments.find_one({"id": experiment_id}, {"_id": 0, "id": 1})
+    if not exp:
+        raise HTTPException(status_code=404, detail="Experiment not found")
+    
+    query = generation_filter({"experiment_id": experiment_id}, model, valid, created_after, created_before)
+    return export_generation_history(db, query, format, model, f"experiment_{experiment_id}")
+
+@router.get("/{experiment_id}/analytics/models", response_model=List[ModelStats])
+async def get_experiment_model_analytics(experiment_id: str, db=Depends(get_db), resources=Depends(get_resources)):
+    """Per-model statistics for the experiment's runs (see /molecules/analytics/models)"""
+    await resources.generation_store.ensure_written(experiment_id=experiment_id)
+    exp = await db.experiments.find_one({"id": experiment_id}, {"_id": 0, "id": 1})
+    if not exp:
+        raise HTTPException(status_code=404, detail="Experiment not found")
+    return await get_model_stats(db, experiment_id)
 
 @router.post("/{experiment_id}/generate", response_model=GenerationRecord)
-async def generate_in_experiment(experiment_id: str, request: MoleculeGenerationRequest, db=Depends(get_db)):
+async def generate_in_experiment(
+    experiment_id: str,
+    request: MoleculeGenerationRequest,
+    db=Depends(get_db),
+    resources=Depends(get_resources)
+):
     # Verify experiment exists
     exp = await db.experiments.find_one({"id": experiment_id})
     if not exp:
         raise HTTPException(status_code=404, detail="Experiment not found")
 
     try:
-        results = await generate_molecules(request.prompt, request.models)
+        results = await generate_molecules(resources.http_session, request.prompt, request.models)
         
         record = GenerationRecord(
             prompt=request.prompt,
@@ -66,16 +115,10 @@ async def generate_in_experiment(experiment_id: str, request: MoleculeGeneration
             experiment_id=experiment_id
         )
         
+        # Also updates the experiment's timestamp and run count
         doc = record.model_dump()
-        doc['created_at'] = doc['created_at'].isoformat()
-        
-        await db.generation_history.insert_one(doc)
-        
-        # Update experiment timestamp
-        await db.experiments.update_one(
-            {"id": experiment_id},
-            {"$set": {"updated_at": datetime.now(timezone.utc).isoformat()}}
-        )
+        await resources.generation_store.save(db, doc, experiment_id=experiment_id)
+        await index_document(resources.retrieval_index, *generation_document(doc), source="generation_history")
         
         return record
     except Exception as e:
@@ -6,20 +6,26 @@ Integrates with OpenAI GPT-4o for:
 2. Molecule-to-Text generation (describe molecules in natural language)
 """
 
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Depends, Query, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+import asyncio
+import json
+import logging
 import uuid
 
-from services.llm_service import get_chat_session, get_mol2text_generator
+from resources import get_db, get_resources
+from services.llm_service import CHAT_SESSION_TITLE_LENGTH, MOL2TEXT_BATCH_CONCURRENCY, MOL2TEXT_MODEL, MoleculeKnowledgeChat
+from services.mol2text_cache import canonical_molecule_key
+from services.retrieval_index import RetrievalIndex, index_document, mol2text_document
+from services.pagination import date_range_filter, fetch_page, page_response, projection
 
-router = APIRouter(prefix="/knowledge", tags=["knowledge"])
+logger = logging.getLogger(__name__)
 
-def get_db():
-    from server import db
-    return db
+router = APIRouter(prefix="/knowledge", tags=["knowledge"])
 
 
 # ============ Request/Response Models ============
@@ -32,17 +38,32 @@ class ChatRequest(BaseModel):
 class ChatResponse(BaseModel):
     answer: str
     session_id: str
-    sources: List[str] = []
+    model: Optional[str] = None  # Model that answered (a fallback if the router fell back)
+    sources: List[str] = []  # Titles of the retrieved passages
 
 class Mol2TextRequest(BaseModel):
     smiles: str
     additional_info: Optional[str] = None
+    force_refresh: bool = False  # Regenerate even if a cached description exists
 
 class Mol2TextResponse(BaseModel):
     smiles: str
     description: str
     success: bool
     error: Optional[str] = None
+    cached: bool = False
+    model: Optional[str] = None  # Model that wrote the description
+
+class Mol2TextPrewarmRequest(BaseModel):
+    smiles: List[str]
+    additional_info: Optional[str] = None
+    force_refresh: bool = False
+
+class Mol2TextBatchRequest(BaseModel):
+    smiles: List[str]
+    additional_info: Optional[str] = None
+    force_refresh: bool = False
+    max_concurrency: Optional[int] = None  # Defaults to MOL2TEXT_BATCH_CONCURRENCY
 
 class ChatMessage(BaseModel):
     id: str
@@ -51,11 +72,79 @@ class ChatMessage(BaseModel):
     content: str
     created_at: datetime
 
+class ChatSessionSummary(BaseModel):
+    session_id: str
+    title: str  # First question of the session
+    message_count: int
+    first_message_at: datetime
+    last_message_at: datetime
+
 
 # ============ Chat Endpoints ============
 
+def retrieve_context(index: RetrievalIndex, query: str, context: Optional[str]) -> tuple:
+    """
+    Add the best matching knowledge base passages to the user's context.
+    Returns (context, sources) where sources are the titles of the passages used.
+    """
+    passages = index.search(query)
+    sources = []
+    for passage in passages:
+        if passage['title'] not in sources:
+            sources.append(passage['title'])
+    if passages:
+        retrieved = "\n\n".join(f"[{i + 1}] {p['title']}\n{p['text']}" for i, p in enumerate(passages))
+        context = f"{context}\n\n{retrieved}" if context else retrieved
+    return context, sources
+
+
+async def save_chat_turn(db, chat: MoleculeKnowledgeChat, question: str, answer: str):
+    """Store a user question and the assistant's answer in chat_history"""
+    session_id = chat.session_id
+    user_msg = ChatMessage(
+        id=str(uuid.uuid4()),
+        session_id=session_id,
+        role='user',
+        content=question,
+        created_at=datetime.now(timezone.utc)
+    )
+    assistant_msg = ChatMessage(
+        id=str(uuid.uuid4()),
+        session_id=session_id,
+        role='assistant',
+        content=answer,
+        # Dates are stored to the millisecond: keep the answer strictly after
+        # the question so the pair replays in order
+        created_at=max(datetime.now(timezone.utc), user_msg.created_at + timedelta(milliseconds=1))
+    )
+    
+    await db.chat_history.insert_many([user_msg.model_dump(), assistant_msg.model_dump()])
+    
+    # Keep the session summary in step with its history, along with the
+    # chat's running context summary so a rehydrated session keeps it
+    latest = {"last_message_at": assistant_msg.created_at}
+    if chat.summary:
+        latest.update(context_summary=chat.summary, history_offset=chat.history_offset)
+    await db.chat_sessions.update_one(
+        {"session_id": session_id},
+        {
+            "$inc": {"message_count": 2},
+            "$set": latest,
+            "$setOnInsert": {
+                "title": question[:CHAT_SESSION_TITLE_LENGTH],
+                "first_message_at": user_msg.created_at
+            }
+        },
+        upsert=True
+    )
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
 @router.post("/chat", response_model=ChatResponse)
-async def chat_with_knowledge_base(request: ChatRequest, db=Depends(get_db)):
+async def chat_with_knowledge_base(request: ChatRequest, db=Depends(get_db), resources=Depends(get_resources)):
     """
     Chat with the AI chemistry assistant.
     Uses OpenAI GPT-4o with chemistry expertise.
@@ -65,38 +154,21 @@ async def chat_with_knowledge_base(request: ChatRequest, db=Depends(get_db)):
     
     try:
         # Get chat session
-        chat = get_chat_session(session_id)
+        chat = await resources.chat_sessions.get(db, session_id)
         
-        # Send message and get response
-        result = await chat.ask(request.query, context=request.context)
+        # Retrieve supporting passages, then send message and get response
+        context, sources = retrieve_context(resources.retrieval_index, request.query, request.context)
+        result = await chat.ask(request.query, context=context)
         
         if result['success']:
             # Save chat history to database
-            user_msg = ChatMessage(
-                id=str(uuid.uuid4()),
-                session_id=session_id,
-                role='user',
-                content=request.query,
-                created_at=datetime.now(timezone.utc)
-            )
-            assistant_msg = ChatMessage(
-                id=str(uuid.uuid4()),
-                session_id=session_id,
-                role='assistant',
-                content=result['answer'],
-                created_at=datetime.now(timezone.utc)
-            )
-            
-            # Store in DB
-            await db.chat_history.insert_many([
-                {**user_msg.model_dump(), 'created_at': user_msg.created_at.isoformat()},
-                {**assistant_msg.model_dump(), 'created_at': assistant_msg.created_at.isoformat()}
-            ])
+            await save_chat_turn(db, chat, request.query, result['answer'])
             
             return ChatResponse(
                 answer=result['answer'],
                 session_id=session_id,
-                sources=["OpenAI GPT-4o", "Chemistry Knowledge Base"]
+                model=result['model'],
+                sources=sources
             )
         else:
             raise HTTPException(status_code=500, detail=result.get('error', 'Chat failed'))
@@ -105,56 +177,195 @@ async def chat_with_knowledge_base(request: ChatRequest, db=Depends(get_db)):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/chat/stream")
+async def chat_with_knowledge_base_stream(request: ChatRequest, db=Depends(get_db), resources=Depends(get_resources)):
+    """
+    Chat with the AI chemistry assistant, streaming the answer as
+    Server-Sent Events.
+
+    Events: "session" (session id), "token" (answer text as generated),
+    "done" (the model that answered and the sources) or "error". The answer is saved to chat history once the
+    stream ends, including the partial answer if the client disconnects.
+    """
+    session_id = request.session_id or str(uuid.uuid4())
+    chat = await resources.chat_sessions.get(db, session_id)
+    context, sources = retrieve_context(resources.retrieval_index, request.query, request.context)
+
+    async def stream():
+        parts = []
+        # This stream's model (the session may be answering another request too)
+        answered_by = []
+        yield sse_event("session", {"session_id": session_id})
+        try:
+            async for token in chat.ask_stream(request.query, context=context, on_route=answered_by.append):
+                parts.append(token)
+                yield sse_event("token", {"content": token})
+            model = answered_by[0] if answered_by else None
+            yield sse_event("done", {"session_id": session_id, "model": model, "sources": sources})
+        except Exception as e:
+            logger.error(f"Chat stream error: {e}")
+            yield sse_event("error", {"detail": str(e)})
+        finally:
+            if parts:
+                # Shielded so a cancelled (disconnected) stream is still recorded
+                await asyncio.shield(save_chat_turn(db, chat, request.query, "".join(parts)))
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+CHAT_MESSAGE_FIELDS = ("id", "session_id", "role", "content", "created_at")
+
 @router.get("/chat/history/{session_id}", response_model=List[ChatMessage])
-async def get_chat_history(session_id: str, db=Depends(get_db)):
-    """Get chat history for a session"""
-    cursor = db.chat_history.find(
-        {"session_id": session_id}, 
-        {"_id": 0}
-    ).sort("created_at", 1)
+async def get_chat_history(
+    session_id: str,
+    response: Response,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    role: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    newest_first: bool = False,
+    db=Depends(get_db)
+):
+    """
+    Get chat history for a session, oldest first (or newest first), in pages.
+    Pass a page's X-Next-Cursor header as ``cursor`` for the next page.
+    """
+    query = {"session_id": session_id, **date_range_filter(created_after, created_before)}
+    if role:
+        query["role"] = role
     
-    messages = await cursor.to_list(length=100)
-    return messages
+    try:
+        fields_projection = projection(fields, CHAT_MESSAGE_FIELDS)
+        messages, next_cursor = await fetch_page(
+            db.chat_history, query, limit, cursor, fields_projection, descending=newest_first
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return page_response(response, messages, next_cursor, projected=fields_projection is not None)
 
 
-@router.get("/chat/sessions")
+@router.get("/chat/sessions", response_model=List[ChatSessionSummary])
 async def list_chat_sessions(db=Depends(get_db)):
-    """List all chat sessions"""
-    pipeline = [
-        {"$group": {
-            "_id": "$session_id",
-            "message_count": {"$sum": 1},
-            "last_message": {"$max": "$created_at"},
-            "first_message": {"$first": "$content"}
-        }},
-        {"$sort": {"last_message": -1}},
-        {"$limit": 50}
-    ]
-    
-    sessions = await db.chat_history.aggregate(pipeline).to_list(length=50)
+    """List the 50 most recently active chat sessions"""
+    cursor = db.chat_sessions.find({}, {"_id": 0}).sort("last_message_at", -1).limit(50)
+    sessions = await cursor.to_list(length=50)
     return sessions
 
 
 # ============ Molecule-to-Text Endpoints ============
 
+# Most molecules accepted by one batch request
+MOL2TEXT_BATCH_MAX = 500
+
+
+async def store_description(resources, key: str, canonical: str, additional_info: Optional[str], result: dict):
+    """Cache a generated description and add it to the retrieval index"""
+    description = result['description']
+    # The cache key names MOL2TEXT_MODEL: a fallback model's answer is served
+    # this once but not cached as that model's description
+    if result['model'] == MOL2TEXT_MODEL:
+        await resources.mol2text_cache.put(resources.db, key, canonical, additional_info, description)
+    else:
+        logger.info(f"Not caching mol2text description for {canonical} from fallback model {result['model']}")
+    await index_document(
+        resources.retrieval_index,
+        *mol2text_document({"key": key, "canonical_smiles": canonical, "description": description}),
+        source="mol2text"
+    )
+
+
+async def describe_molecule(resources, smiles: str, additional_info: Optional[str], force_refresh: bool = False) -> dict:
+    """Description for a molecule, served from the mol2text cache when possible"""
+    cache = resources.mol2text_cache
+    canonical = canonical_molecule_key(smiles)
+    key = cache.make_key(canonical, additional_info)
+
+    description = await cache.get(resources.db, key)
+    if description is not None and not force_refresh:
+        return {'success': True, 'smiles': smiles, 'description': description, 'cached': True, 'model': MOL2TEXT_MODEL}
+
+    result = await resources.mol2text_generator.generate_description(smiles, additional_info)
+    if result['success']:
+        # Only successful generations are cached; failures are retried next time
+        await store_description(resources, key, canonical, additional_info, result)
+    elif description is not None:
+        # Refresh failed on every model: keep serving the previous description
+        logger.warning(f"Mol2Text refresh failed for {smiles}, serving cached description: {result.get('error')}")
+        return {'success': True, 'smiles': smiles, 'description': description, 'cached': True, 'model': MOL2TEXT_MODEL}
+    return result
+
+
+async def describe_molecules(
+    resources,
+    smiles_list: List[str],
+    additional_info: Optional[str],
+    force_refresh: bool = False,
+    max_concurrency: int = MOL2TEXT_BATCH_CONCURRENCY,
+):
+    """
+    Descriptions for many molecules, yielded as (indices, result) as they are
+    ready: cached ones first, then generated ones as the LLM calls complete.
+    Inputs with the same canonical SMILES share one result; ``indices`` are
+    their positions in ``smiles_list``.
+    """
+    cache = resources.mol2text_cache
+
+    # 1. Deduplicate by canonical SMILES
+    unique = {}
+    for i, smiles in enumerate(smiles_list):
+        canonical = canonical_molecule_key(smiles)
+        if canonical not in unique:
+            unique[canonical] = {"smiles": smiles, "key": cache.make_key(canonical, additional_info), "indices": []}
+        unique[canonical]["indices"].append(i)
+
+    # 2. Serve cached descriptions
+    pending = {}
+    for canonical, item in unique.items():
+        description = None if force_refresh else await cache.get(resources.db, item["key"])
+        if description is not None:
+            yield item["indices"], {
+                'success': True, 'smiles': item["smiles"], 'description': description, 'cached': True, 'model': MOL2TEXT_MODEL
+            }
+        else:
+            pending[item["smiles"]] = (canonical, item)
+
+    # 3. Generate the rest within the provider's rate limits
+    generator = resources.mol2text_generator
+    async for result in generator.generate_batch(list(pending), additional_info, max_concurrency=max_concurrency):
+        canonical, item = pending[result['smiles']]
+        if result['success']:
+            await store_description(resources, item["key"], canonical, additional_info, result)
+        yield item["indices"], result
+
+
 @router.post("/mol2text", response_model=Mol2TextResponse)
-async def molecule_to_text(request: Mol2TextRequest):
+async def molecule_to_text(request: Mol2TextRequest, resources=Depends(get_resources)):
     """
     Generate natural language description from SMILES.
-    Uses OpenAI GPT-4o to analyze and describe the molecule.
+    Uses OpenAI GPT-4o to analyze and describe the molecule; repeat requests
+    are served from cache unless force_refresh is set.
     """
     try:
-        generator = get_mol2text_generator()
-        result = await generator.generate_description(
+        result = await describe_molecule(
+            resources,
             request.smiles, 
-            request.additional_info
+            request.additional_info,
+            force_refresh=request.force_refresh
         )
         
         if result['success']:
             return Mol2TextResponse(
                 smiles=request.smiles,
                 description=result['description'],
-                success=True
+                success=True,
+                cached=result.get('cached', False),
+                model=result.get('model')
             )
         else:
             return Mol2TextResponse(
@@ -173,10 +384,106 @@ async def molecule_to_text(request: Mol2TextRequest):
         )
 
 
+@router.post("/mol2text/batch")
+async def molecule_to_text_batch(request: Mol2TextBatchRequest, resources=Depends(get_resources)):
+    """
+    Describe many molecules in one request, streaming results as Server-Sent
+    Events as they complete.
+
+    Events: "result" (a Mol2TextResponse plus the input positions it answers),
+    then "done" with counts, or "error". Duplicate molecules are generated
+    once and cached descriptions are returned without an LLM call.
+    """
+    if not request.smiles:
+        raise HTTPException(status_code=400, detail="No SMILES provided")
+    if len(request.smiles) > MOL2TEXT_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {MOL2TEXT_BATCH_MAX} molecules per batch")
+    max_concurrency = min(request.max_concurrency or MOL2TEXT_BATCH_CONCURRENCY, MOL2TEXT_BATCH_CONCURRENCY)
+
+    async def stream():
+        counts = {"requested": len(request.smiles), "unique": 0, "cached": 0, "generated": 0, "failed": 0}
+        try:
+            async for indices, result in describe_molecules(
+                resources, request.smiles, request.additional_info,
+                force_refresh=request.force_refresh, max_concurrency=max_concurrency
+            ):
+                response = Mol2TextResponse(
+                    smiles=result['smiles'],
+                    description=result.get('description', ""),
+                    success=result['success'],
+                    error=None if result['success'] else result.get('error', 'Generation failed'),
+                    cached=result.get('cached', False),
+                    model=result.get('model')
+                )
+                counts["unique"] += 1
+                if not response.success:
+                    counts["failed"] += 1
+                elif response.cached:
+                    counts["cached"] += 1
+                else:
+                    counts["generated"] += 1
+                yield sse_event("result", {**response.model_dump(), "indices": indices})
+            yield sse_event("done", counts)
+        except Exception as e:
+            logger.error(f"Mol2Text batch error: {e}")
+            yield sse_event("error", {"detail": str(e)})
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/mol2text/prewarm", status_code=202)
+async def prewarm_mol2text_cache(
+    request: Mol2TextPrewarmRequest,
+    background_tasks: BackgroundTasks,
+    db=Depends(get_db),
+    resources=Depends(get_resources)
+):
+    """
+    Generate and cache descriptions for a list of SMILES in the background.
+    Molecules that are already cached are skipped unless force_refresh is set.
+    """
+    cache = resources.mol2text_cache
+    pending, already_cached = [], 0
+    seen = set()
+    for smiles in request.smiles:
+        canonical = canonical_molecule_key(smiles)
+        if canonical in seen:
+            continue
+        seen.add(canonical)
+        key = cache.make_key(canonical, request.additional_info)
+        if not request.force_refresh and await cache.get(db, key) is not None:
+            already_cached += 1
+        else:
+            pending.append(smiles)
+
+    async def prewarm():
+        async for _, result in describe_molecules(resources, pending, request.additional_info, force_refresh=True):
+            if not result['success']:
+                logger.warning(f"Prewarm failed for {result['smiles']}: {result.get('error')}")
+        logger.info(f"Prewarmed mol2text cache with {len(pending)} molecules")
+
+    if pending:
+        background_tasks.add_task(prewarm)
+    return {"requested": len(seen), "already_cached": already_cached, "queued": len(pending)}
+
+
 # ============ Model Info Endpoints ============
 
 @router.get("/models/available")
-async def get_available_models():
+async def get_available_models(resources=Depends(get_resources)):
     """Get list of available Text-to-Molecule models"""
     from services.molecule_service import get_available_models
-    return await get_available_models()
+    return await get_available_models(resources.http_session)
+
+
+@router.get("/models/routing")
+async def get_model_routing(resources=Depends(get_resources)):
+    """
+    LLM routing statistics for this worker: latency percentiles and error
+    rates per endpoint and model, and how often each endpoint fell back.
+    """
+    return resources.model_router.snapshot()
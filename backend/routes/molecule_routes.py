@@ -1,27 +1,90 @@
-from fastapi import APIRouter, HTTPException, Depends, Body
+from fastapi import APIRouter, HTTPException, Depends, Body, Query, Response
+from fastapi.responses import StreamingResponse
 from typing import List, Optional
 from motor.motor_asyncio import AsyncIOMotorDatabase
 import os
 from bson import ObjectId
 from datetime import datetime, timezone
-from models import MoleculeGenerationRequest, GenerationRecord, GenerationHistoryResponse
+from resources import get_db, get_resources
+from models import MoleculeGenerationRequest, GenerationRecord, GenerationHistoryResponse, GenerationLineage, ModelStats
 from services.molecule_service import generate_molecules
+from services.retrieval_index import generation_document, index_document
+from services.pagination import date_range_filter, fetch_page, page_response, projection
+from services.history_export import EXPORT_FORMATS, export_stream, parquet_available
+from services.model_stats import get_model_stats, rebuild_model_stats
+from services.lineage import LINEAGE_MAX_DEPTH, get_lineage, lineage_root_id
 from rdkit import Chem
 from rdkit.Chem import AllChem
 
 router = APIRouter(prefix="/molecules", tags=["molecules"])
 
-def get_db():
-    from server import db
-    return db
+# Largest page a listing endpoint returns
+MAX_PAGE_SIZE = 500
+
+GENERATION_FIELDS = ("id", "prompt", "results", "experiment_id", "created_at", "updated_at", "parent_id", "root_id")
+
+def generation_filter(
+    query: dict,
+    model: Optional[str],
+    valid: Optional[bool],
+    created_after: Optional[datetime],
+    created_before: Optional[datetime],
+) -> dict:
+    """``query`` narrowed to records in the date range with a matching result"""
+    query = {**query, **date_range_filter(created_after, created_before)}
+    
+    # Both conditions must hold for the same result
+    result_filter = {}
+    if model:
+        result_filter["model_name"] = model
+    if valid is not None:
+        result_filter["is_valid"] = valid
+    if result_filter:
+        query["results"] = {"$elemMatch": result_filter}
+    return query
+
+async def generation_history_page(
+    db,
+    response: Response,
+    query: dict,
+    limit: int,
+    cursor: Optional[str],
+    fields: Optional[str],
+    model: Optional[str],
+    valid: Optional[bool],
+    created_after: Optional[datetime],
+    created_before: Optional[datetime],
+):
+    """Newest-first page of generation records matching ``query`` and the filters"""
+    query = generation_filter(query, model, valid, created_after, created_before)
+    
+    try:
+        fields_projection = projection(fields, GENERATION_FIELDS)
+        docs, next_cursor = await fetch_page(db.generation_history, query, limit, cursor, fields_projection)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return page_response(response, docs, next_cursor, projected=fields_projection is not None)
+
+def export_generation_history(db, query: dict, format: str, model: Optional[str], filename: str) -> StreamingResponse:
+    """Stream the matching generation records, oldest first, as a file download"""
+    if format == "parquet" and not parquet_available():
+        raise HTTPException(status_code=501, detail="Parquet export requires pyarrow")
+    
+    media_type, extension = EXPORT_FORMATS[format]
+    cursor = db.generation_history.find(query, {"_id": 0}).sort([("created_at", 1), ("id", 1)])
+    return StreamingResponse(
+        export_stream(cursor, format, model),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{extension}"'}
+    )
 
 @router.post("/generate", response_model=GenerationRecord)
-async def generate_molecule_from_text(request: MoleculeGenerationRequest, db=Depends(get_db)):
+async def generate_molecule_from_text(request: MoleculeGenerationRequest, db=Depends(get_db), resources=Depends(get_resources)):
     if not request.prompt or not request.prompt.strip():
         raise HTTPException(status_code=422, detail="Prompt cannot be empty")
     
     try:
-        results = await generate_molecules(request.prompt, request.models)
+        results = await generate_molecules(resources.http_session, request.prompt, request.models)
         
         record = GenerationRecord(
             prompt=request.prompt,
@@ -30,35 +93,123 @@ async def generate_molecule_from_text(request: MoleculeGenerationRequest, db=Dep
         
         # Save to history
         doc = record.model_dump()
-        doc['created_at'] = doc['created_at'].isoformat()
-        await db.generation_history.insert_one(doc)
+        await resources.generation_store.save(db, doc)
+        await index_document(resources.retrieval_index, *generation_document(doc), source="generation_history")
         
         return record
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/history", response_model=List[GenerationRecord])
-async def get_history(db=Depends(get_db)):
-    cursor = db.generation_history.find({}, {"_id": 0}).sort("created_at", -1).limit(50)
-    history = await cursor.to_list(length=50)
-    return history
+async def get_history(
+    response: Response,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    model: Optional[str] = None,
+    valid: Optional[bool] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    db=Depends(get_db)
+):
+    """
+    Generation history, newest first. Pass a page's X-Next-Cursor header as
+    ``cursor`` for the next page. ``fields`` (comma-separated) limits the
+    returned fields; ``model`` / ``valid`` keep records with a result from that
+    model / with that validity.
+    """
+    return await generation_history_page(
+        db, response, {}, limit, cursor, fields, model, valid, created_after, created_before
+    )
+
+@router.get("/history/export")
+async def export_history(
+    format: str = Query("ndjson", pattern="^(ndjson|csv|parquet)$"),
+    experiment_id: Optional[str] = None,
+    model: Optional[str] = None,
+    valid: Optional[bool] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    db=Depends(get_db)
+):
+    """
+    Download generation history as NDJSON (one record per line), or CSV /
+    Parquet (one row per model result; only ``model``'s results if given).
+    Streams from the database, so any size can be exported.
+    """
+    query = generation_filter(
+        {"experiment_id": experiment_id} if experiment_id else {},
+        model, valid, created_after, created_before
+    )
+    return export_generation_history(db, query, format, model, "generation_history")
+
+@router.get("/analytics/models", response_model=List[ModelStats])
+async def get_model_analytics(experiment_id: Optional[str] = None, db=Depends(get_db)):
+    """
+    Validity rate, confidence and latency percentiles per model, over all
+    generations or one experiment's. Served from maintained aggregates.
+    """
+    return await get_model_stats(db, experiment_id)
+
+@router.post("/analytics/models/rebuild")
+async def rebuild_model_analytics(db=Depends(get_db), resources=Depends(get_resources)):
+    """
+    Recompute the per-model aggregates from generation history. Aggregates
+    updated meanwhile are retried; this worker's own writes wait until it is done.
+    """
+    async with resources.generation_store.paused():
+        models = await rebuild_model_stats(db)
+    return {"models": models}
 
 @router.patch("/history/{record_id}")
-async def update_history_description(record_id: str, prompt: str = Body(..., embed=True), db=Depends(get_db)):
-    # Find and update
+async def update_history_description(
+    record_id: str,
+    prompt: str = Body(..., embed=True),
+    db=Depends(get_db),
+    resources=Depends(get_resources)
+):
+    # Find and update (a record still in the write-behind buffer is written first)
+    await resources.generation_store.ensure_written(record_id=record_id)
     result = await db.generation_history.update_one(
         {"id": record_id},
-        {"$set": {"prompt": prompt, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"prompt": prompt, "updated_at": datetime.now(timezone.utc)}}
     )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Record not found")
+
+    record = await db.generation_history.find_one({"id": record_id}, {"_id": 0})
+    await index_document(resources.retrieval_index, *generation_document(record), source="generation_history")
         
     return {"status": "success", "message": "Description updated"}
 
+@router.get("/history/{record_id}/lineage", response_model=GenerationLineage)
+async def get_record_lineage(
+    record_id: str,
+    max_depth: int = Query(LINEAGE_MAX_DEPTH, ge=1, le=LINEAGE_MAX_DEPTH),
+    db=Depends(get_db),
+    resources=Depends(get_resources)
+):
+    """
+    The whole regeneration tree a record belongs to (its root and every
+    version regenerated from it, down to ``max_depth`` levels), with each
+    model's result per version for side-by-side comparison.
+    """
+    await resources.generation_store.ensure_written(record_id=record_id)
+    lineage = await get_lineage(db, record_id, max_depth)
+    if lineage is None:
+        raise HTTPException(status_code=404, detail="Record not found")
+    return lineage
+
 @router.post("/regenerate/{record_id}", response_model=GenerationRecord)
-async def regenerate_molecule(record_id: str, models: List[str] = Body(..., embed=True), db=Depends(get_db)):
+async def regenerate_molecule(
+    record_id: str,
+    models: List[str] = Body(..., embed=True),
+    db=Depends(get_db),
+    resources=Depends(get_resources)
+):
     # Get original record to retrieve prompt
+    await resources.generation_store.ensure_written(record_id=record_id)
     record = await db.generation_history.find_one({"id": record_id})
     if not record:
         raise HTTPException(status_code=404, detail="Record not found")
@@ -67,19 +218,21 @@ async def regenerate_molecule(record_id: str, models: List[str] = Body(..., embe
     
     try:
         # Generate NEW results
-        results = await generate_molecules(prompt, models)
+        results = await generate_molecules(resources.http_session, prompt, models)
         
-        # Create NEW record (Versioning strategy: New record is safest)
+        # Create NEW record (Versioning strategy: New record is safest),
+        # linked to its parent and the root of the version tree
         new_record = GenerationRecord(
             prompt=prompt,
-            results=results
+            results=results,
+            parent_id=record_id,
+            root_id=await lineage_root_id(db, record)
         )
         
         doc = new_record.model_dump()
-        doc['created_at'] = doc['created_at'].isoformat()
-        doc['parent_id'] = record_id # Link to parent if we want to track versions later
         
-        await db.generation_history.insert_one(doc)
+        await resources.generation_store.save(db, doc)
+        await index_document(resources.retrieval_index, *generation_document(doc), source="generation_history")
         
         return new_record
     except Exception as e:
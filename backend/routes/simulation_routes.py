@@ -1,25 +1,90 @@
-from fastapi import APIRouter, HTTPException, Body
-from pydantic import BaseModel
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Body,
+    Depends,
+    File,
+    Form,
+    Header,
+    HTTPException,
+    Query,
+    UploadFile,
+)
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, Field
 from typing import List, Optional
+from datetime import datetime, timezone
 import asyncio
-import random
-import requests
+import json
+import logging
+import uuid
+import numpy as np
 from rdkit import Chem
-from rdkit.Chem import AllChem
+from resources import get_db, get_resources
+from services.protein_structure import (
+    POCKET_INDEX_RADIUS,
+    delete_structure,
+    fetch_target_pdb,
+    get_protein_structure,
+    parse_pdb,
+    pocket_pdb,
+    read_uploaded_pdb,
+    save_uploaded_pdb,
+    structure_hash,
+)
+from services.compute_pool import run_in_pool
+from services.docking_engine import (
+    DEFAULT_EXHAUSTIVENESS,
+    DEFAULT_NUM_POSES,
+    DEFAULT_TIME_BUDGET,
+    MAX_TIME_BUDGET,
+    SCREENING_EXHAUSTIVENESS,
+    SCREENING_TIME_BUDGET,
+    canonicalize_ligands,
+    dock_ligand,
+    dock_smiles,
+    prepare_ligand,
+    prepare_screening_maps,
+    preprocess_target,
+)
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/simulation", tags=["simulation"])
 
 class DockingRequest(BaseModel):
     ligand_smiles: str
     target_id: str 
+    exhaustiveness: int = Field(DEFAULT_EXHAUSTIVENESS, ge=1, le=32)
+    num_poses: int = Field(DEFAULT_NUM_POSES, ge=1, le=20)
+    time_budget: float = Field(DEFAULT_TIME_BUDGET, gt=0, le=MAX_TIME_BUDGET)  # seconds
+
+class DockingPose(BaseModel):
+    affinity: float
+    ligand_pdb: str
+    score_breakdown: dict
 
 class DockingResult(BaseModel):
     affinity: float 
     ligand_pdb: str 
-    target_pdb: str 
+    target_id: str
+    target_version: str  # Structure hash; fetch the receptor from /simulation/targets/{target_id}
     score_breakdown: dict
+    poses: List[DockingPose] = []  # Top poses, best first
+    cached: bool = False
+
+class ScreeningRequest(BaseModel):
+    target_id: str
+    ligand_smiles: List[str] = []
+    experiment_id: Optional[str] = None  # Screen every valid molecule generated in an experiment
+    exhaustiveness: int = Field(SCREENING_EXHAUSTIVENESS, ge=1, le=32)
+    time_budget: float = Field(SCREENING_TIME_BUDGET, gt=0, le=MAX_TIME_BUDGET)  # seconds per ligand
+
+# Upper bound on unique ligands per screening request
+MAX_SCREENING_LIGANDS = 1000
 
-# Preset Targets with PDB IDs and approx active site centers (x,y,z)
+# Built-in targets with PDB IDs and approx active site centers (x,y,z);
+# user-uploaded targets live in the docking_targets collection
 TARGETS = {
     "covid_protease": {"id": "6LU7", "name": "SARS-CoV-2 Main Protease", "center": (-10.7, 12.4, 68.8)},
     "hiv_protease": {"id": "1HSG", "name": "HIV-1 Protease", "center": (16.0, 26.0, 5.0)},
@@ -34,84 +99,415 @@ ATOM      4  O   ALA A   1       1.272   2.432   0.000  1.00  0.00           O
 ATOM      5  CB  ALA A   1       2.000  -0.767   1.217  1.00  0.00           C  
 """
 
-@router.post("/docking/run", response_model=DockingResult)
-async def run_docking_simulation(request: DockingRequest):
-    # 1. Fetch Target PDB 
-    target_info = TARGETS.get(request.target_id)
-    if not target_info:
+# Results docked against the placeholder are never cached, and it does not
+# count as a new version of the target (which would purge its cached results)
+MOCK_PROTEIN_HASH = structure_hash(MOCK_PROTEIN_PDB)
+
+# Uploaded structures larger than this are rejected (bytes)
+MAX_TARGET_UPLOAD_BYTES = 20 * 1024 * 1024
+
+class TargetInfo(BaseModel):
+    id: str
+    name: str
+    source: str  # "builtin" or "upload"
+    status: str  # "pending", "processing", "ready" or "failed"
+    center: List[float]
+    pdb_id: Optional[str] = None
+    num_atoms: Optional[int] = None
+    num_pocket_atoms: Optional[int] = None
+    structure_hash: Optional[str] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+def builtin_target(target_id: str) -> dict:
+    target_info = TARGETS[target_id]
+    return {
+        "id": target_id,
+        "name": target_info["name"],
+        "source": "builtin",
+        "status": "ready",  # Downloaded and preparsed on first use
+        "center": list(target_info["center"]),
+        "pdb_id": target_info["id"],
+    }
+
+async def resolve_target(db, target_id: str) -> dict:
+    """Registry entry for a built-in or uploaded target"""
+    if target_id in TARGETS:
+        return builtin_target(target_id)
+    target = await db.docking_targets.find_one({"id": target_id}, {"_id": 0})
+    if not target:
         raise HTTPException(status_code=404, detail="Target not found")
-        
-    pdb_id = target_info["id"]
-    target_pdb_data = MOCK_PROTEIN_PDB # Default fallback
-    
+    return target
+
+async def load_target(target_id: str, db):
+    """Resolve a target to its PDB text and preparsed structure"""
+    target = await resolve_target(db, target_id)
+
+    if target["source"] == "builtin":
+        # Cached on disk after the first download; fall back to mock if RCSB fails
+        target_pdb_data = await asyncio.to_thread(fetch_target_pdb, target["pdb_id"])
+        if target_pdb_data is None:
+            logger.warning(f"Using placeholder structure for {target_id}: {target['pdb_id']} could not be fetched")
+            target_pdb_data = MOCK_PROTEIN_PDB
+    else:
+        if target["status"] != "ready":
+            raise HTTPException(status_code=409, detail=f"Target is not ready (status: {target['status']})")
+        target_pdb_data = await asyncio.to_thread(read_uploaded_pdb, target_id)
+        if target_pdb_data is None:
+            raise HTTPException(status_code=404, detail="Target structure file is missing")
+
+    # Parsed once into memory-mapped arrays shared by all workers
+    structure = await asyncio.to_thread(
+        get_protein_structure, target_id, target_pdb_data, target["center"]
+    )
+    return target_pdb_data, structure
+
+def parse_pocket_residues(spec: str) -> List[tuple]:
+    """Parse "A:25,A:27,B:25" (chain defaults to A) into (chain, residue id) pairs"""
+    residues = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        chain, _, resid = item.rpartition(":")
+        try:
+            residues.append((chain.strip() or "A", int(resid)))
+        except ValueError:
+            raise HTTPException(status_code=422, detail=f"Invalid pocket residue: {item}")
+    return residues
+
+def pocket_center(pdb_text: str, center: Optional[List[float]], residues: Optional[str]) -> List[float]:
+    """Validate an uploaded structure and resolve its pocket center"""
+    arrays = parse_pdb(pdb_text)
+    coords = arrays["coords"]
+    if len(coords) == 0:
+        raise HTTPException(status_code=422, detail="No ATOM records found in structure")
+
+    if residues:
+        keys = set(parse_pocket_residues(residues))
+        mask = np.array([
+            (c, r) in keys for c, r in zip(arrays["chain_ids"].tolist(), arrays["residue_ids"].tolist())
+        ], dtype=bool)
+        if not mask.any():
+            raise HTTPException(status_code=422, detail="Pocket residues not found in structure")
+        center = coords[mask].mean(axis=0).tolist()
+
+    nearest = np.sqrt(np.min(np.sum((coords - np.asarray(center, dtype=np.float32)) ** 2, axis=1)))
+    if nearest > POCKET_INDEX_RADIUS:
+        raise HTTPException(status_code=422, detail="Pocket center is not near the protein")
+    return [round(float(c), 3) for c in center]
+
+async def preprocess_uploaded_target(resources, target_id: str, pdb_text: str, center: List[float]):
+    """Parse the structure and precompute grid maps in the process pool"""
+    db = resources.db
+    await db.docking_targets.update_one({"id": target_id}, {"$set": {"status": "processing"}})
     try:
-        # Real fetch from RCSB PDB
-        # Add timeout to avoid hanging
-        pdb_url = f"https://files.rcsb.org/download/{pdb_id}.pdb"
-        response = requests.get(pdb_url, timeout=5)
-        if response.status_code == 200:
-            target_pdb_data = response.text
+        info = await run_in_pool(resources.process_pool, preprocess_target, target_id, pdb_text, center)
     except Exception as e:
-        print(f"PDB Fetch Warning: {e}")
-        # Continue with mock if fetch fails
+        logger.error(f"Preprocessing target {target_id} failed: {e}")
+        await db.docking_targets.update_one(
+            {"id": target_id},
+            {"$set": {"status": "failed", "error": str(e), "updated_at": datetime.now(timezone.utc)}},
+        )
+        return
+
+    result = await db.docking_targets.update_one(
+        {"id": target_id},
+        {"$set": {"status": "ready", **info, "updated_at": datetime.now(timezone.utc)}},
+    )
+    if result.matched_count == 0:
+        # Deleted while it was being prepared
+        await asyncio.to_thread(delete_structure, target_id)
+
+@router.get("/targets", response_model=List[TargetInfo])
+async def list_targets(db=Depends(get_db)):
+    cursor = db.docking_targets.find({}, {"_id": 0}).sort("created_at", -1)
+    uploaded = await cursor.to_list(length=500)
+    return [builtin_target(target_id) for target_id in TARGETS] + uploaded
+
+@router.post("/targets", response_model=TargetInfo, status_code=202)
+async def upload_target(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    name: str = Form(...),
+    center_x: Optional[float] = Form(None),
+    center_y: Optional[float] = Form(None),
+    center_z: Optional[float] = Form(None),
+    pocket_residues: Optional[str] = Form(None),  # e.g. "A:25,A:27,B:25"
+    db=Depends(get_db),
+    resources=Depends(get_resources),
+):
+    """
+    Register a user-supplied PDB structure as a docking target.
+
+    The pocket is given either as a center (center_x/y/z) or as a list of
+    residues whose centroid becomes the center. Parsing and grid map
+    precomputation run in the background; poll /targets/{id}/status.
+    """
+    has_center = None not in (center_x, center_y, center_z)
+    if not has_center and not pocket_residues:
+        raise HTTPException(status_code=422, detail="Provide center_x/center_y/center_z or pocket_residues")
+
+    raw = await file.read(MAX_TARGET_UPLOAD_BYTES + 1)
+    if len(raw) > MAX_TARGET_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Structure file too large")
+    pdb_text = raw.decode("utf-8", errors="ignore")
+
+    center = [center_x, center_y, center_z] if has_center else None
+    center = await asyncio.to_thread(pocket_center, pdb_text, center, pocket_residues)
+
+    now = datetime.now(timezone.utc)
+    target = TargetInfo(
+        id=str(uuid.uuid4()),
+        name=name,
+        source="upload",
+        status="pending",
+        center=center,
+        created_at=now,
+        updated_at=now,
+    )
+    await asyncio.to_thread(save_uploaded_pdb, target.id, pdb_text)
+    await db.docking_targets.insert_one(target.model_dump())
+
+    background_tasks.add_task(preprocess_uploaded_target, resources, target.id, pdb_text, center)
+    return target
+
+@router.get("/targets/{target_id}/status", response_model=TargetInfo)
+async def get_target_status(target_id: str, db=Depends(get_db)):
+    return await resolve_target(db, target_id)
+
+@router.delete("/targets/{target_id}")
+async def delete_target(target_id: str, db=Depends(get_db), resources=Depends(get_resources)):
+    if target_id in TARGETS:
+        raise HTTPException(status_code=400, detail="Built-in targets cannot be deleted")
+    result = await db.docking_targets.delete_one({"id": target_id})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Target not found")
+
+    await asyncio.to_thread(delete_structure, target_id)
+    await resources.docking_cache.invalidate_target(db, target_id)
+    return {"message": "Target deleted", "id": target_id}
+
+# Browser cache lifetime for target structures; requests pinned to a version never change
+TARGET_CACHE_MAX_AGE = 3600
+TARGET_VERSIONED_MAX_AGE = 31536000
+
+@router.get("/targets/{target_id}")
+async def get_target_structure(
+    target_id: str,
+    pocket_radius: Optional[float] = Query(None, gt=0, le=POCKET_INDEX_RADIUS),
+    version: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    db=Depends(get_db),
+):
+    """
+    Receptor PDB for a target, or only the pocket residues within
+    ``pocket_radius`` of the active site center.
+
+    Docking results reference the target by id and ``target_version``, so
+    clients download the structure once and revalidate it with the ETag.
+    """
+    target_pdb_data, structure = await load_target(target_id, db)
+
+    scope = f"pocket-{pocket_radius:g}" if pocket_radius else "full"
+    etag = f'"{structure.structure_hash[:32]}-{scope}"'
+    if version == structure.structure_hash:
+        cache_control = f"public, max-age={TARGET_VERSIONED_MAX_AGE}, immutable"
+    else:
+        cache_control = f"public, max-age={TARGET_CACHE_MAX_AGE}"
+    headers = {"ETag": etag, "Cache-Control": cache_control}
 
-    # 2. Prepare Ligand (RDKit)
+    if if_none_match:
+        client_etags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+        if etag in client_etags or "*" in client_etags:
+            return Response(status_code=304, headers=headers)
+
+    if pocket_radius:
+        content = await asyncio.to_thread(pocket_pdb, structure, target_pdb_data, pocket_radius)
+    else:
+        content = target_pdb_data
+    return Response(content=content, media_type="chemical/x-pdb", headers=headers)
+
+def canonical_smiles(smiles: str) -> Optional[str]:
+    mol = Chem.MolFromSmiles(smiles)
+    return Chem.MolToSmiles(mol) if mol else None
+
+@router.post("/docking/run", response_model=DockingResult)
+async def run_docking_simulation(request: DockingRequest, db=Depends(get_db), resources=Depends(get_resources)):
+    # 1. Fetch Target PDB 
+    _, structure = await load_target(request.target_id, db)
+
+    canonical = canonical_smiles(request.ligand_smiles)
+    if canonical is None:
+        raise HTTPException(status_code=500, detail="Simulation failed: Invalid SMILES")
+
+    # Repeat runs of the same ligand, target version and parameters are served from cache
+    # (the time budget is not part of the key: it only bounds how long the search may take)
+    cache = resources.docking_cache
+    cacheable = structure.structure_hash != MOCK_PROTEIN_HASH
+    params = {"exhaustiveness": request.exhaustiveness, "num_poses": request.num_poses}
+    cache_key = cache.make_key(canonical, request.target_id, structure.structure_hash, params)
+    cached = None
+    if cacheable:
+        await cache.check_target_version(db, request.target_id, structure.structure_hash)
+        cached = await cache.get(db, cache_key)
+    if cached is not None:
+        return DockingResult(
+            **cached,
+            target_id=request.target_id,
+            target_version=structure.structure_hash,
+            cached=True,
+        )
+
+    # 2. Prepare Ligand conformers (RDKit, in the compute pool)
     try:
-        mol = Chem.MolFromSmiles(request.ligand_smiles)
-        if not mol:
-             raise Exception("Invalid SMILES")
-             
-        mol = Chem.AddHs(mol)
-        res = AllChem.EmbedMolecule(mol, randomSeed=42)
-        if res == -1:
-             res = AllChem.EmbedMolecule(mol, useRandomCoords=True)
-             
-        if res != -1:
-            try:
-                AllChem.UFFOptimizeMolecule(mol)
-            except: pass
-        
-        # 3. Translation
-        conf = mol.GetConformer()
-        center = target_info["center"]
-        
-        # Calculate current centroid
-        centroid = [0,0,0]
-        num_atoms = mol.GetNumAtoms()
-        for i in range(num_atoms):
-            pos = conf.GetAtomPosition(i)
-            centroid[0] += pos.x
-            centroid[1] += pos.y
-            centroid[2] += pos.z
-        
-        if num_atoms > 0:
-            centroid = [c/num_atoms for c in centroid]
-            shift = [center[0]-centroid[0], center[1]-centroid[1], center[2]-centroid[2]]
-            
-            # Apply shift
-            for i in range(num_atoms):
-                pos = conf.GetAtomPosition(i)
-                conf.SetAtomPosition(i, [pos.x+shift[0], pos.y+shift[1], pos.z+shift[2]])
-            
-        ligand_pdb_block = Chem.MolToPDBBlock(mol)
-        
-        # 4. Calculate Mock Affinity
-        mw = Chem.rdMolDescriptors.CalcExactMolWt(mol)
-        base_score = -5.0 - (mw / 100.0 * 0.5) 
-        affinity = base_score + random.uniform(-1.5, 0.5)
+        ligand = await run_in_pool(resources.process_pool, prepare_ligand, request.ligand_smiles)
         
-        await asyncio.sleep(1.0)
-        
-        return DockingResult(
-            affinity=round(affinity, 2),
-            ligand_pdb=ligand_pdb_block,
-            target_pdb=target_pdb_data,
-            score_breakdown={
-                "van_der_waals": round(affinity * 0.6, 2),
-                "electrostatic": round(affinity * 0.3, 2),
-                "desolvation": round(affinity * 0.1, 2)
-            }
+        # 3. Pose search, bounded by the request's time budget
+        poses = await dock_ligand(
+            resources.process_pool,
+            structure,
+            ligand,
+            exhaustiveness=request.exhaustiveness,
+            num_poses=request.num_poses,
+            time_budget=request.time_budget,
         )
+        if not poses:
+            raise Exception("No poses found")
         
+        best = poses[0]
+        result = {
+            "affinity": best.affinity,
+            "ligand_pdb": best.ligand_pdb,
+            "score_breakdown": best.score_breakdown,
+            "poses": [vars(pose) for pose in poses],
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Simulation failed: {str(e)}")
+
+    if cacheable:
+        await cache.put(db, cache_key, canonical, request.target_id, structure.structure_hash, params, result)
+    return DockingResult(**result, target_id=request.target_id, target_version=structure.structure_hash)
+
+
+@router.post("/screening/run")
+async def run_virtual_screening(request: ScreeningRequest, db=Depends(get_db), resources=Depends(get_resources)):
+    """
+    Dock many ligands against one target.
+
+    Streams NDJSON: one "result" line per ligand as soon as it finishes, then
+    a final "summary" line ranking all ligands by affinity. Ligands are
+    deduplicated by canonical SMILES and docked one per pool worker.
+    """
+    smiles_list = list(request.ligand_smiles)
+    if request.experiment_id:
+        exp = await db.experiments.find_one({"id": request.experiment_id})
+        if not exp:
+            raise HTTPException(status_code=404, detail="Experiment not found")
+        await resources.generation_store.ensure_written(experiment_id=request.experiment_id)
+        cursor = db.generation_history.find(
+            {"experiment_id": request.experiment_id}, {"_id": 0, "results": 1}
+        )
+        async for run in cursor:
+            smiles_list.extend(r["smiles"] for r in run.get("results", []) if r.get("is_valid", True))
+
+    # Deduplicate by canonical SMILES, keeping the first spelling seen (RDKit, in the compute pool)
+    ligands, invalid = await run_in_pool(resources.process_pool, canonicalize_ligands, smiles_list)
+
+    if not ligands and not invalid:
+        raise HTTPException(status_code=422, detail="No ligands to screen")
+    if len(ligands) > MAX_SCREENING_LIGANDS:
+        raise HTTPException(status_code=422, detail=f"At most {MAX_SCREENING_LIGANDS} unique ligands per request")
+
+    _, structure = await load_target(request.target_id, db)
+
+    cache = resources.docking_cache
+    cacheable = structure.structure_hash != MOCK_PROTEIN_HASH
+    params = {"exhaustiveness": request.exhaustiveness, "num_poses": 1}
+    cache_keys = {
+        canonical: cache.make_key(canonical, request.target_id, structure.structure_hash, params)
+        for canonical in ligands
+    }
+    hits = {}
+    if cacheable:
+        await cache.check_target_version(db, request.target_id, structure.structure_hash)
+        hits = await cache.get_many(db, list(cache_keys.values()))
+    cached_results = {canonical: hits[key] for canonical, key in cache_keys.items() if key in hits}
+    pending = {c: s for c, s in ligands.items() if c not in cached_results}
+
+    # Compute grid maps for every atom type up front so workers only mmap them
+    if pending:
+        await run_in_pool(resources.process_pool, prepare_screening_maps, structure.target_id, list(pending))
+
+    async def dock_one(canonical: str, smiles: str) -> dict:
+        try:
+            poses = await run_in_pool(
+                resources.process_pool,
+                dock_smiles,
+                structure.target_id,
+                smiles,
+                exhaustiveness=request.exhaustiveness,
+                time_budget=request.time_budget,
+            )
+            if not poses:
+                raise Exception("No poses found")
+            best = poses[0]
+            result = {
+                "affinity": best.affinity,
+                "ligand_pdb": best.ligand_pdb,
+                "score_breakdown": best.score_breakdown,
+                "poses": [vars(best)],
+            }
+        except Exception as e:
+            return {"type": "result", "smiles": smiles, "canonical_smiles": canonical, "error": str(e)}
+
+        if cacheable:
+            await cache.put(db, cache_keys[canonical], canonical, request.target_id, structure.structure_hash, params, result)
+        return screening_line(canonical, smiles, result)
+
+    def screening_line(canonical: str, smiles: str, result: dict, cached: bool = False) -> dict:
+        return {
+            "type": "result",
+            "smiles": smiles,
+            "canonical_smiles": canonical,
+            "affinity": result["affinity"],
+            "score_breakdown": result["score_breakdown"],
+            "ligand_pdb": result["ligand_pdb"],
+            "cached": cached,
+        }
+
+    async def stream():
+        for smiles in invalid:
+            yield json.dumps({"type": "result", "smiles": smiles, "error": "Invalid SMILES"}) + "\n"
+
+        results = []
+        for canonical, result in cached_results.items():
+            line = screening_line(canonical, ligands[canonical], result, cached=True)
+            results.append(line)
+            yield json.dumps(line) + "\n"
+
+        tasks = [asyncio.ensure_future(dock_one(c, s)) for c, s in pending.items()]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                results.append(result)
+                yield json.dumps(result) + "\n"
+        finally:
+            # Client went away: drop ligands that have not started yet
+            for task in tasks:
+                task.cancel()
+
+        docked = sorted((r for r in results if "affinity" in r), key=lambda r: r["affinity"])
+        yield json.dumps({
+            "type": "summary",
+            "target_id": request.target_id,
+            "num_ligands": len(ligands),
+            "num_failed": len(results) - len(docked) + len(invalid),
+            "ranking": [
+                {"rank": i + 1, "smiles": r["smiles"], "canonical_smiles": r["canonical_smiles"], "affinity": r["affinity"]}
+                for i, r in enumerate(docked)
+            ],
+        }) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
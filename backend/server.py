@@ -1,22 +1,56 @@
-from fastapi import FastAPI, APIRouter
+from fastapi import FastAPI, APIRouter, Depends
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from contextlib import asynccontextmanager
+import asyncio
 import os
 import logging
 from pathlib import Path
-from routes import molecule_routes, experiment_routes, knowledge_routes, simulation_routes
 
+# Load .env before the modules below read their settings
 ROOT_DIR = Path(__file__).parent.parent
 load_dotenv(ROOT_DIR / 'backend/.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+from routes import molecule_routes, experiment_routes, knowledge_routes, simulation_routes
+from resources import Resources, get_db, get_resources, open_resources
+from services.db_schema import bootstrap_database, index_report
+from services.experiment_runs import reconcile_run_counts
+from services.pagination import NEXT_CURSOR_HEADER
+from services.retrieval_index import build_retrieval_index
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Interval for repairing denormalized experiment run counts (seconds, 0 = off)
+RUN_COUNT_RECONCILE_INTERVAL = int(os.environ.get('RUN_COUNT_RECONCILE_INTERVAL', 3600))
+
+async def reconcile_run_counts_periodically(db):
+    while True:
+        await asyncio.sleep(RUN_COUNT_RECONCILE_INTERVAL)
+        try:
+            await reconcile_run_counts(db)
+        except Exception as e:
+            logger.error(f"Run count reconciliation failed: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Runs once per worker process: resources are created here, not at import
+    resources = await open_resources()
+    app.state.resources = resources
+
+    # Index builds, migrations and the retrieval index load run in the
+    # background; requests are served meanwhile
+    resources.spawn(bootstrap_database(resources.db))
+    resources.spawn(build_retrieval_index(resources.db, resources.retrieval_index))
+    if RUN_COUNT_RECONCILE_INTERVAL > 0:
+        resources.spawn(reconcile_run_counts_periodically(resources.db))
+    try:
+        yield
+    finally:
+        await resources.close()
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -25,6 +59,16 @@ api_router = APIRouter(prefix="/api")
 async def root():
     return {"message": "Molecule Generation API Online"}
 
+@api_router.get("/db/indexes")
+async def get_index_report(db=Depends(get_db)):
+    """Declared indexes that are missing, undeclared ones, and unused ones"""
+    return await index_report(db)
+
+@api_router.get("/db/write-behind")
+async def get_write_behind_stats(resources: Resources = Depends(get_resources)):
+    """Generation write mode and records waiting to be flushed"""
+    return resources.generation_store.stats()
+
 # Include routes
 api_router.include_router(molecule_routes.router)
 api_router.include_router(experiment_routes.router)
@@ -40,11 +84,5 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
-
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
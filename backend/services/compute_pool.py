@@ -0,0 +1,54 @@
+"""
+Compute Pool
+
+Process pool for CPU-bound work (ligand preparation, grid maps, pose
+search) so it runs on all cores without blocking the event loop. Each worker
+process creates one at startup (`Resources.process_pool`); callers pass it
+to `run_in_pool`.
+
+Workers are spawned rather than forked: the API process holds Motor and
+aiohttp threads that must not be duplicated into children.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Each uvicorn worker (WEB_CONCURRENCY of them) has its own pool, so by default
+# the cores are divided between them
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 1))
+DOCKING_WORKERS = int(os.environ.get('DOCKING_WORKERS', max(1, (os.cpu_count() or 1) // WEB_CONCURRENCY)))
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Get the worker's process pool, starting it on first use (at startup)"""
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(
+            max_workers=DOCKING_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+        )
+        logger.info(f"Started compute pool with {DOCKING_WORKERS} workers")
+    return _process_pool
+
+
+async def run_in_pool(pool: ProcessPoolExecutor, fn: Callable, *args: Any, **kwargs: Any) -> Any:
+    """Run a picklable function in ``pool`` and await its result"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(pool, partial(fn, *args, **kwargs))
+
+
+def shutdown_process_pool() -> None:
+    """Stop the pool; running tasks are cancelled"""
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
@@ -0,0 +1,327 @@
+"""
+Database Schema
+
+Indexes each collection needs for its queries, and versioned data migrations.
+`bootstrap_database` runs once per process at startup (off the request path):
+1. Create missing indexes (idempotent; MongoDB builds them without blocking
+   reads and writes)
+2. Apply pending migrations in version order, recording each in
+   `schema_migrations`; a lease keeps several workers from running them at once
+3. Report indexes that are missing, undeclared, or unused since the server started
+
+To add a migration, decorate an async function taking `db` with
+`@migration(<next version>, '<description>')`. Migrations must be safe to
+re-run: a worker can die between applying one and recording it.
+"""
+
+import logging
+import os
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from services.timestamps import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+# A worker that holds the migration lease longer than this is presumed dead
+MIGRATION_LEASE_SECONDS = int(os.environ.get('MIGRATION_LEASE_SECONDS', 600))
+
+# Documents rewritten per bulk write by data migrations
+MIGRATION_BATCH_SIZE = int(os.environ.get('MIGRATION_BATCH_SIZE', 1000))
+
+
+@dataclass(frozen=True)
+class IndexSpec:
+    """A required index on one collection"""
+    collection: str
+    keys: Tuple[Tuple[str, int], ...]
+    unique: bool = False
+
+    @property
+    def name(self) -> str:
+        # MongoDB's default index name, so existing equivalent indexes are recognized
+        return '_'.join(f'{field}_{direction}' for field, direction in self.keys)
+
+
+REQUIRED_INDEXES: List[IndexSpec] = [
+    # Lookup by id; history, experiment runs and per-model history paged by (created_at, id)
+    IndexSpec('generation_history', (('id', ASCENDING),), unique=True),
+    IndexSpec('generation_history', (('created_at', DESCENDING), ('id', DESCENDING))),
+    IndexSpec('generation_history', (('experiment_id', ASCENDING), ('created_at', DESCENDING), ('id', DESCENDING))),
+    IndexSpec('generation_history', (('results.model_name', ASCENDING), ('created_at', DESCENDING), ('id', DESCENDING))),
+    # Regeneration lineage ($graphLookup from a root down parent_id links)
+    IndexSpec('generation_history', (('parent_id', ASCENDING),)),
+
+    # Session history in order (display pages and rehydration)
+    IndexSpec('chat_history', (('session_id', ASCENDING), ('created_at', ASCENDING), ('id', ASCENDING))),
+    IndexSpec('chat_sessions', (('session_id', ASCENDING),), unique=True),
+    IndexSpec('chat_sessions', (('last_message_at', DESCENDING),)),
+
+    IndexSpec('experiments', (('id', ASCENDING),), unique=True),
+    IndexSpec('experiments', (('updated_at', DESCENDING),)),
+
+    # One aggregate per model, globally (experiment_id null) and per experiment
+    IndexSpec('model_stats', (('experiment_id', ASCENDING), ('model_name', ASCENDING)), unique=True),
+
+    IndexSpec('docking_targets', (('id', ASCENDING),), unique=True),
+    IndexSpec('docking_targets', (('created_at', DESCENDING),)),
+
+    # Cache lookups by key; invalidation by target; retrieval index backfill by date
+    IndexSpec('docking_cache', (('key', ASCENDING),), unique=True),
+    IndexSpec('docking_cache', (('target_id', ASCENDING),)),
+    IndexSpec('mol2text_cache', (('key', ASCENDING),), unique=True),
+    IndexSpec('mol2text_cache', (('created_at', ASCENDING),)),
+]
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    apply: Callable[..., Awaitable[None]]
+
+
+MIGRATIONS: Dict[int, Migration] = {}
+
+
+def migration(version: int, description: str):
+    """Register an async ``fn(db)`` as data migration ``version``"""
+    def register(fn):
+        if version in MIGRATIONS:
+            raise ValueError(f"Duplicate migration version {version}")
+        MIGRATIONS[version] = Migration(version, description, fn)
+        return fn
+    return register
+
+
+# ============ Indexes ============
+
+async def ensure_indexes(db) -> Dict[str, List[str]]:
+    """Create every required index that does not exist yet; returns created and failed names"""
+    created, failed = [], []
+    for spec in REQUIRED_INDEXES:
+        existing = await db[spec.collection].index_information()
+        if spec.name in existing:
+            continue
+        try:
+            await db[spec.collection].create_index(list(spec.keys), name=spec.name, unique=spec.unique)
+            created.append(f"{spec.collection}.{spec.name}")
+        except OperationFailure as e:
+            # e.g. duplicates blocking a unique index; the app still works without it
+            logger.error(f"Could not create index {spec.collection}.{spec.name}: {e}")
+            failed.append(f"{spec.collection}.{spec.name}")
+    if created:
+        logger.info(f"Created indexes: {', '.join(created)}")
+    return {'created': created, 'failed': failed}
+
+
+async def index_report(db) -> Dict[str, List[str]]:
+    """
+    Compare indexes in the database with the declared ones:
+    missing (declared, not present), undeclared (present, not declared) and
+    unused (no operations since the server started, per $indexStats).
+    """
+    declared: Dict[str, set] = {}
+    for spec in REQUIRED_INDEXES:
+        declared.setdefault(spec.collection, set()).add(spec.name)
+
+    report = {'missing': [], 'undeclared': [], 'unused': []}
+    for collection, names in declared.items():
+        existing = set(await db[collection].index_information()) - {'_id_'}
+        report['missing'].extend(f"{collection}.{name}" for name in sorted(names - existing))
+        report['undeclared'].extend(f"{collection}.{name}" for name in sorted(existing - names))
+        try:
+            stats = await db[collection].aggregate([{'$indexStats': {}}]).to_list(length=None)
+        except (OperationFailure, NotImplementedError):
+            continue  # Not available (e.g. restricted permissions)
+        report['unused'].extend(
+            f"{collection}.{s['name']}" for s in stats
+            if s['name'] != '_id_' and s.get('accesses', {}).get('ops', 0) == 0
+        )
+    return report
+
+
+# ============ Migrations ============
+
+async def _acquire_migration_lease(db, owner: str) -> bool:
+    now = datetime.now(timezone.utc)
+    lease = {'owner': owner, 'expires_at': now + timedelta(seconds=MIGRATION_LEASE_SECONDS)}
+    try:
+        await db.schema_migrations.insert_one({'_id': 'lease', **lease})
+        return True
+    except DuplicateKeyError:
+        # Take over a lease whose holder died
+        taken = await db.schema_migrations.find_one_and_update(
+            # A string expiry was written by a version that stored ISO strings
+            {'_id': 'lease', '$or': [{'expires_at': {'$lt': now}}, {'expires_at': {'$type': 'string'}}]},
+            {'$set': lease}
+        )
+        return taken is not None
+
+
+async def run_migrations(db) -> List[int]:
+    """Apply pending migrations in order; returns the versions applied"""
+    applied_docs = await db.schema_migrations.find({'version': {'$exists': True}}, {'version': 1}).to_list(length=None)
+    done = {doc['version'] for doc in applied_docs}
+    pending = [MIGRATIONS[v] for v in sorted(MIGRATIONS) if v not in done]
+    if not pending:
+        return []
+
+    owner = str(uuid.uuid4())
+    if not await _acquire_migration_lease(db, owner):
+        logger.info("Migrations are being applied by another worker")
+        return []
+
+    applied = []
+    try:
+        for m in pending:
+            # Another worker may have finished it before we got the lease
+            if await db.schema_migrations.find_one({'version': m.version}):
+                continue
+            logger.info(f"Applying migration {m.version}: {m.description}")
+            try:
+                await m.apply(db)
+            except Exception as e:
+                # Later migrations may depend on this one, so stop here
+                logger.error(f"Migration {m.version} failed: {e}")
+                break
+            await db.schema_migrations.insert_one({
+                'version': m.version,
+                'description': m.description,
+                'applied_at': datetime.now(timezone.utc)
+            })
+            applied.append(m.version)
+    finally:
+        await db.schema_migrations.delete_one({'_id': 'lease', 'owner': owner})
+    return applied
+
+
+async def bootstrap_database(db) -> None:
+    """Indexes, then migrations, then a report of index problems (startup task)"""
+    try:
+        await ensure_indexes(db)
+        await run_migrations(db)
+        report = await index_report(db)
+    except Exception as e:
+        logger.error(f"Database bootstrap failed: {e}")
+        return
+    for kind in ('missing', 'undeclared', 'unused'):
+        if report[kind]:
+            logger.warning(f"{kind.capitalize()} indexes: {', '.join(report[kind])}")
+
+
+# ============ Migration Definitions ============
+
+@migration(1, 'Build chat_sessions summaries from existing chat_history')
+async def backfill_chat_sessions(db):
+    from services.llm_service import CHAT_SESSION_TITLE_LENGTH
+    pipeline = [
+        {"$sort": {"created_at": 1}},
+        {"$group": {
+            "_id": "$session_id",
+            "message_count": {"$sum": 1},
+            "first_message_at": {"$first": "$created_at"},
+            "last_message_at": {"$last": "$created_at"},
+            "title": {"$first": "$content"}
+        }}
+    ]
+    count = 0
+    async for group in db.chat_history.aggregate(pipeline, allowDiskUse=True):
+        await db.chat_sessions.update_one(
+            {"session_id": group["_id"]},
+            {
+                # $max/$min so turns saved meanwhile (or a re-run) are not double counted
+                "$max": {"message_count": group["message_count"], "last_message_at": group["last_message_at"]},
+                "$min": {"first_message_at": group["first_message_at"]},
+                "$setOnInsert": {"title": group["title"][:CHAT_SESSION_TITLE_LENGTH]}
+            },
+            upsert=True
+        )
+        count += 1
+    logger.info(f"Backfilled {count} chat session summaries")
+
+
+@migration(2, 'Store run_count on experiments')
+async def backfill_experiment_run_counts(db):
+    from services.experiment_runs import reconcile_run_counts
+    await reconcile_run_counts(db)
+
+
+@migration(3, 'Drop created_at indexes superseded by (created_at, id) keyset indexes')
+async def drop_superseded_date_indexes(db):
+    superseded = {
+        'generation_history': ['created_at_-1', 'experiment_id_1_created_at_-1'],
+        'chat_history': ['session_id_1_created_at_1'],
+    }
+    for collection, names in superseded.items():
+        existing = await db[collection].index_information()
+        for name in names:
+            if name in existing:
+                await db[collection].drop_index(name)
+
+
+# Timestamp fields that were stored as ISO strings before BSON dates
+TIMESTAMP_FIELDS = {
+    'generation_history': ['created_at', 'updated_at'],
+    'experiments': ['created_at', 'updated_at'],
+    'chat_history': ['created_at'],
+    'chat_sessions': ['first_message_at', 'last_message_at'],
+    'docking_targets': ['created_at', 'updated_at'],
+    'docking_cache': ['created_at'],
+    'mol2text_cache': ['created_at'],
+}
+
+
+async def _convert_string_timestamps(collection, field: str) -> int:
+    """Rewrite ``field`` from ISO string to BSON date, in batches; returns the count converted"""
+    converted = 0
+    last_id = None
+    while True:
+        query = {field: {'$type': 'string'}}
+        if last_id is not None:
+            query['_id'] = {'$gt': last_id}
+        docs = await collection.find(query, {field: 1}) \
+            .sort('_id', ASCENDING) \
+            .limit(MIGRATION_BATCH_SIZE) \
+            .to_list(length=MIGRATION_BATCH_SIZE)
+        if not docs:
+            return converted
+        last_id = docs[-1]['_id']
+
+        updates = []
+        for doc in docs:
+            parsed = parse_timestamp(doc[field])
+            if parsed is None:
+                logger.warning(f"Unparseable {collection.name}.{field} on {doc['_id']}: {doc[field]!r}")
+                continue
+            # Matching the old value leaves documents rewritten meanwhile alone
+            updates.append(UpdateOne({'_id': doc['_id'], field: doc[field]}, {'$set': {field: parsed}}))
+        if updates:
+            result = await collection.bulk_write(updates, ordered=False)
+            converted += result.modified_count
+
+
+@migration(4, 'Store timestamps as BSON dates instead of ISO strings')
+async def convert_string_timestamps(db):
+    for collection, fields in TIMESTAMP_FIELDS.items():
+        for field in fields:
+            converted = await _convert_string_timestamps(db[collection], field)
+            if converted:
+                logger.info(f"Converted {converted} {collection}.{field} timestamps to dates")
+
+
+@migration(5, 'Build per-model stats from existing generation_history')
+async def backfill_model_stats(db):
+    from services.model_stats import rebuild_model_stats
+    await rebuild_model_stats(db)
+
+
+@migration(6, 'Store root_id on regenerated generation records')
+async def backfill_lineage_roots(db):
+    from services.lineage import backfill_root_ids
+    await backfill_root_ids(db, MIGRATION_BATCH_SIZE)
@@ -0,0 +1,147 @@
+"""
+Docking Result Cache
+
+Caches docking results (affinity, poses, score breakdown) keyed by canonical
+SMILES, target id, target structure version, scoring version and search
+parameters. An in-memory LRU sits in front of the `docking_cache` Mongo
+collection so repeat runs skip embedding, search and scoring entirely.
+
+Entries for an old structure or scoring version can never match a new key;
+they are also purged as soon as a new target version is seen.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from services.docking_engine import SEARCH_VERSION
+from services.docking_scoring import SCORING_VERSION
+
+logger = logging.getLogger(__name__)
+
+DOCKING_CACHE_SIZE = int(os.environ.get('DOCKING_CACHE_SIZE', 256))
+
+
+class DockingCache:
+    """Two-tier (memory LRU + MongoDB) docking result cache"""
+
+    def __init__(self, max_entries: int = DOCKING_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._target_versions: Dict[str, str] = {}
+
+    @staticmethod
+    def make_key(canonical_smiles: str, target_id: str, structure_hash: str, params: Dict) -> str:
+        """Stable key over everything that changes the docking result"""
+        payload = {
+            'smiles': canonical_smiles,
+            'target_id': target_id,
+            'structure_hash': structure_hash,
+            'scoring_version': SCORING_VERSION,
+            'search_version': SEARCH_VERSION,
+            'params': params,
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+    async def check_target_version(self, db, target_id: str, structure_hash: str) -> None:
+        """Drop entries computed against an older structure of ``target_id``"""
+        if self._target_versions.get(target_id) == structure_hash:
+            return
+        self._target_versions[target_id] = structure_hash
+
+        stale = [k for k, v in self._entries.items() if v['target_id'] == target_id and v['structure_hash'] != structure_hash]
+        for key in stale:
+            del self._entries[key]
+        result = await db.docking_cache.delete_many({
+            'target_id': target_id,
+            '$or': [
+                {'structure_hash': {'$ne': structure_hash}},
+                {'scoring_version': {'$ne': SCORING_VERSION}},
+                {'search_version': {'$ne': SEARCH_VERSION}},
+            ],
+        })
+        if result.deleted_count:
+            logger.info(f"Invalidated {result.deleted_count} cached docking results for {target_id}")
+
+    async def invalidate_target(self, db, target_id: str) -> None:
+        """Drop every cached result for ``target_id`` (the target was deleted)"""
+        self._target_versions.pop(target_id, None)
+        for key in [k for k, v in self._entries.items() if v['target_id'] == target_id]:
+            del self._entries[key]
+        await db.docking_cache.delete_many({'target_id': target_id})
+
+    async def get(self, db, key: str) -> Optional[Dict]:
+        """Cached result for ``key``, or None"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            return entry['result']
+
+        doc = await db.docking_cache.find_one({'key': key}, {'_id': 0})
+        if doc is None:
+            return None
+        self._remember(key, doc)
+        return doc['result']
+
+    async def get_many(self, db, keys: List[str]) -> Dict[str, Dict]:
+        """Cached results of those ``keys`` that have one, with a single Mongo query"""
+        results = {}
+        missing = []
+        for key in keys:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                results[key] = entry['result']
+            else:
+                missing.append(key)
+        if missing:
+            async for doc in db.docking_cache.find({'key': {'$in': missing}}, {'_id': 0}):
+                self._remember(doc['key'], doc)
+                results[doc['key']] = doc['result']
+        return results
+
+    async def put(
+        self,
+        db,
+        key: str,
+        canonical_smiles: str,
+        target_id: str,
+        structure_hash: str,
+        params: Dict,
+        result: Dict,
+    ) -> None:
+        """Store a docking result in both tiers"""
+        doc = {
+            'key': key,
+            'canonical_smiles': canonical_smiles,
+            'target_id': target_id,
+            'structure_hash': structure_hash,
+            'scoring_version': SCORING_VERSION,
+            'search_version': SEARCH_VERSION,
+            'params': params,
+            'result': result,
+            'created_at': datetime.now(timezone.utc),
+        }
+        self._remember(key, doc)
+        await db.docking_cache.update_one({'key': key}, {'$set': doc}, upsert=True)
+
+    def _remember(self, key: str, doc: Dict) -> None:
+        self._entries[key] = doc
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+_docking_cache: Optional[DockingCache] = None
+
+
+def get_docking_cache() -> DockingCache:
+    """Get the process-wide docking cache"""
+    global _docking_cache
+    if _docking_cache is None:
+        _docking_cache = DockingCache()
+    return _docking_cache
@@ -0,0 +1,410 @@
+"""
+Docking Engine
+
+Pose search for protein-ligand docking:
+1. Prepare ligand conformers with RDKit (ETKDG + MMFF)
+2. Sample random rigid-body poses of every conformer around the pocket and
+   score them in batches against the target grid maps
+3. Refine the best poses with gradient-based rigid-body local optimization
+4. Cluster by RMSD and return the top poses
+
+The search is split into independent shards (Vina's "exhaustiveness") that
+run in the shared process pool under a common deadline, so a request uses
+real but bounded compute.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+from rdkit import Chem
+from rdkit.Chem import AllChem, rdMolDescriptors
+
+from services.compute_pool import run_in_pool
+from services.docking_scoring import (
+    GRID_HALF_SIZE,
+    XS_INDEX,
+    get_grid_maps,
+    ligand_atom_types,
+    score_ligand,
+)
+from services.protein_structure import ProteinStructure, get_protein_structure, load_protein_structure
+
+logger = logging.getLogger(__name__)
+
+# Bump when sampling, refinement or clustering change; part of the result cache key
+SEARCH_VERSION = 'rigid-1'
+
+DEFAULT_EXHAUSTIVENESS = 8
+DEFAULT_NUM_POSES = 9
+DEFAULT_TIME_BUDGET = float(os.environ.get('DOCKING_TIME_BUDGET', 10.0))
+MAX_TIME_BUDGET = 60.0
+
+# Screening docks one ligand per worker, so each gets a smaller search
+SCREENING_EXHAUSTIVENESS = 4
+SCREENING_TIME_BUDGET = float(os.environ.get('SCREENING_TIME_BUDGET', 5.0))
+
+NUM_CONFORMERS = 10
+SAMPLES_PER_SHARD = 20000
+SAMPLE_BATCH = 2000
+REFINE_TOP = 16
+REFINE_STEPS = 200
+CLUSTER_RMSD = 1.0
+
+# Fraction of a shard's time left for sampling; the rest is kept for refinement
+SAMPLING_TIME_FRACTION = 0.6
+
+# Largest distance of a sampled ligand centroid from the pocket center (Angstrom)
+MAX_SEARCH_RADIUS = 6.0
+
+# Ligand atom types whose grid maps are precomputed when a target is registered;
+# rarer types (Br, I, P, metals) are computed on first use
+COMMON_LIGAND_TYPES = ('C_H', 'C_P', 'N_P', 'N_D', 'N_A', 'N_DA', 'O_A', 'O_DA', 'S_P', 'F_H', 'Cl_H')
+
+
+@dataclass
+class PreparedLigand:
+    """Ligand with hydrogens and 3D conformers centered on their heavy-atom centroid"""
+    smiles: str
+    mol: Chem.Mol
+    heavy_idx: np.ndarray
+    types: np.ndarray
+    num_rotatable: int
+    conformers: np.ndarray
+
+    @property
+    def heavy_conformers(self) -> np.ndarray:
+        return self.conformers[:, self.heavy_idx]
+
+
+@dataclass
+class ShardPose:
+    """Rigid-body pose found by one search shard"""
+    energy: float
+    conformer: int
+    rotation: np.ndarray
+    translation: np.ndarray
+
+
+@dataclass
+class DockedPose:
+    """Final pose returned to the caller"""
+    affinity: float
+    ligand_pdb: str
+    score_breakdown: Dict[str, float]
+
+
+def prepare_ligand(smiles: str, num_conformers: int = NUM_CONFORMERS, seed: int = 42) -> PreparedLigand:
+    """Embed and optimize conformers for a SMILES string"""
+    mol = Chem.MolFromSmiles(smiles)
+    if not mol:
+        raise ValueError("Invalid SMILES")
+    mol = Chem.AddHs(mol)
+
+    params = AllChem.ETKDGv3()
+    params.randomSeed = seed
+    conf_ids = list(AllChem.EmbedMultipleConfs(mol, numConfs=num_conformers, params=params))
+    if not conf_ids:
+        params.useRandomCoords = True
+        conf_ids = list(AllChem.EmbedMultipleConfs(mol, numConfs=num_conformers, params=params))
+    if not conf_ids:
+        raise ValueError("Could not generate 3D coordinates")
+
+    try:
+        AllChem.MMFFOptimizeMoleculeConfs(mol)
+    except Exception:
+        try:
+            AllChem.UFFOptimizeMoleculeConfs(mol)
+        except Exception:
+            pass  # Optimization might fail but we have coords
+
+    heavy_idx, types = ligand_atom_types(mol)
+    conformers = np.stack([mol.GetConformer(i).GetPositions() for i in conf_ids]).astype(np.float32)
+    conformers -= conformers[:, heavy_idx].mean(axis=1, keepdims=True)
+
+    return PreparedLigand(
+        smiles=smiles,
+        mol=mol,
+        heavy_idx=heavy_idx,
+        types=types,
+        num_rotatable=rdMolDescriptors.CalcNumRotatableBonds(mol),
+        conformers=conformers,
+    )
+
+
+def prepare_grid_maps(target_id: str, types: Sequence[int]) -> None:
+    """Make sure the grid maps for ``types`` exist on disk (runs in a pool worker)"""
+    structure = load_protein_structure(target_id)
+    if structure is None:
+        raise ValueError(f"Target {target_id} has not been preprocessed")
+    get_grid_maps(structure, types)
+
+
+def canonicalize_ligands(smiles_list: Sequence[str]) -> Tuple[Dict[str, str], List[str]]:
+    """
+    Deduplicate ligands by canonical SMILES (runs in a pool worker).
+
+    Returns canonical -> first spelling seen, and the SMILES that do not parse.
+    """
+    ligands, invalid = {}, []
+    for smiles in smiles_list:
+        mol = Chem.MolFromSmiles(smiles)
+        if mol is None:
+            invalid.append(smiles)
+            continue
+        ligands.setdefault(Chem.MolToSmiles(mol), smiles)
+    return ligands, invalid
+
+
+def prepare_screening_maps(target_id: str, smiles_list: Sequence[str]) -> None:
+    """Grid maps for every atom type in ``smiles_list``, so screening workers only mmap them"""
+    types = set()
+    for smiles in smiles_list:
+        types.update(ligand_atom_types(Chem.AddHs(Chem.MolFromSmiles(smiles)))[1].tolist())
+    if types:
+        prepare_grid_maps(target_id, sorted(types))
+
+
+def preprocess_target(target_id: str, pdb_text: str, center: Sequence[float]) -> Dict:
+    """
+    Parse a newly registered target and precompute its grid maps (runs in a
+    pool worker), so the first docking run against it starts immediately.
+    """
+    structure = get_protein_structure(target_id, pdb_text, center)
+    get_grid_maps(structure, [XS_INDEX[name] for name in COMMON_LIGAND_TYPES])
+    return {
+        'structure_hash': structure.structure_hash,
+        'num_atoms': structure.num_atoms,
+        'num_pocket_atoms': int(len(structure.pocket_atoms(GRID_HALF_SIZE))),
+    }
+
+
+def _random_rotations(rng: np.random.Generator, n: int) -> np.ndarray:
+    """Uniformly distributed rotation matrices from random unit quaternions"""
+    u1, u2, u3 = rng.random((3, n))
+    q = np.stack([
+        np.sqrt(1 - u1) * np.sin(2 * np.pi * u2),
+        np.sqrt(1 - u1) * np.cos(2 * np.pi * u2),
+        np.sqrt(u1) * np.sin(2 * np.pi * u3),
+        np.sqrt(u1) * np.cos(2 * np.pi * u3),
+    ], axis=1)
+    x, y, z, w = q.T
+    return np.stack([
+        1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w),
+        2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w),
+        2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y),
+    ], axis=1).reshape(n, 3, 3).astype(np.float32)
+
+
+def _rotation_from_vectors(rotvec: np.ndarray) -> np.ndarray:
+    """Rodrigues' formula for a batch of rotation vectors"""
+    angle = np.linalg.norm(rotvec, axis=1)
+    axis = rotvec / np.maximum(angle, 1e-12)[:, None]
+    x, y, z = axis.T
+    zeros = np.zeros_like(x)
+    k = np.stack([zeros, -z, y, z, zeros, -x, -y, x, zeros], axis=1).reshape(-1, 3, 3)
+    sin, cos = np.sin(angle)[:, None, None], np.cos(angle)[:, None, None]
+    return (np.eye(3) + sin * k + (1 - cos) * (k @ k)).astype(np.float32)
+
+
+def _place(conformers: np.ndarray, conf_ids: np.ndarray, rotations: np.ndarray, translations: np.ndarray) -> np.ndarray:
+    """Coordinates of a batch of rigid-body poses, shape (P, N, 3)"""
+    return np.einsum('pnj,pij->pni', conformers[conf_ids], rotations) + translations[:, None, :]
+
+
+def _refine(grid_maps, conformers, types, conf_ids, rotations, translations, deadline: float):
+    """Batched adaptive-step gradient descent over translation and rotation"""
+    coords = _place(conformers, conf_ids, rotations, translations)
+    energy, grad = grid_maps.evaluate_with_gradient(coords, types)
+    step_t = np.full(len(conf_ids), 0.3, dtype=np.float32)
+    step_r = np.full(len(conf_ids), 0.1, dtype=np.float32)
+
+    for _ in range(REFINE_STEPS):
+        if time.time() >= deadline or np.all(step_t < 1e-3):
+            break
+        force = grad.sum(axis=1)
+        torque = np.cross(coords - translations[:, None, :], grad).sum(axis=1)
+        f_dir = force / np.maximum(np.linalg.norm(force, axis=1), 1e-9)[:, None]
+        t_dir = torque / np.maximum(np.linalg.norm(torque, axis=1), 1e-9)[:, None]
+
+        new_t = translations - step_t[:, None] * f_dir
+        new_r = _rotation_from_vectors(-step_r[:, None] * t_dir) @ rotations
+        new_coords = _place(conformers, conf_ids, new_r, new_t)
+        new_energy, new_grad = grid_maps.evaluate_with_gradient(new_coords, types)
+
+        better = new_energy < energy
+        translations = np.where(better[:, None], new_t, translations)
+        rotations = np.where(better[:, None, None], new_r, rotations)
+        coords = np.where(better[:, None, None], new_coords, coords)
+        grad = np.where(better[:, None, None], new_grad, grad)
+        energy = np.where(better, new_energy, energy)
+        scale = np.where(better, 1.2, 0.5).astype(np.float32)
+        step_t = np.minimum(step_t * scale, 1.0)
+        step_r = np.minimum(step_r * scale, 0.3)
+
+    return energy, rotations, translations
+
+
+def search_shard(
+    target_id: str,
+    conformers: np.ndarray,
+    types: np.ndarray,
+    seed: int,
+    deadline: float,
+    num_samples: int = SAMPLES_PER_SHARD,
+) -> List[ShardPose]:
+    """
+    One independent search run (executed in a pool worker).
+
+    Samples random rigid-body poses until ``num_samples`` or the sampling
+    share of the time budget is used, then refines the best REFINE_TOP.
+    """
+    structure = load_protein_structure(target_id)
+    if structure is None:
+        raise ValueError(f"Target {target_id} has not been preprocessed")
+    grid_maps = get_grid_maps(structure, types)
+
+    rng = np.random.default_rng(seed)
+    ligand_radius = float(np.max(np.linalg.norm(conformers, axis=-1)))
+    radius = max(1.0, min(MAX_SEARCH_RADIUS, GRID_HALF_SIZE - ligand_radius))
+    center = structure.center.astype(np.float32)
+    sampling_deadline = time.time() + SAMPLING_TIME_FRACTION * max(0.0, deadline - time.time())
+
+    best_energy = np.zeros(0, dtype=np.float32)
+    best_conf = np.zeros(0, dtype=np.intp)
+    best_rot = np.zeros((0, 3, 3), dtype=np.float32)
+    best_trans = np.zeros((0, 3), dtype=np.float32)
+
+    sampled = 0
+    while sampled < num_samples and (sampled == 0 or time.time() < sampling_deadline):
+        n = min(SAMPLE_BATCH, num_samples - sampled)
+        conf_ids = rng.integers(0, len(conformers), n)
+        rotations = _random_rotations(rng, n)
+        # Uniform points inside a sphere around the pocket center
+        direction = rng.normal(size=(n, 3))
+        direction /= np.linalg.norm(direction, axis=1, keepdims=True)
+        translations = (center + direction * radius * rng.random((n, 1)) ** (1 / 3)).astype(np.float32)
+
+        energy = grid_maps.evaluate(_place(conformers, conf_ids, rotations, translations), types)
+
+        best_energy = np.concatenate([best_energy, energy])
+        best_conf = np.concatenate([best_conf, conf_ids])
+        best_rot = np.concatenate([best_rot, rotations])
+        best_trans = np.concatenate([best_trans, translations])
+        keep = np.argsort(best_energy, kind='stable')[:REFINE_TOP]
+        best_energy, best_conf, best_rot, best_trans = best_energy[keep], best_conf[keep], best_rot[keep], best_trans[keep]
+        sampled += n
+
+    energy, rotations, translations = _refine(
+        grid_maps, conformers, types, best_conf, best_rot, best_trans, deadline
+    )
+    return [
+        ShardPose(energy=float(e), conformer=int(c), rotation=r, translation=t)
+        for e, c, r, t in zip(energy, best_conf, rotations, translations)
+    ]
+
+
+def _cluster(ligand: PreparedLigand, poses: List[ShardPose], num_poses: int) -> List[ShardPose]:
+    """Greedily keep the lowest-energy poses that differ by more than CLUSTER_RMSD"""
+    heavy = ligand.heavy_conformers
+    selected, selected_coords = [], []
+    for pose in sorted(poses, key=lambda p: p.energy):
+        coords = heavy[pose.conformer] @ pose.rotation.T + pose.translation
+        if any(np.sqrt(np.mean(np.sum((coords - c) ** 2, axis=1))) < CLUSTER_RMSD for c in selected_coords):
+            continue
+        selected.append(pose)
+        selected_coords.append(coords)
+        if len(selected) == num_poses:
+            break
+    return selected
+
+
+def _finalize_pose(structure: ProteinStructure, ligand: PreparedLigand, pose: ShardPose) -> DockedPose:
+    """Write the pose into an RDKit conformer, then score and serialize it"""
+    mol = Chem.Mol(ligand.mol)
+    conf = mol.GetConformer(mol.GetConformers()[0].GetId())
+    coords = ligand.conformers[pose.conformer] @ pose.rotation.T + pose.translation
+    for i, (x, y, z) in enumerate(coords.astype(float)):
+        conf.SetAtomPosition(i, (x, y, z))
+
+    affinity, breakdown = score_ligand(structure, mol, conf_id=conf.GetId())
+    return DockedPose(
+        affinity=round(affinity, 2),
+        ligand_pdb=Chem.MolToPDBBlock(mol, confId=conf.GetId()),
+        score_breakdown={name: round(value, 2) for name, value in breakdown.items()},
+    )
+
+
+def _finalize_poses(structure: ProteinStructure, ligand: PreparedLigand, poses: List[ShardPose]) -> List[DockedPose]:
+    """Finalized poses, best reported affinity first (the exact score can reorder the grid ranking)"""
+    return sorted((_finalize_pose(structure, ligand, p) for p in poses), key=lambda p: p.affinity)
+
+
+async def dock_ligand(
+    pool: ProcessPoolExecutor,
+    structure: ProteinStructure,
+    ligand: PreparedLigand,
+    exhaustiveness: int = DEFAULT_EXHAUSTIVENESS,
+    num_poses: int = DEFAULT_NUM_POSES,
+    time_budget: float = DEFAULT_TIME_BUDGET,
+    seed: int = 42,
+) -> List[DockedPose]:
+    """
+    Dock a prepared ligand into a target and return the top poses, best first.
+
+    Shards run in parallel across ``pool``; each stops sampling and
+    refining once ``time_budget`` seconds have passed.
+    """
+    types = ligand.types.tolist()
+    # One-time per target and atom type; afterwards workers just mmap the maps
+    await run_in_pool(pool, prepare_grid_maps, structure.target_id, types)
+
+    deadline = time.time() + min(time_budget, MAX_TIME_BUDGET)
+    heavy = ligand.heavy_conformers
+    shard_results = await asyncio.gather(*[
+        run_in_pool(pool, search_shard, structure.target_id, heavy, ligand.types, seed + k, deadline)
+        for k in range(exhaustiveness)
+    ])
+
+    poses = _cluster(ligand, [p for shard in shard_results for p in shard], num_poses)
+    return await asyncio.to_thread(_finalize_poses, structure, ligand, poses)
+
+
+def dock_smiles(
+    target_id: str,
+    smiles: str,
+    exhaustiveness: int = SCREENING_EXHAUSTIVENESS,
+    num_poses: int = 1,
+    time_budget: float = SCREENING_TIME_BUDGET,
+    seed: int = 42,
+) -> List[DockedPose]:
+    """
+    Prepare and dock one ligand entirely inside a single pool worker.
+
+    Used for screening, where parallelism comes from docking many ligands
+    at once rather than from splitting one ligand's search.
+    """
+    structure = load_protein_structure(target_id)
+    if structure is None:
+        raise ValueError(f"Target {target_id} has not been preprocessed")
+
+    deadline = time.time() + min(time_budget, MAX_TIME_BUDGET)
+    ligand = prepare_ligand(smiles, seed=seed)
+    get_grid_maps(structure, ligand.types)
+
+    heavy = ligand.heavy_conformers
+    shard_poses = []
+    for k in range(exhaustiveness):
+        if k > 0 and time.time() >= deadline:
+            break
+        # Later shards share what is left of the budget
+        shard_deadline = time.time() + (deadline - time.time()) / (exhaustiveness - k)
+        shard_poses.extend(search_shard(target_id, heavy, ligand.types, seed + k, shard_deadline))
+
+    poses = _cluster(ligand, shard_poses, num_poses)
+    return _finalize_poses(structure, ligand, poses)
@@ -0,0 +1,52 @@
+"""
+Experiment Run Counts
+
+Each experiment stores its number of generations as `run_count`, incremented
+as generations are saved. `reconcile_run_counts` repairs any drift from
+generation_history; it runs periodically (server.py), from the reconcile
+route, and as a migration.
+"""
+
+import logging
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+
+async def reconcile_run_counts(db) -> int:
+    """
+    Recompute every experiment's denormalized run_count from generation_history
+    with one aggregation. Returns the number of experiments corrected.
+
+    Generations keep running meanwhile, so each correction is conditional on
+    the run_count read before the aggregation: an experiment whose count was
+    incremented since is skipped (and checked again on the next run) rather
+    than overwritten with a stale total.
+    """
+    stored = {
+        doc["id"]: doc.get("run_count")
+        async for doc in db.experiments.find({}, {"_id": 0, "id": 1, "run_count": 1})
+    }
+    pipeline = [
+        {"$match": {"experiment_id": {"$ne": None}}},
+        {"$group": {"_id": "$experiment_id", "count": {"$sum": 1}}}
+    ]
+    counts = {row["_id"]: row["count"] async for row in db.generation_history.aggregate(pipeline)}
+    
+    # Only write counts that drifted, and only if unchanged since they were read
+    updates = [
+        UpdateOne({"id": experiment_id, "run_count": run_count}, {"$set": {"run_count": counts.get(experiment_id, 0)}})
+        for experiment_id, run_count in stored.items()
+        if run_count != counts.get(experiment_id, 0)
+    ]
+    corrected = 0
+    if updates:
+        result = await db.experiments.bulk_write(updates, ordered=False)
+        corrected = result.modified_count
+        if corrected < len(updates):
+            logger.info(f"Skipped {len(updates) - corrected} experiments whose run_count changed during reconciliation")
+    
+    if corrected:
+        logger.info(f"Reconciled run_count for {corrected} experiments")
+    return corrected
@@ -0,0 +1,248 @@
+"""
+Generation Store
+
+Persists generation records together with their experiment's bookkeeping
+(updated_at, run_count). GENERATION_WRITE_MODE sets the durability:
+
+- sync (default): a generation request returns after its record is written
+- write_behind: the request returns once its record is queued. Queued
+  records are written with one insert_many, and the experiment updates
+  coalesced into one bulk_write, when WRITE_BEHIND_BATCH_SIZE are queued,
+  every WRITE_BEHIND_INTERVAL seconds, and at shutdown. A record is not in
+  history listings, nor counted in its experiment's run_count, until
+  flushed; routes that look up a record or an experiment by id flush its
+  queued records first (`ensure_written`). Queued records are lost if the
+  process dies. At most WRITE_BEHIND_MAX_PENDING records are queued: when full, a
+  request flushes before queueing its record, which bounds memory and loss.
+
+`paused` holds all writes (the rebuild of model stats runs under it).
+
+A failed flush keeps its writes queued and is retried. Re-inserting a record
+that was written by a partly failed flush is a no-op (duplicate keys are
+ignored); a run_count that drifts this way is repaired by run count
+reconciliation.
+"""
+
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from services.model_stats import record_model_stats
+
+logger = logging.getLogger(__name__)
+
+GENERATION_WRITE_MODE = os.environ.get('GENERATION_WRITE_MODE', 'sync')
+WRITE_BEHIND_BATCH_SIZE = int(os.environ.get('WRITE_BEHIND_BATCH_SIZE', 200))
+WRITE_BEHIND_INTERVAL = float(os.environ.get('WRITE_BEHIND_INTERVAL', 0.5))
+WRITE_BEHIND_MAX_PENDING = int(os.environ.get('WRITE_BEHIND_MAX_PENDING', 5000))
+
+# Pause after a failed flush before trying again (seconds)
+WRITE_BEHIND_RETRY_DELAY = 2.0
+
+DUPLICATE_KEY_ERROR = 11000
+
+# Experiment id -> (runs to add, latest run time)
+ExperimentRuns = Dict[str, Tuple[int, datetime]]
+
+
+async def write_generations(db, records: List[Dict], experiment_runs: ExperimentRuns) -> None:
+    """Insert ``records``, apply the experiments' run counts and timestamps, and update model stats"""
+    if records:
+        try:
+            await db.generation_history.insert_many(records, ordered=False)
+        except BulkWriteError as e:
+            # Records already written by an earlier, partly failed flush
+            errors = [err for err in e.details.get('writeErrors', []) if err.get('code') != DUPLICATE_KEY_ERROR]
+            if errors or e.details.get('writeConcernErrors'):
+                raise
+    if experiment_runs:
+        await db.experiments.bulk_write([
+            UpdateOne({'id': experiment_id}, {'$max': {'updated_at': run_at}, '$inc': {'run_count': runs}})
+            for experiment_id, (runs, run_at) in experiment_runs.items()
+        ], ordered=False)
+    # Last, so a write that is retried has not counted its records yet
+    await record_model_stats(db, records)
+
+
+def _add_runs(experiment_runs: ExperimentRuns, experiment_id: str, runs: int, run_at: datetime) -> None:
+    if experiment_id in experiment_runs:
+        pending, latest = experiment_runs[experiment_id]
+        experiment_runs[experiment_id] = (pending + runs, max(latest, run_at))
+    else:
+        experiment_runs[experiment_id] = (runs, run_at)
+
+
+class GenerationStore:
+    """Writes generation records directly (sync) or through a write-behind buffer"""
+
+    def __init__(
+        self,
+        mode: str = GENERATION_WRITE_MODE,
+        batch_size: int = WRITE_BEHIND_BATCH_SIZE,
+        interval: float = WRITE_BEHIND_INTERVAL,
+        max_pending: int = WRITE_BEHIND_MAX_PENDING,
+    ):
+        if mode not in ('sync', 'write_behind'):
+            raise ValueError(f"Unknown generation write mode: {mode}. Available: ['sync', 'write_behind']")
+        self.mode = mode
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_pending = max_pending
+
+        self.records: List[Dict] = []
+        self.experiment_runs: ExperimentRuns = {}
+        self.flushed = 0
+        self._db = None
+        self._task: Optional[asyncio.Task] = None
+        self._flush_requested: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        # Writes wait while not open; idle is set when none is in progress
+        self._open = asyncio.Event()
+        self._open.set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._writing = 0
+        self._pause_lock = asyncio.Lock()
+
+    @property
+    def buffering(self) -> bool:
+        return self._task is not None
+
+    def start(self, db) -> None:
+        """Start the flusher (write_behind mode; called on startup)"""
+        if self.mode != 'write_behind' or self._task is not None:
+            return
+        self._db = db
+        self._flush_requested = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+        logger.info(
+            f"Write-behind generation store: batches of {self.batch_size}, every {self.interval}s, "
+            f"at most {self.max_pending} pending"
+        )
+
+    async def stop(self) -> None:
+        """Stop the flusher and write everything still queued (called on shutdown)"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Final flush failed, {len(self.records)} generation records lost: {e}")
+
+    async def save(self, db, record: Dict, experiment_id: Optional[str] = None) -> None:
+        """Persist a generation record (and count it as a run of ``experiment_id``)"""
+        if not self.buffering:
+            runs: ExperimentRuns = {experiment_id: (1, record['created_at'])} if experiment_id else {}
+            await self._write(db, [record], runs)
+            return
+
+        if len(self.records) >= self.max_pending:
+            # Backpressure: the queue is full, so this request waits for a flush
+            # (and fails, without queueing its record, if the flush does)
+            await self.flush()
+        self.records.append(record)
+        if experiment_id:
+            _add_runs(self.experiment_runs, experiment_id, 1, record['created_at'])
+        if len(self.records) >= self.batch_size:
+            self._flush_requested.set()
+
+    async def ensure_written(self, record_id: Optional[str] = None, experiment_id: Optional[str] = None) -> None:
+        """Flush if record ``record_id``, or a run of ``experiment_id``, is still queued"""
+        # A record stays queued until its batch is written, also while a flush is in progress
+        if self.buffering and any(
+            record['id'] == record_id or (experiment_id and record.get('experiment_id') == experiment_id)
+            for record in self.records
+        ):
+            await self.flush()
+
+    async def flush(self) -> int:
+        """Write all queued records and experiment updates; returns the records written"""
+        if self._flush_lock is None:
+            return 0
+        async with self._flush_lock:
+            written = 0
+            while self.records or self.experiment_runs:
+                records = self.records[:self.batch_size]
+                # Experiment updates go with the last batch, after their records
+                runs: ExperimentRuns = {}
+                if len(self.records) <= self.batch_size:
+                    runs, self.experiment_runs = self.experiment_runs, {}
+                try:
+                    await self._write(self._db, records, runs)
+                except Exception:
+                    for experiment_id, (count, run_at) in runs.items():
+                        _add_runs(self.experiment_runs, experiment_id, count, run_at)
+                    raise
+                # Records queued during the write were appended after these
+                del self.records[:len(records)]
+                written += len(records)
+            self.flushed += written
+            return written
+
+    async def _write(self, db, records: List[Dict], experiment_runs: ExperimentRuns) -> None:
+        while not self._open.is_set():
+            await self._open.wait()
+        self._writing += 1
+        self._idle.clear()
+        try:
+            await write_generations(db, records, experiment_runs)
+        finally:
+            self._writing -= 1
+            if not self._writing:
+                self._idle.set()
+
+    @asynccontextmanager
+    async def paused(self) -> AsyncIterator[None]:
+        """Hold generation writes while the block runs, once those in progress finish"""
+        async with self._pause_lock:
+            self._open.clear()
+            try:
+                await self._idle.wait()
+                yield
+            finally:
+                self._open.set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Write-behind flush failed ({len(self.records)} records pending): {e}")
+                await asyncio.sleep(WRITE_BEHIND_RETRY_DELAY)
+
+    def stats(self) -> Dict:
+        return {
+            'mode': self.mode,
+            'pending_records': len(self.records),
+            'pending_experiments': len(self.experiment_runs),
+            'flushed_records': self.flushed,
+        }
+
+
+_generation_store: Optional[GenerationStore] = None
+
+
+def get_generation_store() -> GenerationStore:
+    """Get the process-wide generation store"""
+    global _generation_store
+    if _generation_store is None:
+        _generation_store = GenerationStore()
+    return _generation_store
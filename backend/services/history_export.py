@@ -0,0 +1,179 @@
+"""
+History Export
+
+Streams generation_history as NDJSON, CSV or Parquet straight from a Mongo
+cursor. Documents are fetched and encoded in batches and each encoded batch
+is handed to the response as soon as it is ready, so memory use depends on
+the batch size, not on the number of records exported.
+
+- NDJSON: one generation record per line, as stored
+- CSV / Parquet: one row per model result, with the record's fields repeated
+
+Parquet needs the optional `pyarrow` package.
+"""
+
+import csv
+import io
+import json
+import logging
+import os
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is unavailable without pyarrow
+    pa = None
+    pq = None
+
+from services.timestamps import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+# Documents fetched from Mongo and encoded per batch (one Parquet row group each)
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+# Flattened columns: record fields, then result fields
+RECORD_COLUMNS = ['record_id', 'prompt', 'experiment_id', 'parent_id', 'root_id', 'created_at']
+RESULT_COLUMNS = ['model_name', 'smiles', 'confidence', 'execution_time', 'model_version', 'is_valid']
+EXPORT_COLUMNS = RECORD_COLUMNS + RESULT_COLUMNS
+
+
+def parquet_available() -> bool:
+    return pq is not None
+
+
+def flatten_record(doc: Dict, model: Optional[str] = None) -> List[Dict]:
+    """One row per result (only ``model``'s results if given)"""
+    record = {
+        'record_id': doc.get('id'),
+        'prompt': doc.get('prompt'),
+        'experiment_id': doc.get('experiment_id'),
+        'parent_id': doc.get('parent_id'),
+        'root_id': doc.get('root_id'),
+        'created_at': parse_timestamp(doc.get('created_at')),
+    }
+    rows = []
+    for result in doc.get('results', []):
+        if model and result.get('model_name') != model:
+            continue
+        rows.append({**record, **{column: result.get(column) for column in RESULT_COLUMNS}})
+    return rows
+
+
+def _json_default(value):
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+async def _batches(cursor) -> AsyncIterator[List[Dict]]:
+    batch = []
+    try:
+        async for doc in cursor:
+            batch.append(doc)
+            if len(batch) >= EXPORT_BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        # Also reached when the client disconnects mid-export
+        await cursor.close()
+
+
+async def export_ndjson(cursor, model: Optional[str] = None) -> AsyncIterator[bytes]:
+    async for batch in _batches(cursor):
+        yield ''.join(json.dumps(doc, default=_json_default) + '\n' for doc in batch).encode('utf-8')
+
+
+async def export_csv(cursor, model: Optional[str] = None) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS, extrasaction='ignore')
+    writer.writeheader()
+    async for batch in _batches(cursor):
+        for doc in batch:
+            writer.writerows(
+                {**row, 'created_at': row['created_at'] and row['created_at'].isoformat()}
+                for row in flatten_record(doc, model)
+            )
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that keeps written bytes until drained"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _parquet_schema():
+    return pa.schema([
+        ('record_id', pa.string()),
+        ('prompt', pa.string()),
+        ('experiment_id', pa.string()),
+        ('parent_id', pa.string()),
+        ('root_id', pa.string()),
+        ('created_at', pa.timestamp('ms', tz='UTC')),
+        ('model_name', pa.string()),
+        ('smiles', pa.string()),
+        ('confidence', pa.float64()),
+        ('execution_time', pa.float64()),
+        ('model_version', pa.string()),
+        ('is_valid', pa.bool_()),
+    ])
+
+
+async def export_parquet(cursor, model: Optional[str] = None) -> AsyncIterator[bytes]:
+    # Parquet is written sequentially (row groups, then the footer), so each
+    # row group can be sent as soon as it is encoded
+    schema = _parquet_schema()
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression='snappy')
+    try:
+        async for batch in _batches(cursor):
+            rows = [row for doc in batch for row in flatten_record(doc, model)]
+            if rows:
+                writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+EXPORTERS = {
+    'ndjson': export_ndjson,
+    'csv': export_csv,
+    'parquet': export_parquet,
+}
+
+
+def export_stream(cursor, fmt: str, model: Optional[str] = None) -> AsyncIterator[bytes]:
+    """Encoded chunks of the documents from ``cursor`` in format ``fmt``"""
+    return EXPORTERS[fmt](cursor.batch_size(EXPORT_BATCH_SIZE), model)
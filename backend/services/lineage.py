@@ -0,0 +1,140 @@
+"""
+Regeneration Lineage
+
+Regenerating a record creates a new version linked to it by `parent_id`;
+every version also stores the `root_id` of its tree (originals have neither
+and are their own root). A record's whole version tree is then one
+aggregation: the root, plus its descendants from a depth-limited $graphLookup
+over the `parent_id` index.
+
+Records regenerated before `root_id` was stored get it from migration 6,
+which resolves each one's root with an ancestors $graphLookup.
+"""
+
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from pymongo import UpdateOne
+
+from services.timestamps import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+# Deepest regeneration tree level returned by a lineage query
+LINEAGE_MAX_DEPTH = 50
+
+# Sort position of a version whose created_at is missing or unreadable
+UNKNOWN_CREATED_AT = datetime.min.replace(tzinfo=timezone.utc)
+
+
+async def resolve_root_ids(db, query: Dict) -> Dict[str, str]:
+    """Root id of each record matching ``query``, found by walking up parent_id links"""
+    pipeline = [
+        {"$match": query},
+        {"$graphLookup": {
+            "from": "generation_history",
+            "startWith": "$parent_id",
+            "connectFromField": "parent_id",
+            "connectToField": "id",
+            "as": "ancestors",
+            "depthField": "depth",
+        }},
+        {"$project": {"_id": 0, "id": 1, "parent_id": 1, "ancestors.id": 1, "ancestors.parent_id": 1, "ancestors.depth": 1}},
+    ]
+    roots = {}
+    async for doc in db.generation_history.aggregate(pipeline, allowDiskUse=True):
+        top = max(doc['ancestors'], key=lambda a: a['depth'], default=doc)
+        # A deleted ancestor is still the root its descendants point to
+        roots[doc['id']] = top.get('parent_id') or top['id']
+    return roots
+
+
+async def backfill_root_ids(db, batch_size: int) -> int:
+    """Store root_id on regenerated records that lack it; returns the count updated"""
+    roots = await resolve_root_ids(db, {"parent_id": {"$type": "string"}, "root_id": None})
+    updates = [UpdateOne({"id": record_id}, {"$set": {"root_id": root_id}}) for record_id, root_id in roots.items()]
+    for start in range(0, len(updates), batch_size):
+        await db.generation_history.bulk_write(updates[start:start + batch_size], ordered=False)
+    if updates:
+        logger.info(f"Stored root_id on {len(updates)} regenerated records")
+    return len(updates)
+
+
+async def lineage_root_id(db, record: Dict) -> str:
+    """Root of the regeneration tree ``record`` belongs to"""
+    if record.get('root_id'):
+        return record['root_id']
+    if not record.get('parent_id'):
+        return record['id']
+    # Regenerated before root_id was stored, and not migrated yet
+    roots = await resolve_root_ids(db, {"id": record['id']})
+    return roots.get(record['id'], record['id'])
+
+
+async def get_lineage(db, record_id: str, max_depth: int = LINEAGE_MAX_DEPTH) -> Optional[Dict]:
+    """
+    The regeneration tree containing ``record_id``, root first, down to
+    ``max_depth`` levels below the root; None if the record does not exist.
+    """
+    pipeline = [
+        {"$match": {"id": record_id}},
+        {"$addFields": {"lineage_root": {"$ifNull": ["$root_id", "$id"]}}},
+        {"$lookup": {
+            "from": "generation_history",
+            "localField": "lineage_root",
+            "foreignField": "id",
+            "as": "root",
+        }},
+        # Depth 0 are the root's children; one level more than returned, to detect truncation
+        {"$graphLookup": {
+            "from": "generation_history",
+            "startWith": "$lineage_root",
+            "connectFromField": "id",
+            "connectToField": "parent_id",
+            "as": "descendants",
+            "maxDepth": max_depth,
+            "depthField": "depth",
+        }},
+        {"$project": {"_id": 0, "lineage_root": 1, "root": 1, "descendants": 1}},
+    ]
+    docs = await db.generation_history.aggregate(pipeline).to_list(length=1)
+    if not docs:
+        return None
+    doc = docs[0]
+
+    versions = [{**version, 'depth': 0} for version in doc['root']]
+    truncated = False
+    for version in doc['descendants']:
+        depth = version['depth'] + 1
+        if depth > max_depth:
+            truncated = True
+            continue
+        versions.append({**version, 'depth': depth})
+    versions.sort(key=lambda v: (v['depth'], parse_timestamp(v.get('created_at')) or UNKNOWN_CREATED_AT))
+    for version in versions:
+        version.pop('_id', None)
+
+    return {
+        'record_id': record_id,
+        'root_id': doc['lineage_root'],
+        'truncated': truncated,
+        'versions': versions,
+        'comparison': compare_versions(versions),
+    }
+
+
+def compare_versions(versions: List[Dict]) -> Dict[str, List[Optional[Dict]]]:
+    """Per model, its result in each version (None where it was not run), in version order"""
+    models: List[str] = []
+    for version in versions:
+        for result in version.get('results', []):
+            if result['model_name'] not in models:
+                models.append(result['model_name'])
+    comparison = {}
+    for model_name in models:
+        comparison[model_name] = [
+            next((r for r in version.get('results', []) if r['model_name'] == model_name), None)
+            for version in versions
+        ]
+    return comparison
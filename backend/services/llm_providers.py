@@ -0,0 +1,312 @@
+"""
+LLM Providers
+
+Provider abstraction for the knowledge chat and molecule-to-text features.
+Model, endpoint, timeout and retries come from the environment:
+- LLM_PROVIDER: 'litellm' (default) or 'openai_compatible'
+- LLM_MODEL: default model name (gpt-4o)
+- LLM_API_BASE: base URL of an OpenAI-compatible server, e.g. the local
+  stand-in (llm_standin.py) at http://localhost:5010/v1
+- LLM_TIMEOUT, LLM_MAX_RETRIES
+
+'openai_compatible' talks to the endpoint directly over aiohttp, which keeps
+client overhead minimal when benchmarking against the stand-in.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, List, Optional
+
+import aiohttp
+import litellm
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+LLM_PROVIDER = os.environ.get('LLM_PROVIDER', 'litellm')
+LLM_MODEL = os.environ.get('LLM_MODEL', 'gpt-4o')
+LLM_API_BASE = os.environ.get('LLM_API_BASE') or None
+LLM_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', 60))
+LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', 2))
+
+# First retry waits this long, doubling each attempt (seconds)
+LLM_RETRY_BACKOFF = 0.5
+
+
+@dataclass
+class LLMCompletion:
+    """Standard result from any provider"""
+    content: str
+    model: str
+    latency_ms: float
+    usage: Dict = field(default_factory=dict)
+
+
+class LLMProviderError(Exception):
+    """
+    Provider call failed. ``retryable`` marks transient failures,
+    ``rate_limited`` a 429 from the provider with its Retry-After (seconds).
+    """
+
+    def __init__(
+        self,
+        message: str,
+        retryable: bool = True,
+        rate_limited: bool = False,
+        retry_after: Optional[float] = None,
+    ):
+        super().__init__(message)
+        self.retryable = retryable
+        self.rate_limited = rate_limited
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After header in seconds (HTTP dates are ignored)"""
+    try:
+        return max(0.0, float(value)) if value else None
+    except ValueError:
+        return None
+
+
+class LLMProvider(ABC):
+    """Abstract base class for chat completion providers"""
+
+    def __init__(
+        self,
+        model: str = LLM_MODEL,
+        api_base: Optional[str] = LLM_API_BASE,
+        timeout: float = LLM_TIMEOUT,
+        max_retries: int = LLM_MAX_RETRIES,
+    ):
+        self.model = model
+        self.api_base = api_base
+        self.timeout = timeout
+        self.max_retries = max_retries
+
+    async def close(self) -> None:
+        """Release pooled connections"""
+        pass
+
+    @abstractmethod
+    async def _complete(self, messages: List[Dict], model: str, max_tokens: Optional[int]) -> LLMCompletion:
+        pass
+
+    @abstractmethod
+    def _stream(self, messages: List[Dict], model: str) -> AsyncIterator[str]:
+        pass
+
+    async def complete(
+        self,
+        messages: List[Dict],
+        model: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+    ) -> LLMCompletion:
+        """Chat completion, retried with exponential backoff on transient errors"""
+        model = model or self.model
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self._complete(messages, model, max_tokens)
+            except LLMProviderError as e:
+                if not e.retryable or attempt == self.max_retries:
+                    raise
+                delay = max(LLM_RETRY_BACKOFF * 2 ** attempt, e.retry_after or 0)
+                logger.warning(f"{model} call failed ({e}); retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def stream(self, messages: List[Dict], model: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        Stream completion text chunks. Retries only happen before the first
+        chunk, since a partial answer has already reached the caller.
+        """
+        model = model or self.model
+        for attempt in range(self.max_retries + 1):
+            started = False
+            try:
+                async for chunk in self._stream(messages, model):
+                    started = True
+                    yield chunk
+                return
+            except LLMProviderError as e:
+                if started or not e.retryable or attempt == self.max_retries:
+                    raise
+                delay = max(LLM_RETRY_BACKOFF * 2 ** attempt, e.retry_after or 0)
+                logger.warning(f"{model} stream failed ({e}); retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+
+# litellm errors that will not go away by retrying
+_LITELLM_FATAL_ERRORS = (
+    litellm.BadRequestError,
+    litellm.AuthenticationError,
+    litellm.NotFoundError,
+    litellm.PermissionDeniedError,
+)
+
+
+def _litellm_error(e: Exception) -> LLMProviderError:
+    if isinstance(e, litellm.RateLimitError):
+        headers = getattr(getattr(e, 'response', None), 'headers', None) or {}
+        return LLMProviderError(str(e), rate_limited=True, retry_after=parse_retry_after(headers.get('retry-after')))
+    return LLMProviderError(str(e), retryable=not isinstance(e, _LITELLM_FATAL_ERRORS))
+
+
+class LiteLLMProvider(LLMProvider):
+    """Any provider litellm supports (OpenAI by default)"""
+
+    def _kwargs(self, model: str) -> Dict:
+        kwargs = {'model': model, 'timeout': self.timeout}
+        if self.api_base:
+            # OpenAI-compatible endpoint, e.g. the local stand-in
+            kwargs['api_base'] = self.api_base
+            kwargs['custom_llm_provider'] = 'openai'
+            kwargs.setdefault('api_key', os.environ.get('OPENAI_API_KEY') or 'standin')
+        return kwargs
+
+    async def _complete(self, messages: List[Dict], model: str, max_tokens: Optional[int]) -> LLMCompletion:
+        kwargs = self._kwargs(model)
+        if max_tokens:
+            kwargs['max_tokens'] = max_tokens
+        started = time.perf_counter()
+        try:
+            response = await litellm.acompletion(messages=messages, **kwargs)
+        except Exception as e:
+            raise _litellm_error(e) from e
+
+        usage = getattr(response, 'usage', None)
+        return LLMCompletion(
+            content=response.choices[0].message.content,
+            model=model,
+            latency_ms=(time.perf_counter() - started) * 1000,
+            usage=dict(usage) if usage else {},
+        )
+
+    async def _stream(self, messages: List[Dict], model: str) -> AsyncIterator[str]:
+        try:
+            response = await litellm.acompletion(messages=messages, stream=True, **self._kwargs(model))
+            async for chunk in response:
+                token = chunk.choices[0].delta.content if chunk.choices else None
+                if token:
+                    yield token
+        except Exception as e:
+            raise _litellm_error(e) from e
+
+
+class OpenAICompatibleProvider(LLMProvider):
+    """Direct HTTP client for an OpenAI-compatible /chat/completions endpoint"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not self.api_base:
+            self.api_base = 'https://api.openai.com/v1'
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # One pooled session per provider, bound to the loop that created it
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            api_key = os.environ.get('OPENAI_API_KEY') or 'standin'
+            self._session = aiohttp.ClientSession(headers={'Authorization': f'Bearer {api_key}'})
+            self._session_loop = loop
+        return self._session
+
+    async def _post(self, payload: Dict) -> aiohttp.ClientResponse:
+        try:
+            response = await self._get_session().post(
+                f"{self.api_base.rstrip('/')}/chat/completions",
+                json=payload,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise LLMProviderError(f"{type(e).__name__}: {e}") from e
+        if response.status != 200:
+            body = await response.text()
+            response.release()
+            raise LLMProviderError(
+                f"HTTP {response.status}: {body[:200]}",
+                retryable=response.status == 429 or response.status >= 500,
+                rate_limited=response.status == 429,
+                retry_after=parse_retry_after(response.headers.get('Retry-After')),
+            )
+        return response
+
+    async def _complete(self, messages: List[Dict], model: str, max_tokens: Optional[int]) -> LLMCompletion:
+        payload = {'model': model, 'messages': messages}
+        if max_tokens:
+            payload['max_tokens'] = max_tokens
+        started = time.perf_counter()
+        response = await self._post(payload)
+        try:
+            data = await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            raise LLMProviderError(f"{type(e).__name__}: {e}") from e
+        finally:
+            response.release()
+        return LLMCompletion(
+            content=data['choices'][0]['message']['content'],
+            model=data.get('model', model),
+            latency_ms=(time.perf_counter() - started) * 1000,
+            usage=data.get('usage') or {},
+        )
+
+    async def _stream(self, messages: List[Dict], model: str) -> AsyncIterator[str]:
+        response = await self._post({'model': model, 'messages': messages, 'stream': True})
+        try:
+            # Server-Sent Events: "data: {json}" lines, terminated by "data: [DONE]"
+            async for raw_line in response.content:
+                line = raw_line.decode('utf-8').strip()
+                if not line.startswith('data:'):
+                    continue
+                data = line[5:].strip()
+                if data == '[DONE]':
+                    return
+                choices = json.loads(data).get('choices') or [{}]
+                token = choices[0].get('delta', {}).get('content')
+                if token:
+                    yield token
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            # ValueError: a chunk that is not valid UTF-8 or JSON
+            raise LLMProviderError(f"{type(e).__name__}: {e}") from e
+        finally:
+            response.release()
+
+    async def close(self) -> None:
+        if self._session is not None and self._session_loop is asyncio.get_running_loop():
+            await self._session.close()
+        self._session = None
+
+
+# Provider registry
+LLM_PROVIDERS = {
+    'litellm': LiteLLMProvider,
+    'openai_compatible': OpenAICompatibleProvider,
+}
+
+_llm_provider: Optional[LLMProvider] = None
+
+
+def get_llm_provider() -> LLMProvider:
+    """Get the configured provider"""
+    global _llm_provider
+    if _llm_provider is None:
+        if LLM_PROVIDER not in LLM_PROVIDERS:
+            raise ValueError(f"Unknown LLM provider: {LLM_PROVIDER}. Available: {list(LLM_PROVIDERS.keys())}")
+        _llm_provider = LLM_PROVIDERS[LLM_PROVIDER]()
+        logger.info(f"Using LLM provider {LLM_PROVIDER} ({_llm_provider.model})")
+    return _llm_provider
+
+
+async def close_llm_provider() -> None:
+    """Close the provider's connections (called on shutdown)"""
+    global _llm_provider
+    if _llm_provider is not None:
+        await _llm_provider.close()
+        _llm_provider = None
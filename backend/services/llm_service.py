@@ -1,23 +1,65 @@
 """
 LLM Service for RAG Chatbot and Molecule-to-Text Generation
 
-Using OpenAI GPT-4o via litellm library
+Using OpenAI GPT-4o by default, through the provider configured in llm_providers.
+Each worker process creates one ModelRouter over its provider at startup
+(`Resources.model_router`), and the chat session store and mol2text generator
+on top of it.
 """
 
 import os
+import asyncio
 import logging
-from typing import Optional, List, Dict
+import time
+from collections import Counter, OrderedDict, deque
+from typing import AsyncIterator, Callable, Optional, List, Dict, Set, Tuple
 from dotenv import load_dotenv
-import litellm
+from services.llm_providers import LLM_MODEL, LLMCompletion, LLMProvider, LLMProviderError
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Chat sessions kept in memory per worker; evicted ones are rebuilt from chat_history
+CHAT_SESSION_MAX = int(os.environ.get('CHAT_SESSION_MAX', 1000))
+CHAT_SESSION_TTL = float(os.environ.get('CHAT_SESSION_TTL', 1800))
+
+# Characters of the first question kept as the session title
+CHAT_SESSION_TITLE_LENGTH = 100
+
+# Most recent stored messages replayed into a rehydrated session
+CHAT_REHYDRATE_MESSAGES = 50
+
+# Token budget for the history sent with each question (system message, summary
+# and recent turns); older turns are folded into a rolling summary
+CHAT_CONTEXT_TOKENS = int(os.environ.get('CHAT_CONTEXT_TOKENS', 6000))
+CHAT_SUMMARY_MODEL = os.environ.get('CHAT_SUMMARY_MODEL', LLM_MODEL)
+CHAT_SUMMARY_MAX_TOKENS = 400
+
+# Fold only once this many messages have fallen out of the window
+CHAT_SUMMARY_MIN_MESSAGES = 4
+
+# Models tried, in order, after an endpoint's primary model when it is too slow or failing
+LLM_FALLBACK_MODELS = [m.strip() for m in os.environ.get('LLM_FALLBACK_MODELS', 'gpt-4o-mini').split(',') if m.strip()]
+
+# Latency SLO per endpoint (ms): whole completion, or time to first token when streaming.
+# A model whose p95 exceeds it is demoted, and a call running past it falls back.
+LLM_ENDPOINT_SLO_MS = {
+    'chat': float(os.environ.get('LLM_SLO_CHAT_MS', 15000)),
+    'chat_stream': float(os.environ.get('LLM_SLO_CHAT_STREAM_MS', 4000)),
+    'mol2text': float(os.environ.get('LLM_SLO_MOL2TEXT_MS', 20000)),
+}
+
+# Routing statistics cover this many recent seconds, so a demoted model is tried
+# first again once its slow samples expire
+LLM_ROUTER_WINDOW_SECONDS = 300
+LLM_ROUTER_MIN_SAMPLES = 5
+LLM_ROUTER_MAX_ERROR_RATE = 0.25
+
 # Get API key from environment
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY') or os.environ.get('EMERGENT_LLM_KEY')
 
-# Configure litellm
+# Configure the OpenAI key for the provider clients
 if OPENAI_API_KEY:
     os.environ['OPENAI_API_KEY'] = OPENAI_API_KEY
 
@@ -38,6 +80,17 @@ You have knowledge about:
 - Safety and handling information
 - Industrial and pharmaceutical applications"""
 
+# Model and prompt revision for molecule descriptions; both are part of the
+# mol2text cache key, so bump the version when the prompt below changes
+MOL2TEXT_MODEL = os.environ.get('MOL2TEXT_MODEL', LLM_MODEL)
+MOL2TEXT_PROMPT_VERSION = 1
+
+# Batch descriptions: starting (and maximum) number of concurrent LLM calls, how
+# often a rate-limited molecule is retried, and the first pause after a 429 (seconds)
+MOL2TEXT_BATCH_CONCURRENCY = int(os.environ.get('MOL2TEXT_BATCH_CONCURRENCY', 4))
+MOL2TEXT_BATCH_RETRIES = 3
+MOL2TEXT_BATCH_BACKOFF = 2.0
+
 MOL2TEXT_SYSTEM_MESSAGE = """You are an expert chemistry assistant that describes molecular structures.
 
 When given a SMILES notation or molecule name:
@@ -50,51 +103,406 @@ When given a SMILES notation or molecule name:
 Provide responses in a structured, educational format."""
 
 
+CHAT_SUMMARY_SYSTEM_MESSAGE = """You maintain a running summary of a conversation between a user and a chemistry assistant.
+Merge the existing summary with the new conversation turns into one concise summary.
+Keep molecule names, SMILES, numbers and any conclusions or open questions. Write in third person."""
+
+
+# Running summary folds, kept referenced until done: a session evicted from the
+# store meanwhile must not take its task with it
+_summary_tasks: Set[asyncio.Task] = set()
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token plus per-message overhead)"""
+    return len(text) // 4 + 4
+
+
+class ModelLatencyStats:
+    """Latency and error samples of one model over a sliding time window"""
+
+    def __init__(self, window: float = LLM_ROUTER_WINDOW_SECONDS):
+        self.window = window
+        self._samples: deque = deque()  # (timestamp, latency_ms, ok)
+
+    def record(self, latency_ms: float, ok: bool) -> None:
+        self._samples.append((time.monotonic(), latency_ms, ok))
+        self._trim()
+
+    def _trim(self) -> None:
+        cutoff = time.monotonic() - self.window
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+
+    def __len__(self) -> int:
+        self._trim()
+        return len(self._samples)
+
+    def percentile(self, q: float) -> Optional[float]:
+        self._trim()
+        latencies = sorted(latency for _, latency, _ in self._samples)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+    def error_rate(self) -> float:
+        self._trim()
+        if not self._samples:
+            return 0.0
+        return sum(1 for _, _, ok in self._samples if not ok) / len(self._samples)
+
+    def summary(self) -> Dict:
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {
+            'samples': len(self),
+            'p50_ms': round(p50, 1) if p50 is not None else None,
+            'p95_ms': round(p95, 1) if p95 is not None else None,
+            'error_rate': round(self.error_rate(), 3),
+        }
+
+
+class ModelRouter:
+    """
+    Latency-aware model selection with fallback.
+
+    For each call the endpoint's primary model is tried first unless its
+    recent p95 latency exceeds the endpoint SLO or it is failing too often;
+    a call that errors or runs past the SLO falls back to the next model.
+    Latency is kept per endpoint and model, and is the metric that endpoint's
+    SLO describes (whole completion, or time to first token when streaming),
+    so a model slow on one endpoint is not demoted on another.
+    """
+
+    def __init__(
+        self,
+        provider: LLMProvider,
+        fallback_models: List[str] = LLM_FALLBACK_MODELS,
+        slo_ms: Dict[str, float] = LLM_ENDPOINT_SLO_MS,
+    ):
+        self.provider = provider
+        self.fallback_models = fallback_models
+        self.slo_ms = slo_ms
+        self.stats: Dict[Tuple[str, str], ModelLatencyStats] = {}  # (endpoint, model) -> samples
+        self.decisions: Dict[str, Counter] = {}
+
+    def _stats(self, endpoint: str, model: str) -> ModelLatencyStats:
+        if (endpoint, model) not in self.stats:
+            self.stats[(endpoint, model)] = ModelLatencyStats()
+        return self.stats[(endpoint, model)]
+
+    def _healthy(self, endpoint: str, model: str, slo: float) -> bool:
+        stats = self._stats(endpoint, model)
+        if len(stats) < LLM_ROUTER_MIN_SAMPLES:
+            return True
+        return stats.percentile(0.95) <= slo and stats.error_rate() <= LLM_ROUTER_MAX_ERROR_RATE
+
+    def candidates(self, endpoint: str, model: Optional[str] = None) -> List[str]:
+        """Models to try in order: healthy ones by preference, then the rest"""
+        models = list(dict.fromkeys([model or LLM_MODEL] + self.fallback_models))
+        slo = self.slo_ms.get(endpoint)
+        if slo is None:
+            return models
+        healthy = [m for m in models if self._healthy(endpoint, m, slo)]
+        return healthy + [m for m in models if m not in healthy]
+
+    def _record(self, endpoint: str, model: str, started: float, ok: bool) -> None:
+        self._stats(endpoint, model).record((time.perf_counter() - started) * 1000, ok)
+
+    def _decide(self, endpoint: str, primary: str, model: Optional[str]) -> None:
+        outcome = 'failed' if model is None else 'primary' if model == primary else f'fallback:{model}'
+        self.decisions.setdefault(endpoint, Counter())[outcome] += 1
+        if outcome != 'primary':
+            logger.info(f"LLM route {endpoint}: {outcome} (primary {primary})")
+
+    def _budget(self, endpoint: str, is_last: bool) -> Optional[float]:
+        # The last candidate runs to the provider timeout instead of the SLO
+        slo = self.slo_ms.get(endpoint)
+        return None if is_last or slo is None else slo / 1000
+
+    async def complete(
+        self,
+        endpoint: str,
+        messages: List[Dict],
+        model: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+    ) -> LLMCompletion:
+        """Chat completion from the first candidate to answer within the SLO"""
+        primary = model or LLM_MODEL
+        candidates = self.candidates(endpoint, primary)
+        last_error: Optional[Exception] = None
+        for i, candidate in enumerate(candidates):
+            started = time.perf_counter()
+            try:
+                completion = await asyncio.wait_for(
+                    self.provider.complete(messages, model=candidate, max_tokens=max_tokens),
+                    self._budget(endpoint, i == len(candidates) - 1)
+                )
+            except (LLMProviderError, asyncio.TimeoutError) as e:
+                self._record(endpoint, candidate, started, ok=False)
+                logger.warning(f"{candidate} failed for {endpoint}: {str(e) or 'over SLO'}")
+                last_error = e
+                continue
+            self._record(endpoint, candidate, started, ok=True)
+            self._decide(endpoint, primary, candidate)
+            return completion
+
+        self._decide(endpoint, primary, None)
+        raise last_error
+
+    async def stream(
+        self,
+        endpoint: str,
+        messages: List[Dict],
+        model: Optional[str] = None,
+        on_route: Optional[Callable[[str], None]] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Stream from the first candidate to produce a token within the SLO.
+        Once a token is out there is no fallback; ``on_route`` receives the
+        model that answered.
+        """
+        primary = model or LLM_MODEL
+        candidates = self.candidates(endpoint, primary)
+        last_error: Optional[Exception] = None
+        for i, candidate in enumerate(candidates):
+            started = time.perf_counter()
+            chunks = self.provider.stream(messages, model=candidate)
+            try:
+                first = await asyncio.wait_for(anext(chunks, None), self._budget(endpoint, i == len(candidates) - 1))
+            except (LLMProviderError, asyncio.TimeoutError) as e:
+                await chunks.aclose()
+                self._record(endpoint, candidate, started, ok=False)
+                logger.warning(f"{candidate} failed for {endpoint}: {str(e) or 'over SLO'}")
+                last_error = e
+                continue
+
+            # Time to first token is what the streaming SLO measures
+            self._record(endpoint, candidate, started, ok=True)
+            self._decide(endpoint, primary, candidate)
+            if on_route:
+                on_route(candidate)
+            if first is not None:
+                yield first
+                async for token in chunks:
+                    yield token
+            return
+
+        self._decide(endpoint, primary, None)
+        raise last_error
+
+    def snapshot(self) -> Dict:
+        """Per-endpoint model latency and routing decisions"""
+        models: Dict[str, Dict] = {}
+        for (endpoint, model), stats in self.stats.items():
+            models.setdefault(endpoint, {})[model] = stats.summary()
+        return {
+            'slo_ms': self.slo_ms,
+            'fallback_models': self.fallback_models,
+            'models': models,
+            'decisions': {endpoint: dict(counts) for endpoint, counts in self.decisions.items()},
+        }
+
+
 class MoleculeKnowledgeChat:
     """RAG-powered chatbot for molecular chemistry knowledge"""
     
-    def __init__(self, session_id: str):
+    def __init__(self, session_id: str, router: ModelRouter, context_tokens: int = CHAT_CONTEXT_TOKENS):
         self.session_id = session_id
+        self.router = router
+        self.context_tokens = context_tokens
         self.messages: List[Dict] = [
             {"role": "system", "content": CHEMISTRY_SYSTEM_MESSAGE}
         ]
+        self.summary: Optional[str] = None
+        # Stored messages before the in-memory turns (folded into the summary, or
+        # older than the rehydrated window); saved with the summary so a rehydrated
+        # session resumes after them
+        self.history_offset = 0
+        self._summary_task: Optional[asyncio.Task] = None
     
+    def _split_context(self) -> Tuple[List[Dict], List[Dict]]:
+        """Split the turns into (older turns outside the budget, recent turns that fit)"""
+        budget = self.context_tokens - estimate_tokens(self.messages[0]["content"])
+        if self.summary:
+            budget -= estimate_tokens(self.summary)
+
+        turns = self.messages[1:]
+        start, used = len(turns), 0
+        while start > 0:
+            cost = estimate_tokens(turns[start - 1]["content"])
+            # The latest message is always sent, even if it alone exceeds the budget
+            if used + cost > budget and start < len(turns):
+                break
+            used += cost
+            start -= 1
+        # Start the window on a question rather than a dangling answer
+        while start < len(turns) - 1 and turns[start]["role"] == "assistant":
+            start += 1
+        return turns[:start], turns[start:]
+
+    def context_messages(self) -> List[Dict]:
+        """Messages to send: system message, rolling summary and recent turns within budget"""
+        _, recent = self._split_context()
+        messages = [self.messages[0]]
+        if self.summary:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{self.summary}"})
+        return messages + recent
+
+    def _schedule_summary(self) -> None:
+        """Fold turns that left the window into the summary, off the request path"""
+        if self._summary_task is not None and not self._summary_task.done():
+            return
+        older, _ = self._split_context()
+        if len(older) >= CHAT_SUMMARY_MIN_MESSAGES:
+            self._summary_task = asyncio.create_task(self._fold_into_summary(older))
+            _summary_tasks.add(self._summary_task)
+            self._summary_task.add_done_callback(_summary_tasks.discard)
+
+    async def _fold_into_summary(self, older: List[Dict]) -> None:
+        transcript = "\n\n".join(f"{m['role']}: {m['content']}" for m in older)
+        try:
+            completion = await self.router.provider.complete(
+                [
+                    {"role": "system", "content": CHAT_SUMMARY_SYSTEM_MESSAGE},
+                    {"role": "user", "content": f"Existing summary:\n{self.summary or '(none)'}\n\nNew turns:\n{transcript}"},
+                ],
+                model=CHAT_SUMMARY_MODEL,
+                max_tokens=CHAT_SUMMARY_MAX_TOKENS
+            )
+        except Exception as e:
+            logger.warning(f"Chat summary failed for {self.session_id}: {e}")
+            return
+
+        # New turns are only appended meanwhile, so the folded ones are still the prefix
+        if self.messages[1:1 + len(older)] == older:
+            self.summary = completion.content
+            del self.messages[1:1 + len(older)]
+            self.history_offset += len(older)
+
+    @staticmethod
+    def _user_message(question: str, context: Optional[str] = None) -> Dict:
+        # Build message with optional context
+        message_text = question
+        if context:
+            message_text = f"Context: {context}\n\nQuestion: {question}"
+        return {"role": "user", "content": message_text}
+
+    def _index_of(self, message: Dict) -> Optional[int]:
+        # By identity: another request on the session may have added an equal message
+        return next((i for i, m in enumerate(self.messages) if m is message), None)
+
+    def _answer(self, question: Dict, answer: str) -> None:
+        """Record ``answer`` right after its question, even if other turns were added meanwhile"""
+        position = self._index_of(question)
+        reply = {"role": "assistant", "content": answer}
+        if position is None:
+            # The question was folded into the summary meanwhile
+            self.messages.append(reply)
+        else:
+            self.messages.insert(position + 1, reply)
+        self._schedule_summary()
+
+    def _withdraw(self, question: Dict) -> None:
+        """Drop an unanswered question so the history stays paired"""
+        position = self._index_of(question)
+        if position is not None:
+            del self.messages[position]
+
     async def ask(self, question: str, context: Optional[str] = None) -> Dict:
         """Ask a question to the chemistry chatbot"""
+        user_msg = self._user_message(question, context)
         try:
-            # Build message with optional context
-            message_text = question
-            if context:
-                message_text = f"Context: {context}\n\nQuestion: {question}"
+            self.messages.append(user_msg)
             
-            self.messages.append({"role": "user", "content": message_text})
-            
-            response = await litellm.acompletion(
-                model="gpt-4o",
-                messages=self.messages
-            )
+            completion = await self.router.complete('chat', self.context_messages())
             
-            answer = response.choices[0].message.content
-            self.messages.append({"role": "assistant", "content": answer})
+            answer = completion.content
+            self._answer(user_msg, answer)
             
             return {
                 'success': True,
                 'answer': answer,
+                'model': completion.model,
                 'session_id': self.session_id
             }
         except Exception as e:
             logger.error(f"Chat error: {e}")
+            self._withdraw(user_msg)
             return {
                 'success': False,
                 'error': str(e),
                 'session_id': self.session_id
             }
 
+    async def ask_stream(
+        self,
+        question: str,
+        context: Optional[str] = None,
+        on_route: Optional[Callable[[str], None]] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Ask a question and yield the answer token by token as the model
+        generates it; ``on_route`` receives the model that answers.
+
+        Whatever was generated is kept in the session history when the stream
+        ends, including when the consumer stops early.
+        """
+        user_msg = self._user_message(question, context)
+        self.messages.append(user_msg)
+        parts: List[str] = []
+        try:
+            async for token in self.router.stream('chat_stream', self.context_messages(), on_route=on_route):
+                parts.append(token)
+                yield token
+        finally:
+            if parts:
+                self._answer(user_msg, "".join(parts))
+            else:
+                self._withdraw(user_msg)
+
+
+class ConcurrencyWindow:
+    """
+    Adaptive limit on concurrent provider calls (AIMD): a rate-limited call
+    halves the window and pauses new calls, each success grows it back by
+    1/window up to ``limit``.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.size = float(self.limit)
+        self._in_flight = 0
+        self._resume_at = 0.0
+        self._changed = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        while True:
+            pause = self._resume_at - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            async with self._changed:
+                if self._in_flight < int(self.size):
+                    self._in_flight += 1
+                    return
+                await self._changed.wait()
+
+    async def release(self, rate_limited: bool = False, pause: float = 0.0) -> None:
+        async with self._changed:
+            self._in_flight -= 1
+            if rate_limited:
+                self.size = max(1.0, self.size / 2)
+                self._resume_at = max(self._resume_at, time.monotonic() + pause)
+            else:
+                self.size = min(float(self.limit), self.size + 1 / self.size)
+            self._changed.notify_all()
+
 
 class MoleculeToTextGenerator:
     """Generate natural language descriptions from molecules"""
     
-    def __init__(self):
+    def __init__(self, router: ModelRouter):
+        self.router = router
         self.system_message = MOL2TEXT_SYSTEM_MESSAGE
     
     async def generate_description(self, smiles: str, additional_info: Optional[str] = None) -> Dict:
@@ -118,42 +526,128 @@ Please provide:
                 {"role": "user", "content": prompt}
             ]
             
-            response = await litellm.acompletion(
-                model="gpt-4o",
-                messages=messages
-            )
+            completion = await self.router.complete('mol2text', messages, model=MOL2TEXT_MODEL)
             
-            description = response.choices[0].message.content
+            description = completion.content
             
             return {
                 'success': True,
                 'smiles': smiles,
-                'description': description
+                'description': description,
+                'model': completion.model  # Differs from MOL2TEXT_MODEL if the router fell back
             }
         except Exception as e:
             logger.error(f"Mol2Text error: {e}")
             return {
                 'success': False,
                 'smiles': smiles,
-                'error': str(e)
+                'error': str(e),
+                'rate_limited': isinstance(e, LLMProviderError) and e.rate_limited,
+                'retry_after': getattr(e, 'retry_after', None)
             }
 
+    async def generate_batch(
+        self,
+        smiles_list: List[str],
+        additional_info: Optional[str] = None,
+        max_concurrency: int = MOL2TEXT_BATCH_CONCURRENCY,
+    ) -> AsyncIterator[Dict]:
+        """
+        Generate descriptions for many molecules, yielding each result as it
+        completes. Concurrency adapts to provider rate limits; rate-limited
+        molecules are retried after a backoff.
+        """
+        window = ConcurrencyWindow(max_concurrency)
+
+        async def describe(smiles: str) -> Dict:
+            for attempt in range(MOL2TEXT_BATCH_RETRIES + 1):
+                await window.acquire()
+                result = None
+                try:
+                    result = await self.generate_description(smiles, additional_info)
+                finally:
+                    rate_limited = bool(result and result.get('rate_limited'))
+                    pause = max(MOL2TEXT_BATCH_BACKOFF * 2 ** attempt, (result or {}).get('retry_after') or 0)
+                    await window.release(rate_limited, pause)
+                if not rate_limited:
+                    break
+                logger.warning(f"Mol2Text rate limited for {smiles}; window now {int(window.size)}")
+            return result
+
+        tasks = [asyncio.create_task(describe(smiles)) for smiles in smiles_list]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # The consumer stopped early (client disconnected)
+            for task in tasks:
+                task.cancel()
+
+
+class ChatSessionStore:
+    """
+    LRU + TTL bounded store of chat sessions.
+
+    A session that is not in memory (evicted, expired, or served by another
+    worker until now) is rebuilt from its stored `chat_history` messages.
+    """
+
+    def __init__(self, router: ModelRouter, max_sessions: int = CHAT_SESSION_MAX, ttl: float = CHAT_SESSION_TTL):
+        self.router = router
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, MoleculeKnowledgeChat]" = OrderedDict()
+        self._last_used: Dict[str, float] = {}
+
+    async def get(self, db, session_id: str) -> MoleculeKnowledgeChat:
+        """Get a session, rehydrating it from the database on a miss"""
+        self._expire()
+        chat = self._sessions.get(session_id)
+        if chat is None:
+            chat = await self._rehydrate(db, session_id)
+            # Another request may have loaded it while we were waiting
+            chat = self._sessions.get(session_id) or chat
+        self._sessions[session_id] = chat
+        self._sessions.move_to_end(session_id)
+        self._last_used[session_id] = time.monotonic()
 
-# Singleton instances
-_chat_sessions: Dict[str, MoleculeKnowledgeChat] = {}
-_mol2text_generator: Optional[MoleculeToTextGenerator] = None
+        while len(self._sessions) > self.max_sessions:
+            evicted, _ = self._sessions.popitem(last=False)
+            self._last_used.pop(evicted, None)
+        return chat
 
+    async def _rehydrate(self, db, session_id: str) -> MoleculeKnowledgeChat:
+        chat = MoleculeKnowledgeChat(session_id, self.router)
+        session = await db.chat_sessions.find_one(
+            {"session_id": session_id}, {"_id": 0, "message_count": 1, "context_summary": 1, "history_offset": 1}
+        ) or {}
+        chat.summary = session.get("context_summary")
+        # Messages already folded into the stored summary are not replayed
+        limit = CHAT_REHYDRATE_MESSAGES
+        if chat.summary:
+            limit = min(limit, session.get("message_count", 0) - session.get("history_offset", 0))
+        history = []
+        if limit > 0:
+            cursor = db.chat_history.find(
+                {"session_id": session_id}, {"_id": 0, "role": 1, "content": 1}
+            ).sort("created_at", -1).limit(limit)
+            history = await cursor.to_list(length=limit)
+        chat.messages.extend({"role": m["role"], "content": m["content"]} for m in reversed(history))
+        chat.history_offset = max(session.get("message_count", 0) - len(history), 0)
+        if history:
+            logger.info(f"Rehydrated chat session {session_id} with {len(history)} messages")
+        return chat
 
-def get_chat_session(session_id: str) -> MoleculeKnowledgeChat:
-    """Get or create a chat session"""
-    if session_id not in _chat_sessions:
-        _chat_sessions[session_id] = MoleculeKnowledgeChat(session_id)
-    return _chat_sessions[session_id]
+    def _expire(self) -> None:
+        cutoff = time.monotonic() - self.ttl
+        # Sessions are ordered by last use, so expired ones are at the front
+        while self._sessions:
+            session_id = next(iter(self._sessions))
+            if self._last_used.get(session_id, 0) > cutoff:
+                break
+            self._sessions.popitem(last=False)
+            self._last_used.pop(session_id, None)
 
+    def __len__(self) -> int:
+        return len(self._sessions)
 
-def get_mol2text_generator() -> MoleculeToTextGenerator:
-    """Get the molecule-to-text generator"""
-    global _mol2text_generator
-    if _mol2text_generator is None:
-        _mol2text_generator = MoleculeToTextGenerator()
-    return _mol2text_generator
@@ -22,6 +22,30 @@ from rdkit import Chem
 
 logger = logging.getLogger(__name__)
 
+# Connections kept open to the model APIs (per worker process)
+MODEL_HTTP_POOL_SIZE = int(os.environ.get('MODEL_HTTP_POOL_SIZE', 100))
+
+_http_session: Optional[aiohttp.ClientSession] = None
+_http_session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """Pooled session for the model clients, bound to the loop that created it (created at startup)"""
+    global _http_session, _http_session_loop
+    loop = asyncio.get_running_loop()
+    if _http_session is None or _http_session.closed or _http_session_loop is not loop:
+        _http_session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=MODEL_HTTP_POOL_SIZE))
+        _http_session_loop = loop
+    return _http_session
+
+
+async def close_http_session() -> None:
+    """Close the model API connections (called on shutdown)"""
+    global _http_session
+    if _http_session is not None:
+        await _http_session.close()
+        _http_session = None
+
 @dataclass
 class ModelResult:
     """Standard result from any model"""
@@ -37,7 +61,8 @@ class ModelResult:
 class BaseModelClient(ABC):
     """Abstract base class for model clients"""
     
-    def __init__(self, api_url: str, model_name: str, timeout: int = 30):
+    def __init__(self, session: aiohttp.ClientSession, api_url: str, model_name: str, timeout: int = 30):
+        self.session = session  # The worker's pooled session (Resources.http_session)
         self.api_url = api_url
         self.model_name = model_name
         self.timeout = timeout
@@ -50,10 +75,9 @@ class BaseModelClient(ABC):
     async def health_check(self) -> bool:
         """Check if model service is available"""
         try:
-            async with aiohttp.ClientSession() as session:
-                health_url = self.api_url.replace('/api/text2mol', '/health')
-                async with session.get(health_url, timeout=5) as response:
-                    return response.status == 200
+            health_url = self.api_url.replace('/api/text2mol', '/health')
+            async with self.session.get(health_url, timeout=5) as response:
+                return response.status == 200
         except:
             return False
     
@@ -69,40 +93,39 @@ class BaseModelClient(ABC):
 class YourModelClient(BaseModelClient):
     """Client for Your Custom Model"""
     
-    def __init__(self):
+    def __init__(self, session: aiohttp.ClientSession):
         api_url = os.environ.get('YOUR_MODEL_API_URL', 'http://localhost:5001/api/text2mol')
-        super().__init__(api_url, 'your_model')
+        super().__init__(session, api_url, 'your_model')
     
     async def generate(self, text: str, options: Optional[Dict] = None) -> ModelResult:
         """Generate molecule using Your Model"""
         try:
-            async with aiohttp.ClientSession() as session:
-                payload = {
-                    'text': text,
-                    'options': options or {'num_samples': 1, 'temperature': 0.7}
-                }
+            payload = {
+                'text': text,
+                'options': options or {'num_samples': 1, 'temperature': 0.7}
+            }
                 
-                async with session.post(
-                    self.api_url, 
-                    json=payload, 
-                    timeout=self.timeout
-                ) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        if data.get('success'):
-                            result_data = data['data']
-                            smiles = result_data['smiles'][0] if result_data['smiles'] else 'C'
-                            return ModelResult(
-                                smiles=smiles,
-                                confidence=result_data.get('confidence', [0.9])[0],
-                                model_name=self.model_name,
-                                model_version=result_data.get('model_version', '1.0.0'),
-                                execution_time_ms=result_data.get('execution_time_ms', 0),
-                                is_valid=self.validate_smiles(smiles)
-                            )
+            async with self.session.post(
+                self.api_url, 
+                json=payload, 
+                timeout=self.timeout
+            ) as response:
+                if response.status == 200:
+                    data = await response.json()
+                    if data.get('success'):
+                        result_data = data['data']
+                        smiles = result_data['smiles'][0] if result_data['smiles'] else 'C'
+                        return ModelResult(
+                            smiles=smiles,
+                            confidence=result_data.get('confidence', [0.9])[0],
+                            model_name=self.model_name,
+                            model_version=result_data.get('model_version', '1.0.0'),
+                            execution_time_ms=result_data.get('execution_time_ms', 0),
+                            is_valid=self.validate_smiles(smiles)
+                        )
                     
-                    # Fallback to mock if API fails
-                    return await self._mock_generate(text)
+                # Fallback to mock if API fails
+                return await self._mock_generate(text)
                     
         except Exception as e:
             logger.warning(f"Your Model API error: {e}, using mock")
@@ -146,39 +169,38 @@ class YourModelClient(BaseModelClient):
 class MolT5Client(BaseModelClient):
     """Client for MolT5 Model"""
     
-    def __init__(self):
+    def __init__(self, session: aiohttp.ClientSession):
         api_url = os.environ.get('MOLT5_API_URL', 'http://localhost:5002/api/text2mol')
-        super().__init__(api_url, 'molt5')
+        super().__init__(session, api_url, 'molt5')
     
     async def generate(self, text: str, options: Optional[Dict] = None) -> ModelResult:
         """Generate molecule using MolT5"""
         try:
-            async with aiohttp.ClientSession() as session:
-                payload = {
-                    'text': text,
-                    'options': options or {'num_beams': 5, 'num_return_sequences': 1}
-                }
+            payload = {
+                'text': text,
+                'options': options or {'num_beams': 5, 'num_return_sequences': 1}
+            }
                 
-                async with session.post(
-                    self.api_url,
-                    json=payload,
-                    timeout=self.timeout
-                ) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        if data.get('success'):
-                            result_data = data['data']
-                            smiles = result_data['smiles'][0] if result_data['smiles'] else 'C'
-                            return ModelResult(
-                                smiles=smiles,
-                                confidence=result_data.get('confidence', [0.9])[0],
-                                model_name=self.model_name,
-                                model_version=result_data.get('model_version', 'large'),
-                                execution_time_ms=result_data.get('execution_time_ms', 0),
-                                is_valid=self.validate_smiles(smiles)
-                            )
+            async with self.session.post(
+                self.api_url,
+                json=payload,
+                timeout=self.timeout
+            ) as response:
+                if response.status == 200:
+                    data = await response.json()
+                    if data.get('success'):
+                        result_data = data['data']
+                        smiles = result_data['smiles'][0] if result_data['smiles'] else 'C'
+                        return ModelResult(
+                            smiles=smiles,
+                            confidence=result_data.get('confidence', [0.9])[0],
+                            model_name=self.model_name,
+                            model_version=result_data.get('model_version', 'large'),
+                            execution_time_ms=result_data.get('execution_time_ms', 0),
+                            is_valid=self.validate_smiles(smiles)
+                        )
                     
-                    return await self._mock_generate(text)
+                return await self._mock_generate(text)
                     
         except Exception as e:
             logger.warning(f"MolT5 API error: {e}, using mock")
@@ -218,39 +240,38 @@ class MolT5Client(BaseModelClient):
 class ChemBERTaClient(BaseModelClient):
     """Client for ChemBERTa Model"""
     
-    def __init__(self):
+    def __init__(self, session: aiohttp.ClientSession):
         api_url = os.environ.get('CHEMBERTA_API_URL', 'http://localhost:5003/api/text2mol')
-        super().__init__(api_url, 'chemberta')
+        super().__init__(session, api_url, 'chemberta')
     
     async def generate(self, text: str, options: Optional[Dict] = None) -> ModelResult:
         """Generate molecule using ChemBERTa"""
         try:
-            async with aiohttp.ClientSession() as session:
-                payload = {
-                    'text': text,
-                    'options': options or {'top_k': 50, 'top_p': 0.9, 'temperature': 0.8}
-                }
+            payload = {
+                'text': text,
+                'options': options or {'top_k': 50, 'top_p': 0.9, 'temperature': 0.8}
+            }
                 
-                async with session.post(
-                    self.api_url,
-                    json=payload,
-                    timeout=self.timeout
-                ) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        if data.get('success'):
-                            result_data = data['data']
-                            smiles = result_data['smiles'][0] if result_data['smiles'] else 'C'
-                            return ModelResult(
-                                smiles=smiles,
-                                confidence=result_data.get('confidence', [0.9])[0],
-                                model_name=self.model_name,
-                                model_version=result_data.get('model_version', '77M-MTR'),
-                                execution_time_ms=result_data.get('execution_time_ms', 0),
-                                is_valid=self.validate_smiles(smiles)
-                            )
+            async with self.session.post(
+                self.api_url,
+                json=payload,
+                timeout=self.timeout
+            ) as response:
+                if response.status == 200:
+                    data = await response.json()
+                    if data.get('success'):
+                        result_data = data['data']
+                        smiles = result_data['smiles'][0] if result_data['smiles'] else 'C'
+                        return ModelResult(
+                            smiles=smiles,
+                            confidence=result_data.get('confidence', [0.9])[0],
+                            model_name=self.model_name,
+                            model_version=result_data.get('model_version', '77M-MTR'),
+                            execution_time_ms=result_data.get('execution_time_ms', 0),
+                            is_valid=self.validate_smiles(smiles)
+                        )
                     
-                    return await self._mock_generate(text)
+                return await self._mock_generate(text)
                     
         except Exception as e:
             logger.warning(f"ChemBERTa API error: {e}, using mock")
@@ -294,17 +315,17 @@ MODEL_CLIENTS = {
 }
 
 
-async def get_model_client(model_name: str) -> BaseModelClient:
-    """Factory function to get model client by name"""
+async def get_model_client(model_name: str, session: aiohttp.ClientSession) -> BaseModelClient:
+    """Factory function to get model client by name, calling its API through ``session``"""
     if model_name not in MODEL_CLIENTS:
         raise ValueError(f"Unknown model: {model_name}. Available: {list(MODEL_CLIENTS.keys())}")
-    return MODEL_CLIENTS[model_name]()
+    return MODEL_CLIENTS[model_name](session)
 
 
-async def check_all_models_health() -> Dict[str, bool]:
+async def check_all_models_health(session: aiohttp.ClientSession) -> Dict[str, bool]:
     """Check health of all registered models"""
     results = {}
     for name, client_class in MODEL_CLIENTS.items():
-        client = client_class()
+        client = client_class(session)
         results[name] = await client.health_check()
     return results
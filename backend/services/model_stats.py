@@ -0,0 +1,250 @@
+"""
+Model Statistics
+
+Per-model performance aggregates (validity rate, confidence, latency) kept in
+the `model_stats` collection, one document per model for all generations
+(experiment_id null) and one per model per experiment. Each saved generation
+adds its results with $inc, so reads cost O(number of models) however long
+history grows.
+
+Latency (SingleModelResult.execution_time, seconds) is kept as a histogram
+over fixed buckets; percentiles are interpolated within the bucket they fall
+in. `rebuild_model_stats` recomputes everything from generation_history with
+one aggregation pipeline (backfill, or repair after a failed update) and
+writes it over the live documents, each only if its count is unchanged since
+just before the aggregation: one that an increment touched meanwhile is
+recomputed and retried, so saves in any worker can go on during a rebuild.
+The one gap is a record inserted before the aggregation whose increment lands
+after its aggregate is written; the rebuild route closes it for its own
+worker by pausing the generation store.
+"""
+
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the latency buckets (seconds), about 1.6x apart; a last, open
+# bucket takes the rest. Stored counts refer to these: rebuild after changing them
+LATENCY_BUCKETS = (
+    0.01, 0.015, 0.025, 0.04, 0.06, 0.1, 0.15, 0.25, 0.4, 0.6,
+    1.0, 1.5, 2.5, 4.0, 6.0, 10.0, 15.0, 25.0, 40.0, 60.0,
+)
+LATENCY_PERCENTILES = (50, 90, 95, 99)
+
+# Passes over aggregates that changed while being rebuilt
+MODEL_STATS_REBUILD_ATTEMPTS = 3
+
+
+def latency_bucket(seconds: float) -> int:
+    """Index of the bucket holding ``seconds``: bucket i is (bound i-1, bound i]"""
+    return sum(1 for bound in LATENCY_BUCKETS if bound < seconds)
+
+
+def model_stats_updates(records: Iterable[Dict]) -> List[UpdateOne]:
+    """Upserts adding the results of ``records`` to the global and experiment aggregates"""
+    inc: Dict[Tuple[Optional[str], str], Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    low: Dict[Tuple[Optional[str], str], float] = {}
+    high: Dict[Tuple[Optional[str], str], float] = {}
+    last: Dict[Tuple[Optional[str], str], datetime] = {}
+
+    for record in records:
+        scopes = [None, record['experiment_id']] if record.get('experiment_id') else [None]
+        for result in record.get('results', []):
+            seconds = result['execution_time']
+            for scope in scopes:
+                key = (scope, result['model_name'])
+                counts = inc[key]
+                counts['count'] += 1
+                counts['valid_count'] += 1 if result.get('is_valid', True) else 0
+                counts['confidence_sum'] += result['confidence']
+                counts['execution_time_sum'] += seconds
+                counts[f'latency_buckets.{latency_bucket(seconds)}'] += 1
+                low[key] = min(low.get(key, seconds), seconds)
+                high[key] = max(high.get(key, seconds), seconds)
+                last[key] = max(last.get(key, record['created_at']), record['created_at'])
+
+    return [
+        UpdateOne(
+            {'experiment_id': scope, 'model_name': model_name},
+            {
+                '$inc': dict(counts),
+                '$min': {'min_execution_time': low[(scope, model_name)]},
+                '$max': {
+                    'max_execution_time': high[(scope, model_name)],
+                    'last_generated_at': last[(scope, model_name)],
+                },
+            },
+            upsert=True
+        )
+        for (scope, model_name), counts in inc.items()
+    ]
+
+
+async def record_model_stats(db, records: List[Dict]) -> None:
+    """Add newly saved generation records to the aggregates"""
+    updates = model_stats_updates(records)
+    if not updates:
+        return
+    try:
+        await db.model_stats.bulk_write(updates, ordered=False)
+    except Exception as e:
+        # The records are saved; a rebuild brings the aggregates back in line
+        logger.error(f"Model stats update failed for {len(records)} records: {e}")
+
+
+async def aggregate_model_stats(db) -> Dict[Tuple[Optional[str], str], Dict]:
+    """Every aggregate document, computed from generation_history"""
+    # Grouped per experiment, model and latency bucket in the database; the
+    # (few) groups are then rolled up into the per-experiment and global aggregates
+    pipeline = [
+        {"$unwind": "$results"},
+        {"$project": {
+            "experiment_id": 1,
+            "created_at": 1,
+            "results": 1,
+            "bucket": {"$size": {"$filter": {
+                "input": list(LATENCY_BUCKETS),
+                "cond": {"$lt": ["$$this", "$results.execution_time"]}
+            }}},
+        }},
+        {"$group": {
+            "_id": {"experiment_id": "$experiment_id", "model_name": "$results.model_name", "bucket": "$bucket"},
+            "count": {"$sum": 1},
+            "valid_count": {"$sum": {"$cond": [{"$eq": ["$results.is_valid", False]}, 0, 1]}},
+            "confidence_sum": {"$sum": "$results.confidence"},
+            "execution_time_sum": {"$sum": "$results.execution_time"},
+            "min_execution_time": {"$min": "$results.execution_time"},
+            "max_execution_time": {"$max": "$results.execution_time"},
+            "last_generated_at": {"$max": "$created_at"},
+        }},
+    ]
+
+    aggregates: Dict[Tuple[Optional[str], str], Dict] = {}
+    async for group in db.generation_history.aggregate(pipeline, allowDiskUse=True):
+        experiment_id, model_name = group['_id'].get('experiment_id'), group['_id']['model_name']
+        scopes = [None, experiment_id] if experiment_id else [None]
+        for scope in scopes:
+            doc = aggregates.setdefault((scope, model_name), {
+                'experiment_id': scope, 'model_name': model_name, 'count': 0, 'valid_count': 0,
+                'confidence_sum': 0.0, 'execution_time_sum': 0.0, 'latency_buckets': {},
+            })
+            for field in ('count', 'valid_count', 'confidence_sum', 'execution_time_sum'):
+                doc[field] += group[field]
+            bucket = str(group['_id']['bucket'])
+            doc['latency_buckets'][bucket] = doc['latency_buckets'].get(bucket, 0) + group['count']
+            for field, pick in (('min_execution_time', min), ('max_execution_time', max), ('last_generated_at', max)):
+                doc[field] = pick(doc[field], group[field]) if field in doc else group[field]
+    return aggregates
+
+
+async def _rebuild_pass(
+    db,
+    only: Optional[Set[Tuple[Optional[str], str]]] = None,
+) -> Tuple[int, Set[Tuple[Optional[str], str]]]:
+    """Write rebuilt aggregates over the live ones; returns their number and those that changed meanwhile"""
+    # Counts read before the aggregation: a document whose count still matches
+    # when it is written has had no increment since, so the rebuilt values replace it
+    live = {
+        (doc.get('experiment_id'), doc['model_name']): doc.get('count')
+        async for doc in db.model_stats.find({}, {'_id': 0, 'experiment_id': 1, 'model_name': 1, 'count': 1})
+    }
+    aggregates = await aggregate_model_stats(db)
+    conflicts = set()
+    for key in set(aggregates) | set(live):
+        if only is not None and key not in only:
+            continue
+        scope, model_name = key
+        doc = aggregates.get(key)
+        if key in live:
+            guard = {'experiment_id': scope, 'model_name': model_name, 'count': live[key]}
+            if doc is None:
+                # Models (or experiments) with no results left
+                result = await db.model_stats.delete_one(guard)
+                applied = result.deleted_count
+            else:
+                result = await db.model_stats.update_one(guard, {'$set': doc})
+                applied = result.matched_count
+        else:
+            try:
+                await db.model_stats.update_one(
+                    {'experiment_id': scope, 'model_name': model_name, 'count': {'$exists': False}},
+                    {'$set': doc},
+                    upsert=True
+                )
+                applied = True
+            except DuplicateKeyError:
+                # Created by an increment meanwhile
+                applied = False
+        if not applied:
+            conflicts.add(key)
+    return len(aggregates), conflicts
+
+
+async def rebuild_model_stats(db) -> int:
+    """
+    Recompute all aggregates from generation_history; returns the documents
+    written. Safe while generations are being saved (see the module docstring).
+    """
+    rebuilt, conflicts = await _rebuild_pass(db)
+    for _ in range(MODEL_STATS_REBUILD_ATTEMPTS - 1):
+        if not conflicts:
+            break
+        _, conflicts = await _rebuild_pass(db, only=conflicts)
+    if conflicts:
+        logger.warning(f"Model stats rebuild left {len(conflicts)} aggregates that kept changing; run it again")
+    logger.info(f"Rebuilt model stats: {rebuilt} model aggregates")
+    return rebuilt
+
+
+# ============ Reading ============
+
+def latency_percentile(buckets: List[int], percentile: float, low: float, high: float) -> float:
+    """Percentile interpolated within its bucket, clamped to the observed min/max"""
+    total = sum(buckets)
+    rank = percentile / 100 * total
+    seen = 0
+    for i, count in enumerate(buckets):
+        if count and seen + count >= rank:
+            lower = max(LATENCY_BUCKETS[i - 1] if i > 0 else 0.0, low)
+            upper = min(LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else high, high)
+            return lower + (upper - lower) * (rank - seen) / count
+        seen += count
+    return high
+
+
+def summarize_model_stats(doc: Dict) -> Dict:
+    """API view of one aggregate document"""
+    count = doc.get('count', 0)
+    stored = doc.get('latency_buckets', {})
+    buckets = [int(stored.get(str(i), 0)) for i in range(len(LATENCY_BUCKETS) + 1)]
+    low, high = doc.get('min_execution_time', 0.0), doc.get('max_execution_time', 0.0)
+    bounds = list(LATENCY_BUCKETS) + [None]
+    return {
+        'model_name': doc['model_name'],
+        'experiment_id': doc.get('experiment_id'),
+        'count': count,
+        'valid_count': doc.get('valid_count', 0),
+        'validity_rate': doc.get('valid_count', 0) / count if count else 0.0,
+        'avg_confidence': doc.get('confidence_sum', 0.0) / count if count else 0.0,
+        'avg_execution_time': doc.get('execution_time_sum', 0.0) / count if count else 0.0,
+        'min_execution_time': low,
+        'max_execution_time': high,
+        'latency_percentiles': {
+            f'p{p}': latency_percentile(buckets, p, low, high) if count else 0.0
+            for p in LATENCY_PERCENTILES
+        },
+        'latency_histogram': [{'le': le, 'count': n} for le, n in zip(bounds, buckets)],
+        'last_generated_at': doc.get('last_generated_at'),
+    }
+
+
+async def get_model_stats(db, experiment_id: Optional[str] = None) -> List[Dict]:
+    """Aggregates per model, for all generations or one experiment's"""
+    cursor = db.model_stats.find({'experiment_id': experiment_id}, {'_id': 0}).sort('model_name', 1)
+    return [summarize_model_stats(doc) async for doc in cursor]
@@ -0,0 +1,101 @@
+"""
+Molecule-to-Text Cache
+
+Caches generated molecule descriptions keyed by canonical SMILES, additional
+info, model and prompt version. An in-memory LRU sits in front of the
+`mol2text_cache` Mongo collection so repeat lookups of common molecules skip
+the LLM call entirely.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from rdkit import Chem, rdBase
+
+from services.llm_service import MOL2TEXT_MODEL, MOL2TEXT_PROMPT_VERSION
+
+logger = logging.getLogger(__name__)
+
+MOL2TEXT_CACHE_SIZE = int(os.environ.get('MOL2TEXT_CACHE_SIZE', 1024))
+
+
+def canonical_molecule_key(smiles: str) -> str:
+    """Canonical SMILES, or the stripped input for names RDKit cannot parse"""
+    with rdBase.BlockLogs():  # Names are expected to fail parsing
+        mol = Chem.MolFromSmiles(smiles)
+    return Chem.MolToSmiles(mol) if mol else smiles.strip()
+
+
+class Mol2TextCache:
+    """Two-tier (memory LRU + MongoDB) molecule description cache"""
+
+    def __init__(self, max_entries: int = MOL2TEXT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+
+    @staticmethod
+    def make_key(canonical_smiles: str, additional_info: Optional[str]) -> str:
+        """Stable key over everything that changes the generated description"""
+        payload = {
+            'smiles': canonical_smiles,
+            'additional_info': (additional_info or '').strip(),
+            'model': MOL2TEXT_MODEL,
+            'prompt_version': MOL2TEXT_PROMPT_VERSION,
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+    async def get(self, db, key: str) -> Optional[str]:
+        """Cached description for ``key``, or None"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            return entry['description']
+
+        doc = await db.mol2text_cache.find_one({'key': key}, {'_id': 0})
+        if doc is None:
+            return None
+        self._remember(key, doc)
+        return doc['description']
+
+    async def put(
+        self,
+        db,
+        key: str,
+        canonical_smiles: str,
+        additional_info: Optional[str],
+        description: str,
+    ) -> None:
+        """Store a description in both tiers"""
+        doc = {
+            'key': key,
+            'canonical_smiles': canonical_smiles,
+            'additional_info': additional_info,
+            'model': MOL2TEXT_MODEL,
+            'prompt_version': MOL2TEXT_PROMPT_VERSION,
+            'description': description,
+            'created_at': datetime.now(timezone.utc),
+        }
+        self._remember(key, doc)
+        await db.mol2text_cache.update_one({'key': key}, {'$set': doc}, upsert=True)
+
+    def _remember(self, key: str, doc: Dict) -> None:
+        self._entries[key] = doc
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+_mol2text_cache: Optional[Mol2TextCache] = None
+
+
+def get_mol2text_cache() -> Mol2TextCache:
+    """Get the process-wide mol2text cache"""
+    global _mol2text_cache
+    if _mol2text_cache is None:
+        _mol2text_cache = Mol2TextCache()
+    return _mol2text_cache
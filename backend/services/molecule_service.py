@@ -8,6 +8,7 @@ When models are not available (API down), mock responses are used for testing.
 """
 
 import asyncio
+import aiohttp
 import logging
 from typing import List, Dict, Optional
 from models import SingleModelResult
@@ -36,7 +37,7 @@ def normalize_model_name(name: str) -> str:
     return MODEL_NAME_MAP.get(name.lower(), name.lower())
 
 
-async def call_external_model(model_name: str, prompt: str) -> SingleModelResult:
+async def call_external_model(session: aiohttp.ClientSession, model_name: str, prompt: str) -> SingleModelResult:
     """
     Call a single external model to generate molecule from text.
     Falls back to mock if model is unavailable.
@@ -44,7 +45,7 @@ async def call_external_model(model_name: str, prompt: str) -> SingleModelResult
     normalized_name = normalize_model_name(model_name)
     
     try:
-        client = await get_model_client(normalized_name)
+        client = await get_model_client(normalized_name, session)
         result = await client.generate(prompt)
         
         return SingleModelResult(
@@ -68,11 +69,12 @@ async def call_external_model(model_name: str, prompt: str) -> SingleModelResult
         )
 
 
-async def generate_molecules(prompt: str, models: List[str]) -> List[SingleModelResult]:
+async def generate_molecules(session: aiohttp.ClientSession, prompt: str, models: List[str]) -> List[SingleModelResult]:
     """
     Generate molecules from multiple models in parallel.
     
     Args:
+        session: HTTP session for the model APIs (Resources.http_session)
         prompt: Natural language description of the molecule
         models: List of model names to use
         
@@ -83,7 +85,7 @@ async def generate_molecules(prompt: str, models: List[str]) -> List[SingleModel
         models = ['your_model']  # Default model
     
     # Run all models in parallel
-    tasks = [call_external_model(model, prompt) for model in models]
+    tasks = [call_external_model(session, model, prompt) for model in models]
     results = await asyncio.gather(*tasks, return_exceptions=True)
     
     # Filter out exceptions and convert to results
@@ -105,11 +107,11 @@ async def generate_molecules(prompt: str, models: List[str]) -> List[SingleModel
     return valid_results
 
 
-async def get_available_models() -> Dict[str, Dict]:
+async def get_available_models(session: aiohttp.ClientSession) -> Dict[str, Dict]:
     """
     Get list of available models and their health status.
     """
-    health_status = await check_all_models_health()
+    health_status = await check_all_models_health(session)
     
     models_info = {}
     for name in MODEL_CLIENTS.keys():
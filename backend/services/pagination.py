@@ -0,0 +1,126 @@
+"""
+Keyset Pagination
+
+Cursor-based paging over collections sorted by (created_at, id). A cursor is
+the opaque, URL-safe encoding of the last item's sort key; the next page is
+everything strictly after it in sort order. Unlike skip/limit this costs the
+same for page 1000 as for page 1, provided the query is backed by an index
+ending in (created_at, id).
+
+Listing endpoints return the page as a JSON array and the cursor for the
+next page in the X-Next-Cursor header (absent on the last page).
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from services.timestamps import parse_timestamp, timestamp_range
+
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(doc: Dict) -> str:
+    created_at = doc['created_at']
+    # Legacy string timestamps are kept as strings: they sort apart from dates
+    if isinstance(created_at, datetime):
+        key = [created_at.isoformat(), doc['id'], 'date']
+    else:
+        key = [created_at, doc['id']]
+    payload = json.dumps(key, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, str]:
+    """(created_at, id) of the last item of the previous page"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        created_at, item_id = key[0], key[1]
+    except (ValueError, TypeError, IndexError, KeyError) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+    if not isinstance(created_at, str) or not isinstance(item_id, str):
+        raise InvalidCursor(f"Invalid cursor: {cursor}")
+    if key[2:] == ['date']:
+        created_at = parse_timestamp(created_at)
+        if created_at is None:
+            raise InvalidCursor(f"Invalid cursor: {cursor}")
+    return created_at, item_id
+
+
+def date_range_filter(after: Optional[datetime], before: Optional[datetime]) -> Dict:
+    """created_at bounds; naive datetimes are taken as UTC"""
+    bounds = {}
+    if after:
+        bounds['$gte'] = after
+    if before:
+        bounds['$lt'] = before
+    return timestamp_range('created_at', bounds) if bounds else {}
+
+
+def projection(fields: Optional[str], allowed: Iterable[str]) -> Optional[Dict]:
+    """
+    Mongo projection for a comma-separated ``fields`` list, or None for whole
+    documents. id and created_at are always included (the cursor needs them).
+    """
+    if not fields:
+        return None
+    requested = {f.strip() for f in fields.split(',') if f.strip()}
+    unknown = requested - set(allowed)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return {'_id': 0, 'id': 1, 'created_at': 1, **{f: 1 for f in requested}}
+
+
+async def fetch_page(
+    collection,
+    query: Dict,
+    limit: int,
+    cursor: Optional[str] = None,
+    fields: Optional[Dict] = None,
+    descending: bool = True,
+) -> Tuple[List[Dict], Optional[str]]:
+    """One page of ``query`` in (created_at, id) order, and the next cursor"""
+    if cursor:
+        created_at, item_id = decode_cursor(cursor)
+        op = '$lt' if descending else '$gt'
+        after_cursor = {'$or': [
+            {'created_at': {op: created_at}},
+            {'created_at': created_at, 'id': {op: item_id}},
+        ]}
+        # Legacy string timestamps sort before all dates, and range operators
+        # never compare across types, so add the other type's side explicitly
+        if descending and isinstance(created_at, datetime):
+            after_cursor['$or'].append({'created_at': {'$type': 'string'}})
+        elif not descending and not isinstance(created_at, datetime):
+            after_cursor['$or'].append({'created_at': {'$type': 'date'}})
+        query = {'$and': [query, after_cursor]} if query else after_cursor
+
+    direction = -1 if descending else 1
+    docs = await collection.find(query, fields or {'_id': 0}) \
+        .sort([('created_at', direction), ('id', direction)]) \
+        .limit(limit + 1) \
+        .to_list(length=limit + 1)
+
+    # The extra document only tells us whether another page exists
+    next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    return docs[:limit], next_cursor
+
+
+def page_response(response: Response, items: List[Dict], next_cursor: Optional[str], projected: bool):
+    """Return a page from an endpoint, with the next cursor header"""
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else {}
+    if projected:
+        # Partial documents do not fit the endpoint's response model
+        return JSONResponse(jsonable_encoder(items), headers=headers)
+    response.headers.update(headers)
+    return items
@@ -0,0 +1,399 @@
+"""
+Protein Structure Service
+
+Parses docking target PDB files once into NumPy arrays (coordinates, elements,
+residue ids) and builds a uniform grid spatial index around the pocket center.
+
+Parsed arrays are persisted as .npy files under STRUCTURE_CACHE_DIR and opened
+memory-mapped, so every worker process shares the same pages instead of
+re-parsing the PDB text per request.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import requests
+
+logger = logging.getLogger(__name__)
+
+STRUCTURE_CACHE_DIR = Path(
+    os.environ.get('STRUCTURE_CACHE_DIR', Path(__file__).parent.parent / 'data' / 'structures')
+)
+
+# Bump when the on-disk layout or parsing rules change
+STRUCTURE_FORMAT_VERSION = 1
+
+# Atoms further than this from the pocket center are not indexed (Angstrom)
+POCKET_INDEX_RADIUS = 24.0
+
+# Edge length of a spatial grid cell (Angstrom), matches the scoring cutoff
+GRID_CELL_SIZE = 8.0
+
+_ARRAY_NAMES = (
+    'coords', 'elements', 'atom_names', 'residue_names', 'residue_ids', 'chain_ids',
+    'grid_cell_start', 'grid_atom_order',
+)
+
+
+@dataclass
+class SpatialGrid:
+    """
+    Uniform grid over the pocket region in CSR layout.
+
+    Atoms of cell ``c`` are ``atom_order[cell_start[c]:cell_start[c + 1]]``.
+    """
+    origin: np.ndarray
+    cell_size: float
+    shape: Tuple[int, int, int]
+    cell_start: np.ndarray
+    atom_order: np.ndarray
+
+    @classmethod
+    def build(cls, coords: np.ndarray, center: np.ndarray, radius: float, cell_size: float) -> 'SpatialGrid':
+        """Bin every atom within ``radius`` of ``center`` into grid cells"""
+        origin = (center - radius).astype(np.float32)
+        n = int(np.ceil(2 * radius / cell_size))
+        shape = (n, n, n)
+
+        in_box = np.all(np.abs(coords - center) <= radius, axis=1)
+        atom_idx = np.nonzero(in_box)[0].astype(np.int32)
+        cells = np.clip(((coords[atom_idx] - origin) // cell_size).astype(np.int64), 0, n - 1)
+        flat = np.ravel_multi_index(cells.T, shape) if len(atom_idx) else np.zeros(0, dtype=np.int64)
+
+        order = np.argsort(flat, kind='stable')
+        counts = np.bincount(flat, minlength=n ** 3)
+        cell_start = np.zeros(n ** 3 + 1, dtype=np.int32)
+        np.cumsum(counts, out=cell_start[1:])
+
+        return cls(
+            origin=origin,
+            cell_size=float(cell_size),
+            shape=shape,
+            cell_start=cell_start,
+            atom_order=atom_idx[order],
+        )
+
+    def atoms_in_box(self, lo: Sequence[float], hi: Sequence[float]) -> np.ndarray:
+        """Indices of indexed atoms whose cells overlap the box [lo, hi]"""
+        lo_cell = np.clip(((np.asarray(lo) - self.origin) // self.cell_size).astype(int), 0, np.array(self.shape) - 1)
+        hi_cell = np.clip(((np.asarray(hi) - self.origin) // self.cell_size).astype(int), 0, np.array(self.shape) - 1)
+
+        chunks = []
+        for i in range(lo_cell[0], hi_cell[0] + 1):
+            for j in range(lo_cell[1], hi_cell[1] + 1):
+                # Cells along z are contiguous in the flat index
+                first = np.ravel_multi_index((i, j, lo_cell[2]), self.shape)
+                last = np.ravel_multi_index((i, j, hi_cell[2]), self.shape)
+                start, end = self.cell_start[first], self.cell_start[last + 1]
+                if end > start:
+                    chunks.append(self.atom_order[start:end])
+
+        if not chunks:
+            return np.zeros(0, dtype=np.int32)
+        return np.concatenate(chunks)
+
+    def query_radius(self, coords: np.ndarray, point: Sequence[float], radius: float) -> np.ndarray:
+        """Indices of indexed atoms within ``radius`` of ``point``"""
+        point = np.asarray(point, dtype=np.float32)
+        candidates = self.atoms_in_box(point - radius, point + radius)
+        if len(candidates) == 0:
+            return candidates
+        d2 = np.sum((coords[candidates] - point) ** 2, axis=1)
+        return candidates[d2 <= radius * radius]
+
+
+@dataclass
+class ProteinStructure:
+    """Preparsed protein atoms for one docking target"""
+    target_id: str
+    structure_hash: str
+    center: np.ndarray
+    coords: np.ndarray
+    elements: np.ndarray
+    atom_names: np.ndarray
+    residue_names: np.ndarray
+    residue_ids: np.ndarray
+    chain_ids: np.ndarray
+    grid: SpatialGrid
+    path: Optional[Path] = None
+
+    @property
+    def num_atoms(self) -> int:
+        return len(self.coords)
+
+    def pocket_atoms(self, radius: float) -> np.ndarray:
+        """Indices of atoms within ``radius`` of the pocket center"""
+        return self.grid.query_radius(self.coords, self.center, radius)
+
+
+def structure_hash(pdb_text: str) -> str:
+    """Content hash used to detect a changed target structure"""
+    return hashlib.sha256(pdb_text.encode('utf-8')).hexdigest()
+
+
+def _element_from_name(atom_name: str) -> str:
+    """Guess the element from a PDB atom name when columns 77-78 are blank"""
+    letters = ''.join(c for c in atom_name if c.isalpha())
+    # Protein ATOM records only contain single-letter elements (C, N, O, S, H)
+    return letters[0].upper() if letters else 'X'
+
+
+def parse_pdb(pdb_text: str) -> Dict[str, np.ndarray]:
+    """
+    Parse protein ATOM records of the first model into column arrays.
+
+    HETATM records (waters, co-crystallized ligands, ions) are skipped so the
+    binding pocket is empty for docking. Only the first alternate location
+    is kept.
+    """
+    coords, elements, atom_names, residue_names, residue_ids, chain_ids = [], [], [], [], [], []
+
+    for line in pdb_text.splitlines():
+        record = line[:6]
+        if record.startswith('ENDMDL'):
+            break
+        if record != 'ATOM  ':
+            continue
+        altloc = line[16:17]
+        if altloc not in (' ', 'A', ''):
+            continue
+        try:
+            x, y, z = float(line[30:38]), float(line[38:46]), float(line[46:54])
+        except ValueError:
+            continue
+
+        raw_name = line[12:16]
+        element = line[76:78].strip().capitalize() or _element_from_name(raw_name)
+
+        coords.append((x, y, z))
+        elements.append(element)
+        atom_names.append(raw_name.strip())
+        residue_names.append(line[17:20].strip())
+        residue_ids.append(int(line[22:26]) if line[22:26].strip().lstrip('-').isdigit() else 0)
+        chain_ids.append(line[21:22].strip() or 'A')
+
+    return {
+        'coords': np.asarray(coords, dtype=np.float32).reshape(-1, 3),
+        'elements': np.asarray(elements, dtype='<U2'),
+        'atom_names': np.asarray(atom_names, dtype='<U4'),
+        'residue_names': np.asarray(residue_names, dtype='<U3'),
+        'residue_ids': np.asarray(residue_ids, dtype=np.int32),
+        'chain_ids': np.asarray(chain_ids, dtype='<U1'),
+    }
+
+
+def pocket_pdb(structure: ProteinStructure, pdb_text: str, radius: float) -> str:
+    """
+    PDB text of the residues with at least one atom within ``radius`` of the
+    pocket center.
+
+    Whole residues are kept so the viewer can draw complete side chains; the
+    same ATOM filter as ``parse_pdb`` is applied so both agree on the atoms.
+    """
+    idx = structure.pocket_atoms(radius)
+    keep = set(zip(structure.chain_ids[idx].tolist(), structure.residue_ids[idx].tolist()))
+
+    lines = []
+    for line in pdb_text.splitlines():
+        record = line[:6]
+        if record.startswith('ENDMDL'):
+            break
+        if record != 'ATOM  ' or line[16:17] not in (' ', 'A', ''):
+            continue
+        chain = line[21:22].strip() or 'A'
+        resid = int(line[22:26]) if line[22:26].strip().lstrip('-').isdigit() else 0
+        if (chain, resid) in keep:
+            lines.append(line)
+    lines.append('END')
+    return '\n'.join(lines) + '\n'
+
+
+def _target_dir(target_id: str) -> Path:
+    return STRUCTURE_CACHE_DIR / target_id
+
+
+def _write_structure(target_id: str, arrays: Dict[str, np.ndarray], meta: Dict) -> Path:
+    """Write arrays to a temp dir and swap it into place atomically"""
+    STRUCTURE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    final_dir = _target_dir(target_id)
+    tmp_dir = Path(tempfile.mkdtemp(prefix=f'.{target_id}-', dir=STRUCTURE_CACHE_DIR))
+
+    for name in _ARRAY_NAMES:
+        np.save(tmp_dir / f'{name}.npy', arrays[name])
+    with open(tmp_dir / 'meta.json', 'w') as f:
+        json.dump(meta, f)
+
+    if final_dir.exists():
+        shutil.rmtree(final_dir, ignore_errors=True)
+    try:
+        os.replace(tmp_dir, final_dir)
+    except OSError:
+        # Another worker won the race; its copy is equivalent
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return final_dir
+
+
+def _read_meta(target_id: str) -> Optional[Dict]:
+    meta_path = _target_dir(target_id) / 'meta.json'
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _open_structure(target_id: str, meta: Dict) -> ProteinStructure:
+    """Open persisted arrays memory-mapped (read-only, shared between processes)"""
+    path = _target_dir(target_id)
+    arrays = {name: np.load(path / f'{name}.npy', mmap_mode='r') for name in _ARRAY_NAMES}
+    grid = SpatialGrid(
+        origin=np.asarray(meta['grid_origin'], dtype=np.float32),
+        cell_size=meta['grid_cell_size'],
+        shape=tuple(meta['grid_shape']),
+        cell_start=arrays['grid_cell_start'],
+        atom_order=arrays['grid_atom_order'],
+    )
+    return ProteinStructure(
+        target_id=target_id,
+        structure_hash=meta['structure_hash'],
+        center=np.asarray(meta['center'], dtype=np.float32),
+        coords=arrays['coords'],
+        elements=arrays['elements'],
+        atom_names=arrays['atom_names'],
+        residue_names=arrays['residue_names'],
+        residue_ids=arrays['residue_ids'],
+        chain_ids=arrays['chain_ids'],
+        grid=grid,
+        path=path,
+    )
+
+
+def build_structure(target_id: str, pdb_text: str, center: Sequence[float]) -> ProteinStructure:
+    """Parse ``pdb_text``, index the pocket and persist the arrays"""
+    center_arr = np.asarray(center, dtype=np.float32)
+    arrays = parse_pdb(pdb_text)
+    grid = SpatialGrid.build(arrays['coords'], center_arr, POCKET_INDEX_RADIUS, GRID_CELL_SIZE)
+    arrays['grid_cell_start'] = grid.cell_start
+    arrays['grid_atom_order'] = grid.atom_order
+
+    meta = {
+        'format_version': STRUCTURE_FORMAT_VERSION,
+        'target_id': target_id,
+        'structure_hash': structure_hash(pdb_text),
+        'center': [float(c) for c in center_arr],
+        'num_atoms': int(len(arrays['coords'])),
+        'grid_origin': [float(c) for c in grid.origin],
+        'grid_cell_size': grid.cell_size,
+        'grid_shape': list(grid.shape),
+    }
+    _write_structure(target_id, arrays, meta)
+    logger.info(f"Preparsed target {target_id}: {meta['num_atoms']} atoms")
+    return _open_structure(target_id, meta)
+
+
+# Per-process cache of opened structures
+_structures: Dict[str, ProteinStructure] = {}
+
+
+def get_protein_structure(target_id: str, pdb_text: str, center: Sequence[float]) -> ProteinStructure:
+    """
+    Get the preparsed structure for a target, building it on first use.
+
+    The persisted copy is reused as long as the PDB content hash, pocket center
+    and format version still match; otherwise it is rebuilt.
+    """
+    digest = structure_hash(pdb_text)
+    center_list = [float(c) for c in np.asarray(center, dtype=np.float32)]
+
+    cached = _structures.get(target_id)
+    if cached is not None and cached.structure_hash == digest and list(map(float, cached.center)) == center_list:
+        return cached
+
+    meta = _read_meta(target_id)
+    if (
+        meta
+        and meta.get('format_version') == STRUCTURE_FORMAT_VERSION
+        and meta.get('structure_hash') == digest
+        and meta.get('center') == center_list
+    ):
+        structure = _open_structure(target_id, meta)
+    else:
+        structure = build_structure(target_id, pdb_text, center)
+
+    _structures[target_id] = structure
+    return structure
+
+
+def load_protein_structure(target_id: str) -> Optional[ProteinStructure]:
+    """Open an already persisted structure without the PDB text (used by worker processes)"""
+    cached = _structures.get(target_id)
+    meta = _read_meta(target_id)
+    if not meta or meta.get('format_version') != STRUCTURE_FORMAT_VERSION:
+        return None
+    if cached is not None and cached.structure_hash == meta['structure_hash']:
+        return cached
+    structure = _open_structure(target_id, meta)
+    _structures[target_id] = structure
+    return structure
+
+
+def fetch_target_pdb(pdb_id: str, timeout: int = 5) -> Optional[str]:
+    """
+    Get PDB text for a PDB id, downloading from RCSB on first use.
+
+    The downloaded file is kept next to the parsed arrays so restarts do not
+    hit the network again. Returns None if the structure cannot be fetched.
+    """
+    pdb_path = STRUCTURE_CACHE_DIR / 'pdb' / f'{pdb_id.upper()}.pdb'
+    if pdb_path.exists():
+        return pdb_path.read_text()
+
+    try:
+        response = requests.get(f"https://files.rcsb.org/download/{pdb_id}.pdb", timeout=timeout)
+        if response.status_code != 200:
+            return None
+    except Exception as e:
+        logger.warning(f"PDB fetch failed for {pdb_id}: {e}")
+        return None
+
+    pdb_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = pdb_path.with_suffix(f'.{os.getpid()}.tmp')
+    tmp_path.write_text(response.text)
+    os.replace(tmp_path, pdb_path)
+    return response.text
+
+
+def _upload_path(target_id: str) -> Path:
+    return STRUCTURE_CACHE_DIR / 'uploads' / f'{target_id}.pdb'
+
+
+def save_uploaded_pdb(target_id: str, pdb_text: str) -> None:
+    """Keep an uploaded target's PDB text next to the parsed arrays"""
+    pdb_path = _upload_path(target_id)
+    pdb_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = pdb_path.with_suffix(f'.{os.getpid()}.tmp')
+    tmp_path.write_text(pdb_text)
+    os.replace(tmp_path, pdb_path)
+
+
+def read_uploaded_pdb(target_id: str) -> Optional[str]:
+    """PDB text of an uploaded target, or None if it is gone"""
+    try:
+        return _upload_path(target_id).read_text()
+    except OSError:
+        return None
+
+
+def delete_structure(target_id: str) -> None:
+    """Remove a target's parsed arrays, grid maps and uploaded PDB"""
+    _structures.pop(target_id, None)
+    shutil.rmtree(_target_dir(target_id), ignore_errors=True)
+    _upload_path(target_id).unlink(missing_ok=True)
@@ -0,0 +1,503 @@
+"""
+Retrieval Index
+
+In-process BM25 index that grounds the knowledge chat. Documents from the
+bundled chemistry corpus, generation history and mol2text descriptions are
+split into overlapping passages and indexed as term-major CSR postings
+(NumPy arrays), with a small in-memory delta for passages added since the
+last merge.
+
+The index is persisted under RETRIEVAL_INDEX_DIR so a restart loads arrays
+instead of re-tokenizing everything; Mongo collections are backfilled from a
+created_at watermark. Each worker process loads one at startup
+(`Resources.retrieval_index`) and passes it to the functions below.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from services.timestamps import parse_timestamp, timestamp_range
+
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_INDEX_DIR = Path(
+    os.environ.get('RETRIEVAL_INDEX_DIR', Path(__file__).parent.parent / 'data' / 'retrieval')
+)
+KNOWLEDGE_CORPUS_DIR = Path(
+    os.environ.get('KNOWLEDGE_CORPUS_DIR', Path(__file__).parent.parent / 'knowledge_corpus')
+)
+
+# Bump when tokenization or the on-disk layout change
+INDEX_FORMAT_VERSION = 2
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Passage size and overlap (words)
+PASSAGE_WORDS = 120
+PASSAGE_OVERLAP = 30
+
+# Merge the delta into the CSR arrays once this many passages, or this share
+# of the merged ones, are pending (so merges get rarer as the index grows)
+DELTA_MERGE_PASSAGES = 256
+DELTA_MERGE_FRACTION = 0.1
+
+# A merge also compacts passage ids once this share of passages is dead
+COMPACT_DEAD_FRACTION = 0.2
+
+# Save to disk after this many document changes
+AUTOSAVE_CHANGES = 100
+
+RETRIEVAL_TOP_K = 4
+RETRIEVAL_MIN_SCORE = 1.0
+
+# Searches slower than this are logged (milliseconds)
+RETRIEVAL_BUDGET_MS = 5.0
+
+# Documents read per Mongo batch while backfilling
+BACKFILL_BATCH = 500
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset("""
+a an and are as at be by can do does for from has have how i in is it its me my of on or
+our so than that the their them then there these they this to was we were what when where
+which who why will with you your about into also not no any some explain describe tell
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens without stopwords, with a light plural strip"""
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in _STOPWORDS or (len(token) < 2 and not token.isdigit()):
+            continue
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def split_passages(text: str) -> List[str]:
+    """Split text into overlapping windows of PASSAGE_WORDS words"""
+    words = text.split()
+    if len(words) <= PASSAGE_WORDS:
+        return [' '.join(words)] if words else []
+    step = PASSAGE_WORDS - PASSAGE_OVERLAP
+    return [' '.join(words[i:i + PASSAGE_WORDS]) for i in range(0, len(words) - PASSAGE_OVERLAP, step)]
+
+
+class _Segment:
+    """
+    Merged term-major CSR postings: passages of term t are term_ptr[t]:term_ptr[t + 1].
+    Never modified once built, except ``alive`` as passages are removed.
+    """
+
+    def __init__(self, term_ptr: np.ndarray, post_docs: np.ndarray, post_tfs: np.ndarray, lengths: np.ndarray, alive: np.ndarray):
+        self.term_ptr = term_ptr
+        self.post_docs = post_docs
+        self.post_tfs = post_tfs
+        self.lengths = lengths
+        self.alive = alive
+
+    @classmethod
+    def empty(cls) -> '_Segment':
+        return cls(
+            np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32),
+            np.zeros(0, dtype=np.float32), np.zeros(0, dtype=bool),
+        )
+
+    @property
+    def size(self) -> int:
+        return len(self.lengths)
+
+
+class _View(NamedTuple):
+    """What a search reads: published as one reference, so it is always consistent"""
+    segment: _Segment
+    passages: List[Dict]
+    delta: Dict[int, List[Tuple[int, int]]]
+    delta_lengths: List[int]
+    delta_alive: List[bool]
+    count: int  # Passages in this view; the lists above may have grown since
+
+
+class RetrievalIndex:
+    """
+    BM25 passage index with CSR postings plus an append-only delta.
+
+    Writers (add, remove, merge, save) are serialized by a lock and run in
+    threads. Searches take no lock: they read the view published by the last
+    write, whose lists are only ever appended to.
+    """
+
+    def __init__(self, segment: Optional[_Segment] = None):
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self.vocab: Dict[str, int] = {}  # Only grows, so term ids stay valid across merges
+        self.passages: List[Dict] = []  # doc_key, source, title, text
+        self.doc_hashes: Dict[str, str] = {}
+        self.doc_passages: Dict[str, List[int]] = {}
+        self.watermarks: Dict[str, str] = {}  # Collection -> last indexed created_at (ISO)
+        self.changes = 0
+
+        self._segment = segment or _Segment.empty()
+
+        # Passages added since the last merge; passage ids continue the segment's
+        self._delta: Dict[int, List[Tuple[int, int]]] = {}
+        self._delta_lengths: List[int] = []
+        self._delta_alive: List[bool] = []
+        self._num_live = int(self._segment.alive.sum())
+        self._view: Optional[_View] = None
+
+    @property
+    def num_passages(self) -> int:
+        return self._num_live
+
+    def _publish(self) -> None:
+        self._view = _View(
+            self._segment, self.passages, self._delta, self._delta_lengths, self._delta_alive, len(self.passages)
+        )
+
+    def add_document(self, key: str, title: str, text: str, source: str) -> bool:
+        """Index (or re-index) a document; returns False if it is unchanged"""
+        digest = hashlib.sha1(f"{title}\n{text}".encode('utf-8')).hexdigest()
+        if self.doc_hashes.get(key) == digest:
+            return False
+        # Tokenized before taking the lock
+        passages = [(passage, Counter(tokenize(f"{title} {passage}"))) for passage in split_passages(text)]
+
+        with self._lock:
+            if self.doc_hashes.get(key) == digest:
+                return False
+            self._remove(key)
+
+            ids = []
+            vocab, delta = self.vocab, self._delta
+            for passage, counts in passages:
+                pid = len(self.passages)
+                for term, tf in counts.items():
+                    tid = vocab.get(term)
+                    if tid is None:
+                        tid = vocab[term] = len(vocab)
+                    delta.setdefault(tid, []).append((pid, tf))
+                self._delta_lengths.append(sum(counts.values()))
+                self._delta_alive.append(True)
+                self.passages.append({'doc_key': key, 'source': source, 'title': title, 'text': passage})
+                ids.append(pid)
+
+            self.doc_hashes[key] = digest
+            self.doc_passages[key] = ids
+            self._num_live += len(ids)
+            self.changes += 1
+            if len(self._delta_lengths) >= max(DELTA_MERGE_PASSAGES, DELTA_MERGE_FRACTION * self._segment.size):
+                self._merge()
+            self._publish()
+            return True
+
+    def add_documents(self, documents: Iterable[Tuple[str, str, str]], source: str) -> int:
+        """Index (key, title, text) documents; returns how many were new or changed"""
+        return sum(self.add_document(key, title, text, source=source) for key, title, text in documents)
+
+    def remove_document(self, key: str) -> None:
+        with self._lock:
+            if self._remove(key):
+                self.changes += 1
+
+    def _remove(self, key: str) -> bool:
+        # Passages are only marked dead here; the next merge drops their postings
+        ids = self.doc_passages.pop(key, None)
+        self.doc_hashes.pop(key, None)
+        base = self._segment.size
+        for pid in ids or ():
+            if pid < base:
+                self._segment.alive[pid] = False
+            else:
+                self._delta_alive[pid - base] = False
+        self._num_live -= len(ids or ())
+        return ids is not None
+
+    def _merge(self) -> None:
+        """
+        Fold the delta into a new segment (lock held). Postings are already
+        counted per passage, so this only interleaves arrays: no re-tokenizing,
+        and passage ids stay the same unless dead passages are compacted away.
+        """
+        segment = self._segment
+        num_terms = len(self.vocab)
+        alive = np.concatenate([segment.alive, np.asarray(self._delta_alive, dtype=bool)])
+        lengths = np.concatenate([segment.lengths, np.asarray(self._delta_lengths, dtype=np.float32)])
+
+        # Merged postings are ordered by term; order the delta's the same way
+        old_terms = np.repeat(np.arange(len(segment.term_ptr) - 1, dtype=np.int64), np.diff(segment.term_ptr))
+        old_docs, old_tfs = segment.post_docs, segment.post_tfs
+        tids = sorted(self._delta)
+        new_terms = np.repeat(np.asarray(tids, dtype=np.int64), [len(self._delta[t]) for t in tids])
+        new_postings = np.asarray([p for t in tids for p in self._delta[t]], dtype=np.int64).reshape(-1, 2)
+        new_docs, new_tfs = new_postings[:, 0].astype(np.int32), new_postings[:, 1].astype(np.float32)
+
+        # Drop postings of dead passages
+        keep = alive[old_docs]
+        old_terms, old_docs, old_tfs = old_terms[keep], old_docs[keep], old_tfs[keep]
+        keep = alive[new_docs]
+        new_terms, new_docs, new_tfs = new_terms[keep], new_docs[keep], new_tfs[keep]
+
+        passages, doc_passages = self.passages, self.doc_passages
+        if len(alive) - int(alive.sum()) > COMPACT_DEAD_FRACTION * len(alive):
+            new_ids = (np.cumsum(alive) - 1).astype(np.int32)
+            old_docs, new_docs = new_ids[old_docs], new_ids[new_docs]
+            passages = [p for p, live in zip(self.passages, alive.tolist()) if live]
+            doc_passages = {k: new_ids[ids].tolist() for k, ids in self.doc_passages.items()}
+            lengths, alive = lengths[alive], np.ones(len(passages), dtype=bool)
+
+        # Interleave the two term-ordered lists; within a term, merged postings go
+        # first. A posting moves by the other list's postings of earlier terms
+        old_counts = np.bincount(old_terms, minlength=num_terms)
+        new_counts = np.bincount(new_terms, minlength=num_terms)
+        old_pos = np.arange(len(old_terms)) + (np.cumsum(new_counts) - new_counts)[old_terms]
+        new_pos = np.arange(len(new_terms)) + np.cumsum(old_counts)[new_terms]
+        post_docs = np.empty(len(old_pos) + len(new_pos), dtype=np.int32)
+        post_tfs = np.empty(len(post_docs), dtype=np.float32)
+        post_docs[old_pos], post_docs[new_pos] = old_docs, new_docs
+        post_tfs[old_pos], post_tfs[new_pos] = old_tfs, new_tfs
+        term_ptr = np.zeros(num_terms + 1, dtype=np.int64)
+        np.cumsum(old_counts + new_counts, out=term_ptr[1:])
+
+        # New lists throughout: searches still reading the old view are unaffected
+        self._segment = _Segment(term_ptr, post_docs, post_tfs, lengths, alive)
+        self.passages = list(passages)
+        self.doc_passages = doc_passages
+        self._delta = {}
+        self._delta_lengths = []
+        self._delta_alive = []
+
+    def _postings(self, view: _View, tid: int) -> Tuple[np.ndarray, np.ndarray]:
+        segment = view.segment
+        docs, tfs = np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+        if tid + 1 < len(segment.term_ptr):
+            start, end = segment.term_ptr[tid], segment.term_ptr[tid + 1]
+            docs, tfs = segment.post_docs[start:end], segment.post_tfs[start:end]
+        # Copied, then cut to the view: writers may be appending meanwhile
+        delta = [p for p in list(view.delta.get(tid, ())) if p[0] < view.count]
+        if delta:
+            delta_docs, delta_tfs = zip(*delta)
+            docs = np.concatenate([docs, np.asarray(delta_docs, dtype=np.int32)])
+            tfs = np.concatenate([tfs, np.asarray(delta_tfs, dtype=np.float32)])
+        return docs, tfs
+
+    def search(self, query: str, k: int = RETRIEVAL_TOP_K, min_score: float = RETRIEVAL_MIN_SCORE) -> List[Dict]:
+        """Top ``k`` passages for ``query`` by BM25 score"""
+        started = time.perf_counter()
+        view = self._view
+        if view is None or not view.count:
+            return []
+        term_ids = {self.vocab[t] for t in tokenize(query) if t in self.vocab}
+        if not term_ids:
+            return []
+
+        num_delta = view.count - view.segment.size
+        lengths = np.concatenate([view.segment.lengths, np.asarray(view.delta_lengths[:num_delta], dtype=np.float32)])
+        alive = np.concatenate([view.segment.alive, np.asarray(view.delta_alive[:num_delta], dtype=bool)])
+        num_live = max(int(alive.sum()), 1)
+        avg_length = float(lengths[alive].mean()) if alive.any() else 1.0
+
+        scores = np.zeros(view.count, dtype=np.float32)
+        for tid in term_ids:
+            docs, tfs = self._postings(view, tid)
+            if len(docs) == 0:
+                continue
+            # Document frequency counts not-yet-merged dead passages too
+            idf = np.log(1.0 + (num_live - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = BM25_K1 * (1.0 - BM25_B + BM25_B * lengths[docs] / avg_length)
+            scores[docs] += idf * tfs * (BM25_K1 + 1.0) / (tfs + norm)
+        scores[~alive] = 0.0
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        results = [
+            {**view.passages[pid], 'score': float(scores[pid])}
+            for pid in top if scores[pid] >= min_score
+        ]
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if elapsed_ms > RETRIEVAL_BUDGET_MS:
+            logger.warning(f"Retrieval took {elapsed_ms:.1f} ms for {view.count} passages")
+        return results
+
+    def save(self, path: Path = RETRIEVAL_INDEX_DIR) -> None:
+        """Persist the merged index (tmp dir swapped into place)"""
+        with self._save_lock:
+            # Only the merge and the snapshot hold the write lock; the files are
+            # written from the snapshot while adds and searches go on
+            with self._lock:
+                if self._delta_lengths:
+                    self._merge()
+                    self._publish()
+                segment = self._segment
+                changes = self.changes
+                meta = {
+                    'format_version': INDEX_FORMAT_VERSION,
+                    'vocab': list(self.vocab),  # In term id order
+                    'passages': list(self.passages),
+                    'doc_hashes': dict(self.doc_hashes),
+                    'doc_passages': dict(self.doc_passages),
+                    'watermarks': dict(self.watermarks),
+                }
+                alive = segment.alive.copy()
+
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_dir = Path(tempfile.mkdtemp(prefix=f'.{path.name}-', dir=path.parent))
+            np.save(tmp_dir / 'term_ptr.npy', segment.term_ptr)
+            np.save(tmp_dir / 'post_docs.npy', segment.post_docs)
+            np.save(tmp_dir / 'post_tfs.npy', segment.post_tfs)
+            np.save(tmp_dir / 'lengths.npy', segment.lengths)
+            np.save(tmp_dir / 'alive.npy', alive)
+            with open(tmp_dir / 'meta.json', 'w') as f:
+                json.dump(meta, f)
+
+            with self._lock:
+                self.changes -= changes
+            shutil.rmtree(path, ignore_errors=True)
+            try:
+                os.replace(tmp_dir, path)
+            except OSError:
+                # Another worker saved at the same time; its copy is as good
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                return
+        logger.info(f"Saved retrieval index: {len(meta['passages'])} passages, {len(meta['vocab'])} terms")
+
+    @classmethod
+    def load(cls, path: Path = RETRIEVAL_INDEX_DIR) -> Optional['RetrievalIndex']:
+        """Load a persisted index, or None if missing or from another format version"""
+        try:
+            with open(path / 'meta.json') as f:
+                meta = json.load(f)
+            if meta.get('format_version') != INDEX_FORMAT_VERSION:
+                return None
+            segment = _Segment(*(np.load(path / f'{name}.npy') for name in (
+                'term_ptr', 'post_docs', 'post_tfs', 'lengths', 'alive'
+            )))
+        except (OSError, ValueError):
+            return None
+
+        index = cls(segment)
+        index.vocab = {term: i for i, term in enumerate(meta['vocab'])}
+        index.passages = meta['passages']
+        index.doc_hashes = meta['doc_hashes']
+        index.doc_passages = meta['doc_passages']
+        index.watermarks = meta['watermarks']
+        index._publish()
+        return index
+
+
+# ============ Document builders ============
+
+def corpus_document(path: Path) -> Tuple[str, str, str]:
+    """(key, title, text) for a markdown file of the bundled corpus"""
+    text = path.read_text()
+    first_line = text.strip().splitlines()[0] if text.strip() else path.stem
+    title = first_line.lstrip('# ').strip() or path.stem
+    return f"corpus:{path.name}", title, text
+
+
+def generation_document(record: Dict) -> Tuple[str, str, str]:
+    """(key, title, text) for a generation_history record"""
+    lines = [f"Prompt: {record['prompt']}", "Generated molecules:"]
+    for result in record.get('results', []):
+        validity = "valid" if result.get('is_valid', True) else "invalid"
+        lines.append(f"- {result.get('model_name')}: {result.get('smiles')} ({validity})")
+    return f"generation:{record['id']}", f"Generation: {record['prompt'][:60]}", "\n".join(lines)
+
+
+def mol2text_document(doc: Dict) -> Tuple[str, str, str]:
+    """(key, title, text) for a cached mol2text description"""
+    title = f"Description of {doc['canonical_smiles']}"
+    text = f"SMILES: {doc['canonical_smiles']}\n{doc['description']}"
+    return f"mol2text:{doc['key']}", title, text
+
+
+_retrieval_index: Optional[RetrievalIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_retrieval_index() -> RetrievalIndex:
+    """Get the worker's index, loading the persisted copy on first use (at startup)"""
+    global _retrieval_index
+    with _index_lock:
+        if _retrieval_index is None:
+            _retrieval_index = RetrievalIndex.load() or RetrievalIndex()
+        return _retrieval_index
+
+
+def _index_corpus(index: RetrievalIndex) -> int:
+    files = sorted(KNOWLEDGE_CORPUS_DIR.glob('*.md')) if KNOWLEDGE_CORPUS_DIR.exists() else []
+    added = 0
+    for path in files:
+        added += index.add_document(*corpus_document(path), source='knowledge_base')
+    present = {f"corpus:{path.name}" for path in files}
+    for key in [k for k in index.doc_hashes if k.startswith('corpus:') and k not in present]:
+        index.remove_document(key)
+    return added
+
+
+async def _backfill(db, index: RetrievalIndex, collection: str, builder, source: str) -> int:
+    """Index documents of ``collection`` created after its watermark"""
+    watermark = parse_timestamp(index.watermarks.get(collection))
+    query = timestamp_range("created_at", {"$gt": watermark}) if watermark else {}
+    cursor = db[collection].find(query, {"_id": 0}).sort("created_at", 1)
+    added = 0
+    batch, created_at = [], None
+    async for doc in cursor:
+        batch.append(builder(doc))
+        created_at = parse_timestamp(doc.get('created_at')) or created_at
+        if len(batch) == BACKFILL_BATCH:
+            # Tokenizing runs in a thread, so requests are served meanwhile
+            added += await asyncio.to_thread(index.add_documents, batch, source)
+            if created_at:
+                index.watermarks[collection] = created_at.isoformat()
+            batch = []
+    if batch:
+        added += await asyncio.to_thread(index.add_documents, batch, source)
+        if created_at:
+            index.watermarks[collection] = created_at.isoformat()
+    return added
+
+
+async def build_retrieval_index(db, index: RetrievalIndex) -> RetrievalIndex:
+    """Bring the index up to date with the corpus and the database"""
+    added = await asyncio.to_thread(_index_corpus, index)
+    try:
+        added += await _backfill(db, index, 'generation_history', generation_document, 'generation_history')
+        added += await _backfill(db, index, 'mol2text_cache', mol2text_document, 'mol2text')
+    except Exception as e:
+        logger.warning(f"Retrieval index backfill failed: {e}")
+    if index.changes:
+        await asyncio.to_thread(index.save)
+    logger.info(f"Retrieval index ready: {index.num_passages} passages ({added} new documents)")
+    return index
+
+
+async def index_document(index: RetrievalIndex, key: str, title: str, text: str, source: str) -> None:
+    """Add one document as it is created (in a thread), saving now and then"""
+    await asyncio.to_thread(index.add_document, key, title, text, source)
+    if index.changes >= AUTOSAVE_CHANGES and not index._save_lock.locked():
+        await asyncio.to_thread(index.save)
+
+
+def save_retrieval_index(index: RetrievalIndex) -> None:
+    """Persist pending changes (called on shutdown)"""
+    if index.changes:
+        index.save()
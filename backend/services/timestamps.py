@@ -0,0 +1,35 @@
+"""
+Timestamps
+
+Timestamps are stored as native BSON dates (UTC). Documents written before
+that stored ISO 8601 strings, and until migration 4 has rewritten them both
+forms can be present. Range queries must then match both, since MongoDB
+compares values only within the same BSON type.
+"""
+
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+
+def parse_timestamp(value: Any) -> Optional[datetime]:
+    """A stored timestamp (date or legacy ISO string) as an aware UTC datetime"""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def timestamp_range(field: str, bounds: Dict[str, datetime]) -> Dict:
+    """
+    Query for ``field`` within ``bounds`` (e.g. {'$gte': start, '$lt': end}),
+    matching both dates and legacy ISO strings.
+    """
+    bounds = {op: parse_timestamp(value) for op, value in bounds.items()}
+    return {'$or': [
+        {field: bounds},
+        {field: {op: value.isoformat() for op, value in bounds.items()}},
+    ]}
@@ -374,11 +374,11 @@ class MoleculeAPITester:
                 print(f"✅ Binding affinity: {response['affinity']} kcal/mol")
             if 'ligand_pdb' in response and response['ligand_pdb']:
                 print(f"✅ Ligand PDB data received (length: {len(response['ligand_pdb'])} chars)")
-            if 'target_pdb' in response and response['target_pdb']:
-                print(f"✅ Target PDB data received (length: {len(response['target_pdb'])} chars)")
+            if 'target_version' in response:
+                print(f"✅ Target {response.get('target_id')} version: {response['target_version'][:12]}")
             if 'score_breakdown' in response:
                 breakdown = response['score_breakdown']
-                print(f"✅ Score breakdown: VdW={breakdown.get('van_der_waals')}, Elec={breakdown.get('electrostatic')}")
+                print(f"✅ Score breakdown: Steric={breakdown.get('steric')}, HBond={breakdown.get('hydrogen_bond')}")
         
         return success, response
 
@@ -13,6 +13,7 @@ import { cn } from '@/lib/utils';
 interface ChatMessage {
   role: 'user' | 'assistant';
   content: string;
+  model?: string | null;
   sources?: string[];
 }
 
@@ -22,6 +23,7 @@ export function KnowledgePage() {
     { role: 'assistant', content: "Hello! I'm your molecular assistant. Ask me about chemical structures, properties, or synthesis methods." },
   ]);
   const [loading, setLoading] = useState(false);
+  const [streaming, setStreaming] = useState(false);
   const [sessionId, setSessionId] = useState<string | null>(null);
   const scrollRef = useRef<HTMLDivElement>(null);
 
@@ -33,20 +35,32 @@ export function KnowledgePage() {
     setQuery('');
     setLoading(true);
 
+    // Replace the in-progress assistant message (the last one) as tokens arrive
+    let started = false;
+    const updateAnswer = (update: (msg: ChatMessage) => ChatMessage) =>
+      setMessages((prev) => [...prev.slice(0, -1), update(prev[prev.length - 1])]);
+
     try {
-      const res = await knowledgeApi.chat({ query: userMsg.content, session_id: sessionId || undefined });
+      const res = await knowledgeApi.chatStream(
+        { query: userMsg.content, session_id: sessionId || undefined },
+        (token) => {
+          if (!started) {
+            started = true;
+            setStreaming(true);
+            setMessages((prev) => [...prev, { role: 'assistant', content: token }]);
+          } else {
+            updateAnswer((msg) => ({ ...msg, content: msg.content + token }));
+          }
+        },
+      );
       if (!sessionId) setSessionId(res.session_id);
-      const botMsg: ChatMessage = {
-        role: 'assistant',
-        content: res.answer,
-        sources: res.sources,
-      };
-      setMessages((prev) => [...prev, botMsg]);
+      updateAnswer((msg) => ({ ...msg, model: res.model, sources: res.sources }));
     } catch (e) {
       toast.error('Failed to get answer');
       setMessages((prev) => [...prev, { role: 'assistant', content: 'Sorry, I encountered an error retrieving that information.' }]);
     } finally {
       setLoading(false);
+      setStreaming(false);
     }
   };
 
@@ -112,9 +126,14 @@ export function KnowledgePage() {
                   )}
                 >
                   <p className="whitespace-pre-wrap">{msg.content}</p>
-                  {msg.sources && msg.sources.length > 0 && (
+                  {(msg.model || (msg.sources && msg.sources.length > 0)) && (
                     <div className="mt-3 pt-3 border-t border-border/20 flex flex-wrap gap-2">
-                      {msg.sources.map((src, i) => (
+                      {msg.model && (
+                        <span className="text-[10px] bg-background/20 px-2 py-1 rounded-full opacity-80">
+                          Model: {msg.model}
+                        </span>
+                      )}
+                      {msg.sources?.map((src, i) => (
                         <span key={i} className="text-[10px] bg-background/20 px-2 py-1 rounded-full opacity-80">
                           Source: {src}
                         </span>
@@ -125,7 +144,7 @@ export function KnowledgePage() {
               </motion.div>
             ))}
 
-            {loading && (
+            {loading && !streaming && (
               <motion.div initial={{ opacity: 0 }} animate={{ opacity: 1 }} className="flex gap-4 max-w-3xl">
                 <div className="w-8 h-8 rounded-full bg-muted flex items-center justify-center flex-shrink-0">
                   <Bot className="w-4 h-4 text-muted-foreground" />
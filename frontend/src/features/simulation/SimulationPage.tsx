@@ -23,11 +23,12 @@ const TARGETS = [
 interface DockingResult {
   affinity: number;
   ligand_pdb: string;
-  target_pdb: string;
+  target_id: string;
+  target_version: string;
   score_breakdown: {
-    van_der_waals: number;
-    electrostatic: number;
-    desolvation: number;
+    steric: number;
+    hydrophobic: number;
+    hydrogen_bond: number;
   };
 }
 
@@ -273,9 +274,9 @@ export function SimulationPage() {
                 </h3>
                 <div className="space-y-4">
                   {[
-                    { label: 'Van der Waals', value: result.score_breakdown.van_der_waals, color: 'bg-blue-500' },
-                    { label: 'Electrostatic', value: result.score_breakdown.electrostatic, color: 'bg-purple-500' },
-                    { label: 'Desolvation', value: result.score_breakdown.desolvation, color: 'bg-orange-500' },
+                    { label: 'Steric', value: result.score_breakdown.steric, color: 'bg-blue-500' },
+                    { label: 'Hydrogen Bond', value: result.score_breakdown.hydrogen_bond, color: 'bg-purple-500' },
+                    { label: 'Hydrophobic', value: result.score_breakdown.hydrophobic, color: 'bg-orange-500' },
                   ].map((item) => (
                     <div key={item.label}>
                       <div className="flex justify-between text-sm mb-1">
@@ -7,8 +7,15 @@ import type {
   ChatResponse,
   Mol2TextRequest,
   Mol2TextResponse,
+  Mol2TextBatchRequest,
+  Mol2TextBatchResult,
+  Mol2TextBatchSummary,
   Experiment,
   ExperimentCreate,
+  GenerationLineage,
+  HistoryQuery,
+  ModelStats,
+  Page,
 } from './types';
 
 // Get API base URL from environment
@@ -46,6 +53,11 @@ export const moleculesApi = {
     return response.data;
   },
 
+  getHistoryPage: async (query: HistoryQuery = {}): Promise<Page<GenerationRecord>> => {
+    const response = await api.get<GenerationRecord[]>('/api/molecules/history', { params: query });
+    return { items: response.data, nextCursor: response.headers['x-next-cursor'] };
+  },
+
   get3DStructure: async (smiles: string): Promise<Structure3DResponse> => {
     const response = await api.get<Structure3DResponse>('/api/molecules/3d', {
       params: { smiles },
@@ -61,6 +73,20 @@ export const moleculesApi = {
     const response = await api.post<GenerationRecord>(`/api/molecules/regenerate/${recordId}`, { models });
     return response.data;
   },
+
+  getLineage: async (recordId: string, maxDepth?: number): Promise<GenerationLineage> => {
+    const response = await api.get<GenerationLineage>(`/api/molecules/history/${recordId}/lineage`, {
+      params: maxDepth ? { max_depth: maxDepth } : {},
+    });
+    return response.data;
+  },
+
+  getModelStats: async (experimentId?: string): Promise<ModelStats[]> => {
+    const response = await api.get<ModelStats[]>('/api/molecules/analytics/models', {
+      params: experimentId ? { experiment_id: experimentId } : {},
+    });
+    return response.data;
+  },
 };
 
 // ============ Knowledge API ============
@@ -70,11 +96,116 @@ export const knowledgeApi = {
     return response.data;
   },
 
+  // Streams the answer over Server-Sent Events; onToken is called as text arrives
+  chatStream: async (
+    request: ChatRequest,
+    onToken: (token: string) => void,
+    signal?: AbortSignal,
+  ): Promise<ChatResponse> => {
+    const response = await fetch(`${getBaseUrl()}/api/knowledge/chat/stream`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify(request),
+      signal,
+    });
+    if (!response.ok || !response.body) {
+      throw new Error(`Chat failed (${response.status})`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    const result: ChatResponse = { answer: '', session_id: request.session_id || '', sources: [] };
+    let buffer = '';
+
+    for (;;) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      // Events are separated by a blank line
+      let boundary = buffer.indexOf('\n\n');
+      while (boundary !== -1) {
+        const raw = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+        boundary = buffer.indexOf('\n\n');
+
+        const event = raw.match(/^event: (.*)$/m)?.[1];
+        const data = raw.match(/^data: (.*)$/m)?.[1];
+        if (!event || !data) continue;
+        const payload = JSON.parse(data);
+
+        if (event === 'session') {
+          result.session_id = payload.session_id;
+        } else if (event === 'token') {
+          result.answer += payload.content;
+          onToken(payload.content);
+        } else if (event === 'done') {
+          result.model = payload.model;
+          result.sources = payload.sources;
+        } else if (event === 'error') {
+          throw new Error(payload.detail);
+        }
+      }
+    }
+    return result;
+  },
+
   mol2text: async (request: Mol2TextRequest): Promise<Mol2TextResponse> => {
     const response = await api.post<Mol2TextResponse>('/api/knowledge/mol2text', request);
     return response.data;
   },
 
+  mol2textBatch: async (
+    request: Mol2TextBatchRequest,
+    onResult: (result: Mol2TextBatchResult) => void,
+    signal?: AbortSignal,
+  ): Promise<Mol2TextBatchSummary> => {
+    const response = await fetch(`${getBaseUrl()}/api/knowledge/mol2text/batch`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify(request),
+      signal,
+    });
+    if (!response.ok || !response.body) {
+      throw new Error(`Mol2Text batch failed (${response.status})`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let summary: Mol2TextBatchSummary | null = null;
+    let buffer = '';
+
+    for (;;) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      let boundary = buffer.indexOf('\n\n');
+      while (boundary !== -1) {
+        const raw = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+        boundary = buffer.indexOf('\n\n');
+
+        const event = raw.match(/^event: (.*)$/m)?.[1];
+        const data = raw.match(/^data: (.*)$/m)?.[1];
+        if (!event || !data) continue;
+        const payload = JSON.parse(data);
+
+        if (event === 'result') {
+          onResult(payload);
+        } else if (event === 'done') {
+          summary = payload;
+        } else if (event === 'error') {
+          throw new Error(payload.detail);
+        }
+      }
+    }
+    if (!summary) {
+      throw new Error('Mol2Text batch ended early');
+    }
+    return summary;
+  },
+
   getAvailableModels: async (): Promise<Record<string, unknown>> => {
     const response = await api.get('/api/knowledge/models/available');
     return response.data;
@@ -103,6 +234,11 @@ export const experimentsApi = {
     return response.data;
   },
 
+  getRunsPage: async (id: string, query: HistoryQuery = {}): Promise<Page<GenerationRecord>> => {
+    const response = await api.get<GenerationRecord[]>(`/api/experiments/${id}/runs`, { params: query });
+    return { items: response.data, nextCursor: response.headers['x-next-cursor'] };
+  },
+
   generateInExperiment: async (experimentId: string, request: GenerateRequest): Promise<GenerationRecord> => {
     const response = await api.post<GenerationRecord>(`/api/experiments/${experimentId}/generate`, request);
     return response.data;
@@ -118,6 +254,14 @@ export const simulationApi = {
     });
     return response.data;
   },
+
+  getTarget: async (targetId: string, pocketRadius?: number): Promise<string> => {
+    const response = await api.get<string>(`/api/simulation/targets/${targetId}`, {
+      params: pocketRadius ? { pocket_radius: pocketRadius } : undefined,
+      responseType: 'text',
+    });
+    return response.data;
+  },
 };
 
 export default api;
@@ -27,6 +27,14 @@ export interface ChatRequest {
 export interface Mol2TextRequest {
   smiles: string;
   additional_info?: string;
+  force_refresh?: boolean;
+}
+
+export interface Mol2TextBatchRequest {
+  smiles: string[];
+  additional_info?: string;
+  force_refresh?: boolean;
+  max_concurrency?: number;
 }
 
 // ============ API Response Types ============
@@ -46,12 +54,30 @@ export interface GenerationRecord {
   experiment_id?: string;
   created_at: string;
   updated_at?: string;
+  parent_id?: string | null; // Record this one was regenerated from
+  root_id?: string | null;
+}
+
+// Regeneration tree of a record
+export interface LineageVersion extends Omit<GenerationRecord, 'created_at'> {
+  created_at: string | null; // Null if missing or unreadable in the stored record
+  depth: number; // Regenerations below the root
+}
+
+export interface GenerationLineage {
+  record_id: string;
+  root_id: string;
+  truncated: boolean;
+  versions: LineageVersion[];
+  // Per model, its result in each version (aligned with versions)
+  comparison: Record<string, (SingleModelResult | null)[]>;
 }
 
 export interface ChatResponse {
   answer: string;
   session_id: string;
-  sources: string[];
+  model?: string | null; // Model that answered
+  sources: string[]; // Titles of the retrieved passages
 }
 
 export interface Mol2TextResponse {
@@ -59,12 +85,62 @@ export interface Mol2TextResponse {
   description: string;
   success: boolean;
   error?: string;
+  cached?: boolean;
+  model?: string | null; // Model that wrote the description
+}
+
+export interface Mol2TextBatchResult extends Mol2TextResponse {
+  indices: number[];
+}
+
+export interface Mol2TextBatchSummary {
+  requested: number;
+  unique: number;
+  cached: number;
+  generated: number;
+  failed: number;
+}
+
+// Keyset-paginated listings: pass nextCursor back as cursor for the next page
+export interface Page<T> {
+  items: T[];
+  nextCursor?: string;
+}
+
+export interface HistoryQuery {
+  limit?: number;
+  cursor?: string;
+  model?: string;
+  valid?: boolean;
+  created_after?: string;
+  created_before?: string;
 }
 
 export interface Structure3DResponse {
   sdf: string;
 }
 
+// Per-model analytics; latency in seconds
+export interface LatencyBucket {
+  le: number | null; // Upper bound; null for the last, open bucket
+  count: number;
+}
+
+export interface ModelStats {
+  model_name: string;
+  experiment_id: string | null;
+  count: number;
+  valid_count: number;
+  validity_rate: number;
+  avg_confidence: number;
+  avg_execution_time: number;
+  min_execution_time: number;
+  max_execution_time: number;
+  latency_percentiles: Record<'p50' | 'p90' | 'p95' | 'p99', number>;
+  latency_histogram: LatencyBucket[];
+  last_generated_at: string | null;
+}
+
 // ============ Experiment Types ============
 export interface Experiment {
   id: string;
@@ -89,11 +165,12 @@ export interface DockingRequest {
 export interface DockingResult {
   affinity: number;
   ligand_pdb: string;
-  target_pdb: string;
+  target_id: string;
+  target_version: string;
   score_breakdown: {
-    van_der_waals: number;
-    electrostatic: number;
-    desolvation: number;
+    steric: number;
+    hydrophobic: number;
+    hydrogen_bond: number;
   };
 }
 